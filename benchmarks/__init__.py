@@ -0,0 +1,33 @@
+"""
+Benchmarks for the API. Run them from the repository root, for example:
+
+    python -m benchmarks.favorites_lookup
+
+Every benchmark works on its own throwaway database and prints its results
+as JSON.
+"""
+import json
+import os
+import sys
+import tempfile
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+if SRC_DIR not in sys.path:
+    sys.path.insert(0, SRC_DIR)
+
+
+def create_app(database_url=None):
+    # The app reads DATABASE_URL at import time, so this must run before `import app`
+    if database_url is None:
+        database_url = 'sqlite:///' + os.path.join(tempfile.mkdtemp(prefix='swapi-bench-'), 'bench.db')
+    os.environ['DATABASE_URL'] = database_url
+
+    from app import app
+    from models import db
+    with app.app_context():
+        db.create_all()
+    return app
+
+
+def report(results):
+    print(json.dumps(results, indent=2, default=str))
@@ -0,0 +1,115 @@
+"""
+Memory per row, load time and lookup latency of the in-memory catalog snapshot
+
+    python -m benchmarks.catalog_snapshot --planets 10000 --characters 100000 --requests 2000
+
+Memory is what tracemalloc sees allocated by a load_snapshot() call, split
+into the JSON bytes, the id arrays and the name indexes. Latency compares the
+same GET /planets/<id>, /characters/<id> and first list page served from the
+snapshot and from the database (catalog cache cleared before every request),
+through the Flask test client.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+from benchmarks import create_app, report
+from benchmarks.concurrency import percentile
+from benchmarks.datagen import generate
+
+
+def table_bytes(table):
+    """Bytes of each structure of a CatalogTable."""
+    bodies = sys.getsizeof(table.bodies) + sum(sys.getsizeof(body) for body in table.bodies)
+    ids = sys.getsizeof(table.ids)
+    names = sys.getsizeof(table.names) + sum(sys.getsizeof(name) for name in table.names) \
+        + sys.getsizeof(table.name_positions)
+    return {'json': bodies, 'ids': ids, 'name_index': names}
+
+
+def latency_us(client, paths, clear):
+    latencies = []
+    for path in paths:
+        clear()
+        started = time.perf_counter()
+        response = client.get(path, headers={'Accept-Encoding': 'identity'})
+        response.get_data()
+        latencies.append((time.perf_counter() - started) * 1e6)
+        assert response.status_code == 200, (path, response.status_code)
+    return {'p50': round(percentile(latencies, 0.5), 1), 'p99': round(percentile(latencies, 0.99), 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--planets', type=int, default=10000)
+    parser.add_argument('--characters', type=int, default=100000)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    os.environ['CATALOG_SNAPSHOT'] = '1'
+    app = create_app()
+    import catalog_snapshot
+    from models import db
+    from cache import catalog_cache
+
+    with app.app_context():
+        generate(db, args.planets, args.characters, 0, 0, args.seed)
+        with db.engine.connect() as connection:
+            started = time.perf_counter()
+            catalog_snapshot.load_snapshot(connection)
+            load_seconds = time.perf_counter() - started
+            # A second load under tracemalloc, which slows it down
+            tracemalloc.start()
+            snapshot = catalog_snapshot.load_snapshot(connection)
+            allocated, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+    rows = len(snapshot.planets) + len(snapshot.characters)
+    memory = {}
+    for name, table in (('planets', snapshot.planets), ('characters', snapshot.characters)):
+        parts = table_bytes(table)
+        memory[name] = {
+            'rows': len(table),
+            'bytes_per_row': round(sum(parts.values()) / max(len(table), 1), 1),
+            **{f'{part}_bytes_per_row': round(size / max(len(table), 1), 1) for part, size in parts.items()},
+        }
+
+    rng = random.Random(args.seed)
+    paths = {
+        'planet': [f'/planets/{rng.randint(1, args.planets)}' for _ in range(args.requests)],
+        'character': [f'/characters/{rng.randint(1, args.characters)}' for _ in range(args.requests)],
+        'characters_page': ['/characters?limit=100'] * args.requests,
+    }
+
+    client = app.test_client()
+    engine = catalog_snapshot._engine
+    latency = {}
+    for name, route_paths in paths.items():
+        def clear():
+            catalog_cache.clear('planets')
+            catalog_cache.clear('characters')
+
+        catalog_snapshot._engine = engine
+        snapshot_latency = latency_us(client, route_paths, clear)
+        catalog_snapshot._engine = None
+        database_latency = latency_us(client, route_paths, clear)
+        latency[name] = {'snapshot_us': snapshot_latency, 'database_us': database_latency}
+    catalog_snapshot._engine = engine
+
+    report({
+        'benchmark': 'catalog_snapshot',
+        'planets': args.planets,
+        'characters': args.characters,
+        'load_seconds': round(load_seconds, 3),
+        'tracemalloc_bytes_per_row': round(allocated / max(rows, 1), 1),
+        'tracemalloc_peak_mb': round(peak / 2 ** 20, 1),
+        'memory': memory,
+        'latency': latency,
+    })
+
+
+if __name__ == '__main__':
+    main()
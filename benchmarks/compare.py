@@ -0,0 +1,72 @@
+"""
+Compare two benchmarks.routes reports route by route
+
+    python -m benchmarks.compare before.json after.json --threshold 10
+
+Exits with status 1 when the p95 latency or the queries per request of any
+route got worse by more than --threshold percent.
+"""
+import argparse
+import json
+import sys
+from benchmarks import report
+
+METRICS = ('p95_ms', 'queries_per_request')
+
+
+def change_percent(before, after):
+    if before in (None, 0) or after is None:
+        return None
+    return round((after - before) / before * 100, 1)
+
+
+def compare(before, after, threshold):
+    rows = []
+    for mode in ('client', 'server'):
+        if mode not in before or mode not in after:
+            continue
+        for route, new in after[mode]['routes'].items():
+            old = before[mode]['routes'].get(route)
+            if old is None:
+                continue
+            for metric in METRICS:
+                change = change_percent(old.get(metric), new.get(metric))
+                rows.append({
+                    'mode': mode,
+                    'route': route,
+                    'metric': metric,
+                    'before': old.get(metric),
+                    'after': new.get(metric),
+                    'change_percent': change,
+                    'regression': change is not None and change > threshold,
+                })
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('before')
+    parser.add_argument('after')
+    parser.add_argument('--threshold', type=float, default=10.0, help='percent')
+    args = parser.parse_args()
+
+    with open(args.before) as file:
+        before = json.load(file)
+    with open(args.after) as file:
+        after = json.load(file)
+
+    rows = compare(before, after, args.threshold)
+    regressions = [row for row in rows if row['regression']]
+    report({
+        'benchmark': 'compare',
+        'before': before.get('commit'),
+        'after': after.get('commit'),
+        'threshold_percent': args.threshold,
+        'regressions': regressions,
+        'changes': rows,
+    })
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""
+Bytes on the wire and CPU per request for each encoding and response shape
+
+    python -m benchmarks.compression --characters 10000 --limit 100 --requests 200
+
+Calls the list endpoints through the Flask test client with every available
+Accept-Encoding, for the default object shape and ?shape=columns. CPU time is
+the process time per request, with the precompressed body cache warm (repeated
+hits on the same ETag) and cold (cleared before every request); compress_us is
+the encoder alone on the identity body.
+"""
+import argparse
+import time
+from benchmarks import create_app, report
+from benchmarks.datagen import generate
+
+
+def cpu_us(function, repeat):
+    started = time.process_time()
+    for _ in range(repeat):
+        function()
+    return round((time.process_time() - started) / repeat * 1e6, 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--planets', type=int, default=1000)
+    parser.add_argument('--characters', type=int, default=10000)
+    parser.add_argument('--limit', type=int, default=100)
+    parser.add_argument('--requests', type=int, default=200)
+    args = parser.parse_args()
+
+    app = create_app()
+    from models import db
+    from compression import compressed_bodies
+
+    with app.app_context():
+        generate(db, args.planets, args.characters, 0, 0)
+
+    client = app.test_client()
+    encoders = app.extensions.get('compression', {})
+    encodings = ['identity'] + list(encoders)
+    results = {
+        'benchmark': 'compression',
+        'planets': args.planets,
+        'characters': args.characters,
+        'limit': args.limit,
+        'min_size': app.config['COMPRESSION_MIN_SIZE'],
+        'routes': {},
+    }
+
+    for resource in ('planets', 'characters'):
+        for shape in ('objects', 'columns'):
+            path = f'/{resource}?limit={args.limit}&shape={shape}'
+            rows = {}
+            identity = client.get(path, headers={'Accept-Encoding': 'identity'}).get_data()
+            for encoding in encodings:
+                headers = {'Accept-Encoding': encoding}
+
+                def request():
+                    response = client.get(path, headers=headers)
+                    response.get_data()
+                    return response
+
+                response = request()
+                assert response.headers.get('Content-Encoding', 'identity') == encoding, encoding
+
+                def cold():
+                    compressed_bodies.clear()
+                    request()
+
+                rows[encoding] = {
+                    'bytes': len(response.get_data()),
+                    'compress_us': cpu_us(lambda: encoders[encoding][0](identity), args.requests)
+                    if encoding in encoders else 0.0,
+                    'cpu_us_per_request': cpu_us(request, args.requests),
+                    'cpu_us_per_request_uncached': cpu_us(cold, args.requests),
+                }
+            results['routes'][path] = rows
+
+    report(results)
+
+
+if __name__ == '__main__':
+    main()
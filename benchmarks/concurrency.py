@@ -0,0 +1,151 @@
+"""
+Throughput of the read endpoints under concurrent clients, sync vs async serving
+
+    python -m benchmarks.concurrency --workers 2 --clients 32 --seconds 10
+
+Starts the Flask app under gunicorn sync workers (wsgi:application, as in the
+Procfile) and the ASGI app under uvicorn (asgi:application) against the same
+local SQLite database, then hits both with the same mix of GET requests.
+"""
+import argparse
+import http.client
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+from benchmarks import SRC_DIR, create_app, report
+from benchmarks.datagen import generate
+
+SERVERS = {
+    'sync': lambda port, workers: [sys.executable, '-m', 'gunicorn', 'wsgi', '--chdir', SRC_DIR,
+                                   '--workers', str(workers), '--bind', f'127.0.0.1:{port}', '--log-level', 'warning'],
+    'async': lambda port, workers: [sys.executable, '-m', 'uvicorn', 'asgi:application', '--app-dir', SRC_DIR,
+                                    '--workers', str(workers), '--port', str(port), '--log-level', 'warning',
+                                    '--no-access-log'],
+}
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_until_ready(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            connection.request('GET', '/planets?limit=1')
+            if connection.getresponse().status == 200:
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f'The server on port {port} did not start')
+
+
+def make_paths(planets, characters, users):
+    return [
+        '/planets?limit=20',
+        '/characters?limit=20',
+        '/characters?limit=20&sort=-height&fields=id,name,height',
+        f'/planets/{random.randint(1, planets)}',
+        f'/characters/{random.randint(1, characters)}',
+        f'/favorites/{random.randint(1, users)}',
+    ]
+
+
+def run_clients(port, clients, seconds, paths_for):
+    latencies = []
+    errors = []
+    deadline = time.monotonic() + seconds
+
+    def client():
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        while time.monotonic() < deadline:
+            path = random.choice(paths_for())
+            started = time.perf_counter()
+            try:
+                connection.request('GET', path)
+                response = connection.getresponse()
+                response.read()
+                if response.status != 200:
+                    errors.append(response.status)
+                if response.getheader('Connection', '').lower() == 'close':
+                    connection.close()
+            except (OSError, http.client.HTTPException) as error:
+                errors.append(type(error).__name__)
+                connection.close()
+                continue
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--planets', type=int, default=1000)
+    parser.add_argument('--characters', type=int, default=10000)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--favorites', type=int, default=20, help='favorites per user')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--clients', type=int, default=32)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--modes', default='sync,async')
+    args = parser.parse_args()
+
+    app = create_app()
+    from models import db
+
+    with app.app_context():
+        generate(db, args.planets, args.characters, args.users, args.users * args.favorites)
+
+    environment = dict(os.environ, DATABASE_URL=app.config['SQLALCHEMY_DATABASE_URI'])
+    results = {
+        'benchmark': 'concurrency',
+        'planets': args.planets,
+        'characters': args.characters,
+        'users': args.users,
+        'workers': args.workers,
+        'clients': args.clients,
+        'seconds': args.seconds,
+    }
+
+    for mode in args.modes.split(','):
+        port = free_port()
+        server = subprocess.Popen(SERVERS[mode](port, args.workers), env=environment)
+        try:
+            wait_until_ready(port)
+            latencies, errors = run_clients(
+                port, args.clients, args.seconds, lambda: make_paths(args.planets, args.characters, args.users))
+        finally:
+            server.terminate()
+            server.wait()
+
+        results[mode] = {
+            'requests': len(latencies),
+            'errors': len(errors),
+            'requests_per_second': round(len(latencies) / args.seconds, 1),
+            'p50_ms': round(percentile(latencies, 0.50), 2) if latencies else None,
+            'p95_ms': round(percentile(latencies, 0.95), 2) if latencies else None,
+            'p99_ms': round(percentile(latencies, 0.99), 2) if latencies else None,
+        }
+
+    report(results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,171 @@
+"""
+Synthetic SWAPI-shaped dataset at any scale
+
+    python -m benchmarks.datagen --database-url sqlite:////tmp/swapi-1m.db \\
+        --planets 10000 --characters 1000000 --users 100000 --favorites 10000000
+
+Rows are inserted through the tables of the models in batches of executemany
+INSERTs, and the same --seed always gives the same data. Bulk inserts skip the
+mapper events, so the search index, resident counts, table versions, caches
+and favorites snapshots are refreshed once at the end.
+"""
+import argparse
+import random
+import time
+from benchmarks import create_app, report
+
+SYLLABLES = ['ta', 'too', 'ine', 'ko', 'rus', 'cant', 'na', 'bo', 'o', 'hoth', 'da', 'go', 'bah', 'en', 'dor',
+             'ka', 'shyy', 'yk', 'mus', 'ta', 'far', 'lu', 'ke', 'sky', 'wal', 'ker', 'le', 'ia', 'or', 'ga']
+TERRAINS = ['desert', 'grasslands', 'mountains', 'jungle', 'ocean', 'tundra', 'swamp', 'forests', 'cityscape']
+CLIMATES = ['arid', 'temperate', 'tropical', 'frozen', 'murky', 'humid']
+GENDERS = ['male', 'female', 'n/a', 'hermaphrodite']
+HAIR_COLORS = ['blond', 'brown', 'black', 'auburn', 'white', 'grey', 'none', 'n/a']
+EYE_COLORS = ['blue', 'brown', 'yellow', 'red', 'hazel', 'black', 'orange', 'unknown']
+SKIN_COLORS = ['fair', 'gold', 'white, blue', 'light', 'green', 'pale', 'dark', 'metal']
+
+BATCH_SIZE = 10000
+
+
+def make_name(rng, index):
+    parts = [rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))]
+    return ''.join(parts).capitalize() + f' {index}'
+
+
+def _unknown(rng, value, share=0.1):
+    # SWAPI has "unknown" for part of every measurement
+    return None if rng.random() < share else value
+
+
+def planet_rows(rng, count):
+    for index in range(1, count + 1):
+        yield {
+            'id': index,
+            'name': make_name(rng, index),
+            'climate': rng.choice(CLIMATES),
+            'terrain': rng.choice(TERRAINS),
+            'diameter': _unknown(rng, rng.randint(2000, 120000)),
+            'rotation_period': str(rng.randint(10, 60)),
+            'orbital_period': str(rng.randint(200, 5000)),
+            'gravity': _unknown(rng, round(rng.uniform(0.1, 3.0), 2)),
+            'population': _unknown(rng, rng.randint(1, 10 ** 12), share=0.3),
+        }
+
+
+def character_rows(rng, count, planets):
+    for index in range(1, count + 1):
+        yield {
+            'id': index,
+            'name': make_name(rng, index),
+            'birth_year': _unknown(rng, f'{rng.randint(1, 900)}BBY'),
+            'gender': rng.choice(GENDERS),
+            'height': _unknown(rng, rng.randint(60, 260)),
+            'mass': _unknown(rng, round(rng.uniform(15, 160), 1), share=0.2),
+            'hair_color': rng.choice(HAIR_COLORS),
+            'eye_color': rng.choice(EYE_COLORS),
+            'skin_color': rng.choice(SKIN_COLORS),
+            'home_world_id': rng.randint(1, planets) if planets else None,
+        }
+
+
+def user_rows(count):
+    for index in range(1, count + 1):
+        yield {'id': index, 'email': f'user{index}@example.com', 'password': 'x', 'is_active': True}
+
+
+def favorite_rows(rng, users, total, items, key):
+    # The same number of distinct items per user, the remainder to the first users
+    if not users or not items:
+        return
+    per_user, remainder = divmod(total, users)
+    for user_id in range(1, users + 1):
+        count = min(items, per_user + (1 if user_id <= remainder else 0))
+        for item_id in rng.sample(range(1, items + 1), count):
+            yield {'user_id': user_id, key: item_id}
+
+
+def insert_batches(connection, table, rows, batch_size=BATCH_SIZE):
+    batch = []
+    inserted = 0
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            connection.execute(table.insert(), batch)
+            inserted += len(batch)
+            batch = []
+    if batch:
+        connection.execute(table.insert(), batch)
+        inserted += len(batch)
+    return inserted
+
+
+def generate(db, planets, characters, users, favorites, seed=0, batch_size=BATCH_SIZE):
+    """Fill an empty database; `favorites` is split evenly between planets and characters."""
+    from models import User, Planet, Character, FavoritePlanet, FavoriteCharacter
+    from favorites import refresh_snapshots
+    from importer import refresh_after_bulk_load
+
+    rng = random.Random(seed)
+    timings = {}
+    with db.engine.begin() as connection:
+        for name, table, rows in (
+            ('planets', Planet.__table__, planet_rows(rng, planets)),
+            ('characters', Character.__table__, character_rows(rng, characters, planets)),
+            ('users', User.__table__, user_rows(users)),
+            ('favorite_planets', FavoritePlanet.__table__,
+             favorite_rows(rng, users, favorites // 2, planets, 'planet_id')),
+            ('favorite_characters', FavoriteCharacter.__table__,
+             favorite_rows(rng, users, favorites - favorites // 2, characters, 'character_id')),
+        ):
+            started = time.perf_counter()
+            insert_batches(connection, table, rows, batch_size)
+            timings[f'{name}_seconds'] = round(time.perf_counter() - started, 2)
+
+        started = time.perf_counter()
+        refresh_after_bulk_load(connection)
+        timings['search_index_seconds'] = round(time.perf_counter() - started, 2)
+
+    # Served by GET /favorites/<user_id> with one lookup
+    started = time.perf_counter()
+    refresh_snapshots()
+    timings['favorites_snapshots_seconds'] = round(time.perf_counter() - started, 2)
+    return timings
+
+
+def is_empty(db):
+    from models import Planet
+    return db.session.query(Planet.id).first() is None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--database-url', default=None, help='default: a new SQLite file in a temp directory')
+    parser.add_argument('--planets', type=int, default=10000)
+    parser.add_argument('--characters', type=int, default=100000)
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--favorites', type=int, default=200000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    args = parser.parse_args()
+
+    app = create_app(args.database_url)
+    from models import db
+
+    with app.app_context():
+        if not is_empty(db):
+            parser.error('the database already has data')
+        timings = generate(db, args.planets, args.characters, args.users, args.favorites, args.seed, args.batch_size)
+
+    report({
+        'benchmark': 'datagen',
+        'database': app.config['SQLALCHEMY_DATABASE_URI'],
+        'planets': args.planets,
+        'characters': args.characters,
+        'users': args.users,
+        'favorites': args.favorites,
+        'seed': args.seed,
+        **timings,
+    })
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""
+Per-user favorites lookup as the favorites tables grow
+
+Every user keeps the same number of favorites, so a lookup that uses the
+(user_id, planet_id) index should cost about the same at every size, while a
+table scan grows linearly.
+
+    python -m benchmarks.favorites_lookup --sizes 10000 100000 1000000
+"""
+import argparse
+import random
+import time
+from benchmarks import create_app, report
+
+FAVORITES_PER_USER = 10
+PLANETS = 1000
+
+
+def fill(db, User, FavoritePlanet, size, start):
+    # Grow the tables to `size` favorites with core executemany inserts
+    users = range(start // FAVORITES_PER_USER + 1, size // FAVORITES_PER_USER + 1)
+    db.session.execute(User.__table__.insert(), [
+        {'id': user_id, 'email': f'user{user_id}@example.com', 'password': 'x', 'is_active': True} for user_id in users
+    ])
+    db.session.execute(FavoritePlanet.__table__.insert(), [
+        {'user_id': user_id, 'planet_id': (user_id * 7 + offset) % PLANETS + 1}
+        for user_id in users for offset in range(FAVORITES_PER_USER)
+    ])
+    db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--lookups', type=int, default=2000)
+    args = parser.parse_args()
+
+    app = create_app()
+    from sqlalchemy import bindparam, select, text
+    from models import db, Planet, User, FavoritePlanet
+
+    results = []
+    with app.app_context():
+        db.session.execute(Planet.__table__.insert(), [{'id': i, 'name': f'planet-{i}'} for i in range(1, PLANETS + 1)])
+        db.session.commit()
+
+        current = 0
+        for size in sorted(args.sizes):
+            fill(db, User, FavoritePlanet, size, current)
+            current = size
+            statement = select(FavoritePlanet.planet_id).where(FavoritePlanet.user_id == bindparam('user_id'))
+            plan = None
+            if db.engine.dialect.name == 'sqlite':
+                plan = [row[-1] for row in db.session.execute(
+                    text('EXPLAIN QUERY PLAN SELECT planet_id FROM "FavoritePlanets" WHERE user_id = 1'))]
+
+            user_ids = [random.randint(1, size // FAVORITES_PER_USER) for _ in range(args.lookups)]
+            started = time.perf_counter()
+            for user_id in user_ids:
+                db.session.execute(statement, {'user_id': user_id}).all()
+            elapsed = time.perf_counter() - started
+
+            results.append({
+                'favorites': size,
+                'lookups': args.lookups,
+                'us_per_lookup': round(elapsed / args.lookups * 1e6, 2),
+                'query_plan': plan,
+            })
+
+    report({'benchmark': 'favorites_lookup', 'results': results})
+
+
+if __name__ == '__main__':
+    main()
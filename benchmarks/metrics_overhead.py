@@ -0,0 +1,68 @@
+"""
+Per-request cost of the /metrics instrumentation
+
+    python -m benchmarks.metrics_overhead --requests 20000
+
+Times the before/after request hooks on their own, a full cached GET
+/planets/<id> for comparison, and one multi-process snapshot write.
+"""
+import argparse
+import tempfile
+import time
+from benchmarks import create_app, report
+
+
+def per_call_us(function, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return (time.perf_counter() - started) / repeat * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=20000)
+    parser.add_argument('--endpoints', type=int, default=20, help='distinct endpoint labels to spread the samples over')
+    args = parser.parse_args()
+
+    app = create_app()
+    from models import db, Planet
+    from metrics import _record, _start_timer, merge_snapshots, process_snapshot, read_snapshots, render, write_snapshot
+
+    with app.app_context():
+        db.session.add(Planet(id=1, name='Tatooine'))
+        db.session.commit()
+
+    client = app.test_client()
+    client.get('/planets/1')
+    request_us = per_call_us(lambda: client.get('/planets/1'), args.requests)
+
+    response = app.response_class('{}', mimetype='application/json')
+    with app.test_request_context('/planets/1'):
+        def hooks():
+            _start_timer()
+            _record(response)
+        hooks_us = per_call_us(hooks, args.requests)
+
+    from metrics import request_metrics
+    for index in range(args.endpoints):
+        request_metrics.observe(f'endpoint_{index}', 'GET', 200, 0.01, 100)
+
+    directory = tempfile.mkdtemp(prefix='swapi-metrics-')
+    with app.app_context():
+        write_us = per_call_us(lambda: write_snapshot(directory, process_snapshot()), 200)
+    scrape_us = per_call_us(lambda: render(merge_snapshots(read_snapshots(directory))), 200)
+
+    report({
+        'benchmark': 'metrics_overhead',
+        'requests': args.requests,
+        'request_us': round(request_us, 2),
+        'hooks_us': round(hooks_us, 2),
+        'overhead_percent': round(hooks_us / request_us * 100, 2),
+        'snapshot_write_us': round(write_us, 2),
+        'scrape_render_us': round(scrape_us, 2),
+    })
+
+
+if __name__ == '__main__':
+    main()
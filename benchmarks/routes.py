@@ -0,0 +1,254 @@
+"""
+Every route of the API against a synthetic dataset, in-process and over HTTP
+
+    python -m benchmarks.routes --planets 10000 --characters 1000000 --users 100000 \\
+        --favorites 10000000 --requests 500 --output results.json
+
+Each route is called --requests times with seeded random ids through the Flask
+test client ("client") and through gunicorn ("server"), one request at a time.
+The report has p50/p95/p99 latency, throughput and SQL statements per request
+for each route, plus peak RSS, and can be compared with `benchmarks.compare`.
+Write routes add and then remove the same favorites, picked among the ones
+the users don't have yet, so the data is the same at the end of a run.
+--database-url reuses a database filled by `benchmarks.datagen`.
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import re
+import resource
+import subprocess
+import sys
+import time
+from benchmarks import SRC_DIR, create_app, report
+from benchmarks.concurrency import free_port, percentile, wait_until_ready
+from benchmarks.datagen import SYLLABLES, generate, is_empty
+
+SERVER_TIMING_QUERIES = re.compile(r'db;dur=[\d.]+;desc="(\d+) queries"')
+
+
+def free_pairs(rng, user_ids, items, taken):
+    """A random (user, item) pair per user that is not in `taken`."""
+    pairs = []
+    for user_id in user_ids:
+        for _ in range(100):
+            pair = (user_id, rng.randint(1, max(items, 1)))
+            if pair not in taken:
+                break
+        else:
+            raise ValueError(f'user {user_id} already has (almost) every item as a favorite')
+        pairs.append(pair)
+    return pairs
+
+
+def taken_favorites(db, kind, user_ids):
+    """(user, item) favorites of `kind` ('planet' or 'character') that the given users already have."""
+    from models import FavoritePlanet, FavoriteCharacter
+
+    model, column = {'planet': (FavoritePlanet, FavoritePlanet.planet_id),
+                     'character': (FavoriteCharacter, FavoriteCharacter.character_id)}[kind]
+    rows = db.session.query(model.user_id, column).filter(model.user_id.in_(set(user_ids)))
+    return set(rows)
+
+
+def route_plan(rng, planets, characters, users, count, taken=None):
+    """[(route, method, [(path, json body)])] with the same requests for both modes.
+
+    `taken(kind, user_ids)` returns the favorites those users already have; the
+    write routes use other pairs, so removing them leaves the data as it was.
+    """
+    def ids(total):
+        return [rng.randint(1, max(total, 1)) for _ in range(count)]
+
+    def pairs(kind, user_ids, items):
+        return free_pairs(rng, user_ids, items, taken(kind, user_ids) if taken else set())
+
+    planet_pairs = pairs('planet', ids(users), planets)
+    character_pairs = pairs('character', ids(users), characters)
+    batch_users = ids(users)
+    batches = [[{'op': op, 'type': kind, 'id': item_id}
+                for op in ('add', 'remove')
+                for kind, item_id in (('planet', planet_id), ('character', character_id))]
+               for (_, planet_id), (_, character_id) in zip(pairs('planet', batch_users, planets),
+                                                            pairs('character', batch_users, characters))]
+
+    return [
+        ('GET /', 'GET', [('/', None)] * count),
+        ('GET /users', 'GET', [('/users?limit=20', None)] * count),
+        ('GET /users/<id>', 'GET', [(f'/users/{i}', None) for i in ids(users)]),
+        ('GET /planets', 'GET', [('/planets?limit=20', None)] * count),
+        ('GET /planets?filter&sort', 'GET',
+         [('/planets?limit=20&filter=population>1000000&sort=-population', None)] * count),
+        ('GET /planets/<id>', 'GET', [(f'/planets/{i}', None) for i in ids(planets)]),
+        ('GET /characters', 'GET', [('/characters?limit=20', None)] * count),
+        ('GET /characters/<id>', 'GET', [(f'/characters/{i}', None) for i in ids(characters)]),
+        ('GET /search', 'GET', [(f'/search?q={rng.choice(SYLLABLES)}', None) for _ in range(count)]),
+        ('GET /favorites/<user_id>', 'GET', [(f'/favorites/{i}', None) for i in ids(users)]),
+        ('POST /favorites/planets', 'POST',
+         [('/favorites/planets', {'user_id': u, 'planet_id': p}) for u, p in planet_pairs]),
+        ('DELETE /favorites/planets', 'DELETE',
+         [('/favorites/planets', {'user_id': u, 'planet_id': p}) for u, p in planet_pairs]),
+        ('POST /favorites/characters', 'POST',
+         [('/favorites/characters', {'user_id': u, 'character_id': c}) for u, c in character_pairs]),
+        ('DELETE /favorites/characters', 'DELETE',
+         [('/favorites/characters', {'user_id': u, 'character_id': c}) for u, c in character_pairs]),
+        ('POST /favorites/batch', 'POST',
+         [('/favorites/batch', {'user_id': u, 'operations': operations})
+          for u, operations in zip(batch_users, batches)]),
+        ('GET /stats/pool', 'GET', [('/stats/pool', None)] * count),
+        ('GET /metrics', 'GET', [('/metrics', None)] * count),
+    ]
+
+
+def summarize(latencies, queries, errors, elapsed):
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'requests_per_second': round(len(latencies) / elapsed, 1) if elapsed else None,
+        'p50_ms': round(percentile(latencies, 0.50), 3),
+        'p95_ms': round(percentile(latencies, 0.95), 3),
+        'p99_ms': round(percentile(latencies, 0.99), 3),
+        'queries_per_request': round(sum(queries) / len(queries), 2) if queries else None,
+    }
+
+
+def run_client(app, db, plan):
+    from sqlalchemy import event
+
+    statements = []
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', lambda *args: statements.append(1))
+
+    client = app.test_client()
+    results = {}
+    for route, method, requests in plan:
+        latencies, queries, errors = [], [], 0
+        started_route = time.perf_counter()
+        for path, body in requests:
+            statements.clear()
+            started = time.perf_counter()
+            response = client.open(path, method=method, json=body)
+            response.get_data()
+            latencies.append((time.perf_counter() - started) * 1000)
+            queries.append(len(statements))
+            errors += response.status_code >= 500
+        results[route] = summarize(latencies, queries, errors, time.perf_counter() - started_route)
+
+    # ru_maxrss is in kilobytes on Linux
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return {'routes': results, 'peak_rss_mb': round(peak_rss, 1)}
+
+
+def _worker_peak_rss_mb(pid):
+    # VmHWM of the gunicorn workers (children of the master); Linux only
+    total = 0
+    try:
+        with open(f'/proc/{pid}/task/{pid}/children') as file:
+            children = file.read().split()
+        for child in children:
+            with open(f'/proc/{child}/status') as file:
+                for line in file:
+                    if line.startswith('VmHWM:'):
+                        total += int(line.split()[1])
+    except OSError:
+        return None
+    return round(total / 1024, 1)
+
+
+def run_server(database_url, plan, workers):
+    port = free_port()
+    environment = dict(os.environ, DATABASE_URL=database_url, PROFILE_REQUESTS='1', PROFILE_SERVER_TIMING='1',
+                       PROFILE_SLOW_MS='1e9', PROFILE_SLOW_QUERY_MS='1e9', PROFILE_N_PLUS_ONE='1000000000')
+    server = subprocess.Popen([sys.executable, '-m', 'gunicorn', 'wsgi', '--chdir', SRC_DIR, '--workers', str(workers),
+                               '--bind', f'127.0.0.1:{port}', '--log-level', 'warning'], env=environment)
+    results = {}
+    try:
+        wait_until_ready(port)
+        for route, method, requests in plan:
+            latencies, queries, errors = [], [], 0
+            started_route = time.perf_counter()
+            for path, body in requests:
+                connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+                payload = json.dumps(body) if body is not None else None
+                headers = {'Content-Type': 'application/json'} if body is not None else {}
+                started = time.perf_counter()
+                connection.request(method, path, body=payload, headers=headers)
+                response = connection.getresponse()
+                response.read()
+                latencies.append((time.perf_counter() - started) * 1000)
+                connection.close()
+                match = SERVER_TIMING_QUERIES.search(response.getheader('Server-Timing') or '')
+                if match:
+                    queries.append(int(match.group(1)))
+                errors += response.status >= 500
+            results[route] = summarize(latencies, queries, errors, time.perf_counter() - started_route)
+        peak_rss = _worker_peak_rss_mb(server.pid)
+    finally:
+        server.terminate()
+        server.wait()
+    return {'routes': results, 'workers': workers, 'peak_rss_mb': peak_rss}
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(SRC_DIR),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--database-url', default=None, help='reuse a database filled by benchmarks.datagen')
+    parser.add_argument('--planets', type=int, default=1000)
+    parser.add_argument('--characters', type=int, default=10000)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--favorites', type=int, default=20000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--requests', type=int, default=200, help='requests per route and mode')
+    parser.add_argument('--modes', default='client,server')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--output', default=None, help='also write the JSON report to this file')
+    args = parser.parse_args()
+
+    app = create_app(args.database_url)
+    from models import db, Planet, Character, User
+
+    with app.app_context():
+        generation = generate(db, args.planets, args.characters, args.users, args.favorites, args.seed) \
+            if is_empty(db) else None
+        # Sizes of the data actually in the database, which may have been generated earlier
+        dataset = {
+            'planets': db.session.query(Planet).count(),
+            'characters': db.session.query(Character).count(),
+            'users': db.session.query(User).count(),
+        }
+        plan = route_plan(random.Random(args.seed), dataset['planets'], dataset['characters'], dataset['users'],
+                          args.requests, taken=lambda kind, user_ids: taken_favorites(db, kind, user_ids))
+
+    results = {
+        'benchmark': 'routes',
+        'commit': git_commit(),
+        'python': sys.version.split()[0],
+        'database': app.config['SQLALCHEMY_DATABASE_URI'].split(':')[0],
+        'dataset': dict(dataset, favorites=args.favorites, seed=args.seed),
+        'generation': generation,
+        'requests_per_route': args.requests,
+    }
+
+    modes = args.modes.split(',')
+    if 'client' in modes:
+        results['client'] = run_client(app, db, plan)
+    if 'server' in modes:
+        results['server'] = run_server(app.config['SQLALCHEMY_DATABASE_URI'], plan, args.workers)
+
+    report(results)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2, default=str)
+
+
+if __name__ == '__main__':
+    main()
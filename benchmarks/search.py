@@ -0,0 +1,58 @@
+"""
+Latency of GET /search against a synthetic catalog
+
+    python -m benchmarks.search --planets 10000 --characters 100000 --budget-ms 50
+"""
+import argparse
+import random
+import time
+from benchmarks import create_app, report
+from benchmarks.datagen import SYLLABLES, TERRAINS, generate
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--planets', type=int, default=10000)
+    parser.add_argument('--characters', type=int, default=100000)
+    parser.add_argument('--queries', type=int, default=1000)
+    parser.add_argument('--budget-ms', type=float, default=50.0)
+    args = parser.parse_args()
+
+    app = create_app()
+    from models import db
+
+    with app.app_context():
+        rebuild_seconds = generate(db, args.planets, args.characters, 0, 0)['search_index_seconds']
+
+    client = app.test_client()
+    queries = [random.choice(SYLLABLES + TERRAINS)[:random.randint(2, 4)] for _ in range(args.queries)]
+    latencies = []
+    for query in queries:
+        started = time.perf_counter()
+        response = client.get(f'/search?q={query}')
+        latencies.append((time.perf_counter() - started) * 1000)
+        assert response.status_code == 200, response.data
+
+    p95 = percentile(latencies, 0.95)
+    report({
+        'benchmark': 'search',
+        'database': app.config['SQLALCHEMY_DATABASE_URI'].split(':')[0],
+        'planets': args.planets,
+        'characters': args.characters,
+        'queries': args.queries,
+        'rebuild_seconds': round(rebuild_seconds, 3),
+        'p50_ms': round(percentile(latencies, 0.50), 2),
+        'p95_ms': round(p95, 2),
+        'p99_ms': round(percentile(latencies, 0.99), 2),
+        'budget_ms': args.budget_ms,
+        'within_budget': p95 <= args.budget_ms,
+    })
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""
+ORM objects + serialize() against Core rows + precompiled encoders
+
+    python -m benchmarks.serializers --characters 20000 --repeat 5
+"""
+import argparse
+import json
+import time
+from benchmarks import create_app, report
+
+
+def best_of(repeat, function):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - started)
+    return round(min(timings) * 1000, 2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--planets', type=int, default=200)
+    parser.add_argument('--characters', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    app = create_app()
+    from models import db, eager_query, Planet, Character
+    from pagination import projected_query
+    from serializers import orjson, row_encoder, selected_columns
+
+    with app.app_context():
+        db.session.execute(Planet.__table__.insert(), [
+            {'id': i, 'name': f'planet-{i}', 'climate': 'arid', 'terrain': 'desert', 'diameter': 10465}
+            for i in range(1, args.planets + 1)
+        ])
+        db.session.execute(Character.__table__.insert(), [
+            {'id': i, 'name': f'character-{i}', 'height': 172, 'mass': 77.0, 'hair_color': 'blond',
+             'eye_color': 'blue', 'gender': 'male', 'home_world_id': i % args.planets + 1}
+            for i in range(1, args.characters + 1)
+        ])
+        db.session.commit()
+
+        fields = tuple(Character.projection())
+        encode = row_encoder(selected_columns(Character, fields), fields)
+
+        def orm_path():
+            db.session.expunge_all()
+            return [item.serialize() for item in eager_query(Character).order_by(Character.id).all()]
+
+        def row_path():
+            return [encode(row) for row in projected_query(Character, fields).order_by(Character.id).all()]
+
+        assert orm_path() == row_path()
+        payload = row_path()
+
+        results = {
+            'orm_serialize_ms': best_of(args.repeat, orm_path),
+            'core_rows_encoder_ms': best_of(args.repeat, row_path),
+            'json_dumps_ms': best_of(args.repeat, lambda: json.dumps(payload)),
+        }
+        if orjson is not None:
+            results['orjson_dumps_ms'] = best_of(args.repeat, lambda: orjson.dumps(payload))
+
+    report({'benchmark': 'serializers', 'characters': args.characters, 'repeat': args.repeat, **results})
+
+
+if __name__ == '__main__':
+    main()
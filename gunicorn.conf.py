@@ -0,0 +1,28 @@
+"""
+gunicorn settings, loaded by default from the directory gunicorn is started in
+
+With METRICS_DIR set (see src/metrics.py) the master moves the counters of each
+worker that exits into METRICS_DIR/exited.json and deletes its file.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'src'))
+
+
+def _collect_metrics(pids=None):
+    directory = os.getenv('METRICS_DIR')
+    if not directory or not os.path.isdir(directory):
+        return
+    from metrics import collect_exited
+
+    collect_exited(directory, pids)
+
+
+def on_starting(server):
+    # Files left by the workers of a previous run
+    _collect_metrics()
+
+
+def child_exit(server, worker):
+    _collect_metrics([worker.pid])
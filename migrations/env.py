@@ -38,6 +38,15 @@ def get_metadata():
     return target_db.metadata
 
 
+def include_object(object, name, type_, reflected, compare_to):
+    # SearchIndex (and the FTS5 shadow tables on SQLite) is created with raw
+    # DDL by src/search.py, so it is not in the metadata; without this every
+    # autogenerate would drop it
+    if type_ == 'table' and name.startswith('SearchIndex'):
+        return False
+    return True
+
+
 def run_migrations_offline():
     """Run migrations in 'offline' mode.
 
@@ -52,7 +61,8 @@ def run_migrations_offline():
     """
     url = config.get_main_option("sqlalchemy.url")
     context.configure(
-        url=url, target_metadata=get_metadata(), literal_binds=True
+        url=url, target_metadata=get_metadata(), literal_binds=True,
+        include_object=include_object
     )
 
     with context.begin_transaction():
@@ -80,10 +90,16 @@ def run_migrations_online():
     connectable = current_app.extensions['migrate'].db.get_engine()
 
     with connectable.connect() as connection:
+        # The app turns SQLite foreign keys on; batch migrations recreate
+        # tables and would fail on the references while they do
+        if connection.dialect.name == 'sqlite':
+            connection.exec_driver_sql('PRAGMA foreign_keys=OFF')
+
         context.configure(
             connection=connection,
             target_metadata=get_metadata(),
             process_revision_directives=process_revision_directives,
+            include_object=include_object,
             **current_app.extensions['migrate'].configure_args
         )
 
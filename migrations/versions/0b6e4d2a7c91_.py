@@ -0,0 +1,53 @@
+"""search index for planets and characters
+
+Revision ID: 0b6e4d2a7c91
+Revises: f1a9c3b8e042
+Create Date: 2026-10-18 14:22:37.560184
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0b6e4d2a7c91'
+down_revision = 'f1a9c3b8e042'
+branch_labels = None
+depends_on = None
+
+PLANET_BODY = "trim(coalesce(climate, '') || ' ' || coalesce(terrain, ''))"
+CHARACTER_BODY = ("trim(coalesce(gender, '') || ' ' || coalesce(hair_color, '') || ' ' || coalesce(eye_color, '')"
+                  " || ' ' || coalesce(skin_color, '') || ' ' || coalesce(birth_year, ''))")
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        op.execute("""CREATE VIRTUAL TABLE "SearchIndex" USING fts5(
+            kind UNINDEXED, ref_id UNINDEXED, name, body, tokenize='unicode61', prefix='2 3')""")
+        op.execute(f"""INSERT INTO "SearchIndex" (rowid, kind, ref_id, name, body)
+            SELECT id * 2, 'planet', id, name, {PLANET_BODY} FROM "Planets" """)
+        op.execute(f"""INSERT INTO "SearchIndex" (rowid, kind, ref_id, name, body)
+            SELECT id * 2 + 1, 'character', id, name, {CHARACTER_BODY} FROM "Characters" """)
+    elif dialect == 'postgresql':
+        op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        op.execute("""CREATE TABLE "SearchIndex" (
+            kind VARCHAR(10) NOT NULL,
+            ref_id INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            body TEXT,
+            document TSVECTOR GENERATED ALWAYS AS (
+                setweight(to_tsvector('simple', coalesce(name, '')), 'A') ||
+                setweight(to_tsvector('simple', coalesce(body, '')), 'B')) STORED,
+            PRIMARY KEY (kind, ref_id))""")
+        op.execute('CREATE INDEX "ix_SearchIndex_document" ON "SearchIndex" USING gin (document)')
+        op.execute('CREATE INDEX "ix_SearchIndex_name_trgm" ON "SearchIndex" USING gin (name gin_trgm_ops)')
+        op.execute(f"""INSERT INTO "SearchIndex" (kind, ref_id, name, body)
+            SELECT 'planet', id, name, {PLANET_BODY} FROM "Planets" """)
+        op.execute(f"""INSERT INTO "SearchIndex" (kind, ref_id, name, body)
+            SELECT 'character', id, name, {CHARACTER_BODY} FROM "Characters" """)
+
+
+def downgrade():
+    if op.get_bind().dialect.name in ('sqlite', 'postgresql'):
+        op.execute('DROP TABLE "SearchIndex"')
@@ -0,0 +1,38 @@
+"""planet resident counts and the residents index
+
+Revision ID: 4e7a2c9d1b63
+Revises: 9d3f6b1e8a24
+Create Date: 2026-10-18 16:41:27.315902
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4e7a2c9d1b63'
+down_revision = '9d3f6b1e8a24'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('Planets', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('resident_count', sa.Integer(), server_default='0', nullable=False))
+
+    op.create_index('ix_Characters_home_world_id_id', 'Characters', ['home_world_id', 'id'], unique=False)
+
+    op.execute('UPDATE "Planets" SET resident_count = '
+               '(SELECT count(*) FROM "Characters" WHERE "Characters".home_world_id = "Planets".id)')
+
+    # Every planet's JSON has a new field: new ETags, and the favorites snapshots get rebuilt
+    table_versions = sa.table('TableVersions', sa.column('name'), sa.column('version'), sa.column('updated_at'))
+    op.execute(table_versions.update().where(table_versions.c.name == 'Planets')
+               .values(version=table_versions.c.version + 1, updated_at=sa.func.now()))
+
+
+def downgrade():
+    op.drop_index('ix_Characters_home_world_id_id', table_name='Characters')
+
+    with op.batch_alter_table('Planets', schema=None) as batch_op:
+        batch_op.drop_column('resident_count')
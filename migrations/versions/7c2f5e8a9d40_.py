@@ -0,0 +1,46 @@
+"""change log for incremental sync
+
+Revision ID: 7c2f5e8a9d40
+Revises: 4e7a2c9d1b63
+Create Date: 2026-10-18 17:28:53.640217
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7c2f5e8a9d40'
+down_revision = '4e7a2c9d1b63'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    change_log = op.create_table('ChangeLog',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('version', sa.Integer(), nullable=False),
+    sa.Column('kind', sa.String(length=30), nullable=False),
+    sa.Column('row_id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=True),
+    sa.Column('operation', sa.String(length=10), nullable=False),
+    sa.Column('changed_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('ChangeLog', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_ChangeLog_version'), ['version'], unique=False)
+        batch_op.create_index('ix_ChangeLog_kind_row_id_version', ['kind', 'row_id', 'version'], unique=False)
+
+    # Nothing before this point is in the log: clients starting from 0 download everything
+    table_versions = sa.table('TableVersions', sa.column('name'), sa.column('version'), sa.column('updated_at'))
+    op.execute(table_versions.insert().values(name='ChangeLog', version=1, updated_at=sa.func.now()))
+    op.execute(change_log.insert().values(version=1, kind='*', row_id=0, operation='reset', changed_at=sa.func.now()))
+
+
+def downgrade():
+    op.execute("DELETE FROM \"TableVersions\" WHERE name = 'ChangeLog'")
+    with op.batch_alter_table('ChangeLog', schema=None) as batch_op:
+        batch_op.drop_index('ix_ChangeLog_kind_row_id_version')
+        batch_op.drop_index(batch_op.f('ix_ChangeLog_version'))
+
+    op.drop_table('ChangeLog')
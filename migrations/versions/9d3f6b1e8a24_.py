@@ -0,0 +1,34 @@
+"""pre-serialized favorites body per user
+
+Revision ID: 9d3f6b1e8a24
+Revises: 0b6e4d2a7c91
+Create Date: 2026-10-18 15:02:11.904318
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9d3f6b1e8a24'
+down_revision = '0b6e4d2a7c91'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Starts empty: reads never store snapshots, so `flask refresh-favorites` builds them
+    # after the upgrade (favorites writes keep them up to date from then on)
+    op.create_table('FavoriteSnapshots',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('body', sa.Text(), nullable=True),
+    sa.Column('revision', sa.Integer(), nullable=False),
+    sa.Column('planets_version', sa.Integer(), nullable=False),
+    sa.Column('characters_version', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['Users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('user_id')
+    )
+
+
+def downgrade():
+    op.drop_table('FavoriteSnapshots')
@@ -0,0 +1,40 @@
+"""favorite counts for the popularity leaderboards
+
+Revision ID: b5d81f3a6e27
+Revises: 7c2f5e8a9d40
+Create Date: 2026-10-18 19:12:05.448310
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b5d81f3a6e27'
+down_revision = '7c2f5e8a9d40'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('FavoriteCounts',
+    sa.Column('kind', sa.String(length=20), nullable=False),
+    sa.Column('item_id', sa.Integer(), nullable=False),
+    sa.Column('favorites', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('kind', 'item_id')
+    )
+    with op.batch_alter_table('FavoriteCounts', schema=None) as batch_op:
+        batch_op.create_index('ix_FavoriteCounts_kind_favorites_item_id', ['kind', 'favorites', 'item_id'], unique=False)
+
+    # Counters of the favorites saved so far
+    op.execute('INSERT INTO "FavoriteCounts" (kind, item_id, favorites) '
+               'SELECT \'planet\', planet_id, count(*) FROM "FavoritePlanets" GROUP BY planet_id')
+    op.execute('INSERT INTO "FavoriteCounts" (kind, item_id, favorites) '
+               'SELECT \'character\', character_id, count(*) FROM "FavoriteCharacters" GROUP BY character_id')
+
+
+def downgrade():
+    with op.batch_alter_table('FavoriteCounts', schema=None) as batch_op:
+        batch_op.drop_index('ix_FavoriteCounts_kind_favorites_item_id')
+
+    op.drop_table('FavoriteCounts')
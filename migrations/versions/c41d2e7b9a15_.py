@@ -0,0 +1,44 @@
+"""table versions and updated_at for conditional requests
+
+Revision ID: c41d2e7b9a15
+Revises: 5a47ef3de79d
+Create Date: 2026-10-18 10:12:44.381052
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c41d2e7b9a15'
+down_revision = '5a47ef3de79d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    table_versions = op.create_table('TableVersions',
+    sa.Column('name', sa.String(length=50), nullable=False),
+    sa.Column('version', sa.Integer(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+    with op.batch_alter_table('Planets', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('updated_at', sa.DateTime(), nullable=True))
+
+    with op.batch_alter_table('Characters', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('updated_at', sa.DateTime(), nullable=True))
+
+    for name in ('Planets', 'Characters'):
+        op.execute(sa.table(name, sa.column('updated_at')).update().values(updated_at=sa.func.now()))
+        op.execute(table_versions.insert().values(name=name, version=1, updated_at=sa.func.now()))
+
+
+def downgrade():
+    with op.batch_alter_table('Characters', schema=None) as batch_op:
+        batch_op.drop_column('updated_at')
+
+    with op.batch_alter_table('Planets', schema=None) as batch_op:
+        batch_op.drop_column('updated_at')
+
+    op.drop_table('TableVersions')
@@ -0,0 +1,36 @@
+"""unique (user_id, item_id) indexes on the favorites tables
+
+Revision ID: e83f5a0c6d27
+Revises: c41d2e7b9a15
+Create Date: 2026-10-18 11:40:02.917346
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e83f5a0c6d27'
+down_revision = 'c41d2e7b9a15'
+branch_labels = None
+depends_on = None
+
+FAVORITE_TABLES = (
+    ('FavoritePlanets', 'planet_id'),
+    ('FavoriteCharacters', 'character_id'),
+)
+
+
+def upgrade():
+    for table_name, item_column in FAVORITE_TABLES:
+        # Keep the oldest row of every duplicated (user, item) pair
+        table = sa.table(table_name, sa.column('id'), sa.column('user_id'), sa.column(item_column))
+        keep = sa.select(sa.func.min(table.c.id)).group_by(table.c.user_id, table.c[item_column])
+        op.execute(table.delete().where(table.c.id.not_in(keep.scalar_subquery())))
+
+        op.create_index(f'ix_{table_name}_user_id_{item_column}', table_name, ['user_id', item_column], unique=True)
+
+
+def downgrade():
+    for table_name, item_column in FAVORITE_TABLES:
+        op.drop_index(f'ix_{table_name}_user_id_{item_column}', table_name=table_name)
@@ -0,0 +1,86 @@
+"""numeric planet and character measurements
+
+Revision ID: f1a9c3b8e042
+Revises: e83f5a0c6d27
+Create Date: 2026-10-18 13:05:51.204719
+
+"""
+import re
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f1a9c3b8e042'
+down_revision = 'e83f5a0c6d27'
+branch_labels = None
+depends_on = None
+
+# table -> [(column, text type, numeric type)]
+NUMERIC_COLUMNS = {
+    'Planets': [
+        ('diameter', sa.String(length=20), sa.Integer()),
+        ('gravity', sa.String(length=10), sa.Float()),
+        ('population', sa.String(length=20), sa.BigInteger()),
+    ],
+    'Characters': [
+        ('height', sa.String(length=10), sa.Integer()),
+        ('mass', sa.String(length=10), sa.Float()),
+    ],
+}
+
+
+def parse_number(value, number_type):
+    # "1,000" -> 1000, "0.9 standard" -> 0.9, "unknown" / "n/a" -> None
+    match = re.search(r'-?\d[\d,]*(\.\d+)?', value or '')
+    if match is None:
+        return None
+    number = float(match.group(0).replace(',', ''))
+    return round(number) if number_type is int else number
+
+
+def format_number(value, number_type):
+    if value is None:
+        return None
+    return str(int(value)) if float(value).is_integer() else str(value)
+
+
+def convert(table_name, columns, target, converter):
+    # Copy every column into a new one of the `target` type (0 text, 1 numeric),
+    # then swap it in place of the old column
+    bind = op.get_bind()
+    with op.batch_alter_table(table_name, schema=None) as batch_op:
+        for name, *types in columns:
+            batch_op.add_column(sa.Column(f'{name}_new', types[target], nullable=True))
+
+    table = sa.table(table_name, sa.column('id'),
+                     *[sa.column(name) for name, *types in columns],
+                     *[sa.column(f'{name}_new') for name, *types in columns])
+    rows = bind.execute(sa.select(table.c.id, *[table.c[name] for name, *types in columns])).fetchall()
+    if rows:
+        statement = table.update().where(table.c.id == sa.bindparam('row_id')).values(
+            {f'{name}_new': sa.bindparam(f'value_{name}') for name, *types in columns})
+        bind.execute(statement, [
+            dict(row_id=row[0], **{f'value_{name}': converter(row[index + 1], types[target].python_type)
+                                   for index, (name, *types) in enumerate(columns)})
+            for row in rows
+        ])
+
+    with op.batch_alter_table(table_name, schema=None) as batch_op:
+        for name, *types in columns:
+            batch_op.drop_column(name)
+            batch_op.alter_column(f'{name}_new', new_column_name=name)
+
+
+def upgrade():
+    for table_name, columns in NUMERIC_COLUMNS.items():
+        convert(table_name, columns, 1, parse_number)
+        for name, *types in columns:
+            op.create_index(f'ix_{table_name}_{name}', table_name, [name], unique=False)
+
+
+def downgrade():
+    for table_name, columns in NUMERIC_COLUMNS.items():
+        for name, *types in columns:
+            op.drop_index(f'ix_{table_name}_{name}', table_name=table_name)
+        convert(table_name, columns, 0, format_number)
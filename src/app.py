@@ -8,7 +8,26 @@ from flask_swagger import swagger
 from flask_cors import CORS
 from utils import APIException, generate_sitemap
 from admin import setup_admin
-from models import db, User, Planet, Character, FavoriteCharacter, FavoritePlanet
+from pagination import paginate, include_args, include_item
+from streaming import wants_stream, stream_response
+from cache import setup_cache, catalog_cache
+from versioning import setup_versioning
+from serializers import setup_serializers
+from search import setup_search, timed_search, SEARCH_DEFAULT_LIMIT, SEARCH_MAX_LIMIT
+from favorites import setup_favorites, add_favorite, remove_favorite, apply_batch, favorites_json, favorites_response, \
+    parse_id, BATCH_MAX_OPERATIONS
+from conditional import conditional, request_versions
+from pool import setup_pool, instrument_pools, pool_status
+from replica import setup_replica, replica_status, use_primary
+from profiler import setup_profiler
+from importer import setup_importer
+from residents import setup_residents
+from changes import setup_changes, changes_args, changes_body
+from popularity import setup_popularity, popular_body
+from metrics import setup_metrics, metrics_text, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from compression import setup_compression
+from catalog_snapshot import setup_catalog_snapshot, request_snapshot, snapshot_status, page_response, json_response
+from models import db, eager_query, User, Planet, Character
 #from models import Person
 
 app = Flask(__name__)
@@ -20,11 +39,41 @@ if db_url is not None:
 else:
     app.config['SQLALCHEMY_DATABASE_URI'] = "sqlite:////tmp/test.db"
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# Con RAISE_ON_LAZY_LOAD=1 cualquier lazy load en los serializadores lanza una excepción (útil en tests)
+app.config['RAISE_ON_LAZY_LOAD'] = os.getenv("RAISE_ON_LAZY_LOAD", "0").lower() in ("1", "true", "yes")
+
+# Tamaño del pool, pre-ping, reciclado y statement timeout desde variables de entorno (ver pool.py)
+setup_pool(app)
+# Réplica de lectura opcional (DATABASE_REPLICA_URL) para las peticiones GET (ver replica.py)
+setup_replica(app)
 
 MIGRATE = Migrate(app, db)
 db.init_app(app)
+# Estadísticas del pool de cada engine por separado ("default" y "replica")
+with app.app_context():
+    instrument_pools(db)
 CORS(app)
 setup_admin(app)
+setup_serializers(app)
+# Perfilado opcional de cada petición (PROFILE_REQUESTS=1): consultas, tiempo de BD y serialización
+setup_profiler(app)
+# Métricas de Prometheus por endpoint en /metrics (METRICS_DIR para sumar varios workers de gunicorn)
+setup_metrics(app)
+# Compresión gzip/brotli/zstd de las respuestas (después de las métricas para que cuenten los bytes enviados)
+setup_compression(app)
+setup_cache(app)
+setup_versioning(app)
+# Contador resident_count de cada planeta, actualizado al crear, mover o borrar personajes (ver residents.py)
+setup_residents(app)
+# Registro de cambios para la sincronización incremental de GET /changes (ver changes.py)
+setup_changes(app)
+# Copia inmutable en memoria de planetas y personajes (CATALOG_SNAPSHOT=1, ver catalog_snapshot.py)
+setup_catalog_snapshot(app)
+# Cuerpo de GET /favorites/<user_id> ya serializado por usuario (ver favorites.py)
+setup_favorites(app)
+setup_popularity(app)
+setup_search(app)
+setup_importer(app)
 
 # Handle/serialize errors like a JSON object
 @app.errorhandler(APIException)
@@ -36,20 +85,18 @@ def handle_invalid_usage(error):
 def sitemap():
     return generate_sitemap(app)
 
+def serialize_by_id(query, item_id):
+    item = query.get(item_id)
+    return item.serialize() if item is not None else None
+
 # =============== ENDPOINTS =============== #
 
 # ========== get users ========== #
 @app.route('/users', methods=['GET'])
 def get_users():
-    users_query = User.query.all()
-    serialized_users = list(map(lambda item: item.serialize(), users_query))
+    # Paginado por cursor (?limit=&after=), proyección (?fields=) y total opcional (?count=)
+    response_body = paginate(User, 'users')
 
-    response_body = {
-         "msg": "ok",
-         "total_users": len(serialized_users),
-         "result": serialized_users
-     }
-    
     return jsonify(response_body), 200
 
 
@@ -66,328 +113,299 @@ def get_user(user_id):
 
 # ========== get planets ========== #
 @app.route('/planets', methods=['GET'])
+@conditional('Planets')
 def get_planets():
-    planets_query = Planet.query.all()
-    serialized_planets = list(map(lambda item: item.serialize(), planets_query))
+    # Exportación completa en streaming (?stream=1 o Accept: application/x-ndjson)
+    if wants_stream():
+        return stream_response(Planet)
 
-    response_body = {
-        "msg": "ok",
-        "total_planets": len(serialized_planets),
-        "result": serialized_planets
-    }
+    # Páginas simples (?limit=&after=&count=) desde el snapshot en memoria, si está activo
+    snapshot = request_snapshot()
+    if snapshot is not None:
+        return page_response(snapshot, snapshot.planets, 'planets'), 200
+
+    # Paginado por cursor (?limit=&after=), proyección (?fields=), total opcional (?count=) y ?shape=columns
+    # o varios planetas por id con una sola consulta (?ids=1,2,3)
+    response_body = paginate(Planet, 'planets')
 
     return jsonify(response_body), 200
 
 
 # ========== get planet by id ========== #
 @app.route('/planets/<int:planet_id>', methods=['GET'])
+@conditional('Planets')
 def get_planet(planet_id):
-    planet_query = Planet.query.get(planet_id)
-
-    if planet_query is None:
+    # JSON ya codificado del snapshot en memoria, si está activo
+    snapshot = request_snapshot()
+    if snapshot is not None:
+        body = snapshot.planets.body(planet_id)
+        if body is None:
+            return jsonify({"msg": f"El planeta con id {planet_id} no existe"}), 404
+        return json_response(body), 200
+
+    # Lectura a través de la caché del catálogo, con las mismas versiones que el ETag
+    serialized_planet = catalog_cache.get_or_load('planets', planet_id, request_versions(), lambda: serialize_by_id(Planet.query, planet_id))
+
+    if serialized_planet is None:
         return jsonify({"msg": f"El planeta con id {planet_id} no existe"}), 404
     else:
-        return jsonify(planet_query.serialize()), 200
+        return jsonify(serialized_planet), 200
     
 
+# ========== get most favorited planets ========== #
+@app.route('/planets/popular', methods=['GET'])
+def get_popular_planets():
+    # Ranking por cantidad de favoritos (?limit=), leído de los contadores y cacheado unos segundos
+    response_body = popular_body('planet')
+
+    return jsonify(response_body), 200
+
+
+# ========== get residents of a planet ========== #
+@app.route('/planets/<int:planet_id>/residents', methods=['GET'])
+@conditional('Characters', 'Planets')
+def get_planet_residents(planet_id):
+    # El total sale del contador resident_count, sin COUNT(*)
+    resident_count = db.session.query(Planet.resident_count).filter(Planet.id == planet_id).scalar()
+    if resident_count is None:
+        return jsonify({"msg": f"El planeta con id {planet_id} no existe"}), 404
+
+    # Personajes con este planeta natal, paginados por id sobre el índice (home_world_id, id);
+    # admite los mismos parámetros que /characters
+    response_body = paginate(Character, 'residents', Character.home_world_id == planet_id, total=resident_count)
+
+    return jsonify(response_body), 200
+
+
 # ========== get characters ========== #
 @app.route('/characters', methods=['GET'])
+@conditional('Characters', 'Planets')
 def get_characters():
-    characters_query = Character.query.all()
-    serialized_characters = list(map(lambda item: item.serialize(), characters_query))
+    # Exportación completa en streaming (?stream=1 o Accept: application/x-ndjson)
+    if wants_stream():
+        return stream_response(Character)
 
-    response_body = {
-        "msg": "ok",
-        "total_characters": len(serialized_characters),
-        "result": serialized_characters
-    }
+    # Páginas simples (?limit=&after=&count=) desde el snapshot en memoria, si está activo
+    snapshot = request_snapshot()
+    if snapshot is not None:
+        return page_response(snapshot, snapshot.characters, 'characters'), 200
+
+    # Paginado por cursor (?limit=&after=), proyección (?fields=), total opcional (?count=) y ?shape=columns,
+    # varios personajes por id (?ids=1,2,3) y su planeta embebido (?include=home_world)
+    response_body = paginate(Character, 'characters')
 
     return jsonify(response_body), 200
 
 
 # ========== get character by id ========== #
 @app.route('/characters/<int:character_id>', methods=['GET'])
+@conditional('Characters', 'Planets')
 def get_character(character_id):
-    character_query = Character.query.get(character_id)
+    # ?include=home_world agrega el planeta completo con una consulta más
+    includes = include_args(Character)
+
+    # JSON ya codificado del snapshot en memoria, si está activo y no se pidió ?include
+    snapshot = request_snapshot()
+    if snapshot is not None:
+        body = snapshot.characters.body(character_id)
+        if body is None:
+            return jsonify({"msg": f"El personaje con id {character_id} no existe"}), 404
+        return json_response(body), 200
 
-    if character_query is None:
+    # Lectura a través de la caché del catálogo, con las mismas versiones que el ETag
+    serialized_character = catalog_cache.get_or_load('characters', character_id, request_versions(), lambda: serialize_by_id(eager_query(Character), character_id))
+
+    if serialized_character is None:
         return jsonify({"msg": f"El personaje con id {character_id} no existe"}), 404
+    elif includes:
+        return jsonify(include_item(serialized_character, includes)), 200
     else:
-        return jsonify(character_query.serialize()), 200
+        return jsonify(serialized_character), 200
 
 
-# ========== get favorites by user id ========== #
-@app.route('/favorites/<int:user_id>', methods=['GET'])
-def get_favorites_by_user(user_id):
-    user = User.query.get(user_id)
+# ========== get most favorited characters ========== #
+@app.route('/characters/popular', methods=['GET'])
+def get_popular_characters():
+    # Ranking por cantidad de favoritos (?limit=), leído de los contadores y cacheado unos segundos
+    response_body = popular_body('character')
 
-    if user is None:
-        return jsonify({"msg": f"El usuario con id {user_id} no existe"}), 404
-    
-    # Usando la relación
-    favorite_characters_query = FavoriteCharacter.query.filter_by(user_id=user_id)
-    serialized_favorite_characters = list(map(lambda item: item.serialize()['character'], favorite_characters_query))
+    return jsonify(response_body), 200
+
+
+# ========== search planets and characters ========== #
+@app.route('/search', methods=['GET'])
+def search_catalog():
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({"msg": "Error: la petición no incluye el parámetro q"}), 400
 
-    # Usando un join
-    favorite_planets_query = db.session.query(FavoritePlanet, Planet).join(Planet).filter(FavoritePlanet.user_id == user_id).all()
-    serialized_favorite_planets = []
-    for favorite_item, planet_item in favorite_planets_query:
-        serialized_favorite_planets.append(planet_item.serialize())
+    kind = request.args.get('type')
+    if kind not in (None, 'planet', 'character'):
+        return jsonify({"msg": "Error: el parámetro type debe ser 'planet' o 'character'"}), 400
+
+    limit = max(1, min(request.args.get('limit', SEARCH_DEFAULT_LIMIT, type=int), SEARCH_MAX_LIMIT))
+    results, took_ms = timed_search(query, limit, kind)
 
     response_body = {
         "msg": "ok",
-        "total_favorites": len(serialized_favorite_characters) + len(serialized_favorite_planets),
-        "result": {
-            "favorite_characters": serialized_favorite_characters,
-            "favorite_planets": serialized_favorite_planets
-        }
+        "query": query,
+        "took_ms": took_ms,
+        "total": len(results),
+        "result": results
     }
 
     return jsonify(response_body), 200
 
 
-# ========== post favorite planet ========== #
-@app.route('/favorites/planets', methods=['POST'])
-def add_favorite_planet():
-    request_body = request.get_json(silent=True)
+# ========== get changes since a version ========== #
+@app.route('/changes', methods=['GET'])
+def get_changes():
+    # Altas, modificaciones y bajas posteriores a ?since= (catálogo y, con ?user_id=, sus favoritos),
+    # con el estado actual de cada fila; "reset": true pide volver a descargar todo
+    since, user_id, limit = changes_args()
+    response_body = changes_body(since, user_id, limit)
 
-    # Chequear si la petición trajo datos en el body
-    if request_body is not None: 
-        print("Incoming request with the following body", request_body)
-    else:
-        return jsonify({"msg": f"Error: la petición no incluye datos en el body"}), 400
+    return jsonify(response_body), 200
 
-    # Chequear si el body trae los datos correctos del usuario
-    if request_body.get('user_id') is not None:
-        user_query = User.query.get(request_body['user_id'])
 
-        if user_query is None:
-            return jsonify({"msg": f"El usuario con id {request_body['user_id']} no existe."}), 400
-        
-    else:
-        return jsonify({"msg": f"Error: el body de la petición no incluye la propiedad user_id"}), 400
-    
-    # Chequear si el body trae los datos correctos del planeta
-    if request_body.get('planet_id') is not None:
-        planet_query = Planet.query.get(request_body['planet_id'])
+# ========== get connection pool stats ========== #
+@app.route('/stats/pool', methods=['GET'])
+def get_pool_stats():
+    # Conexiones en uso, overflow y tiempos de espera del pool de este proceso
+    result = pool_status(db.engine)
+    # Retraso, lecturas enviadas y pool de la réplica, si hay una configurada
+    result["replica"] = replica_status(db)
+    # Filas, versiones y recargas del snapshot del catálogo, si está activo
+    result["catalog_snapshot"] = snapshot_status()
+    return jsonify({"msg": "ok", "result": result}), 200
 
-        if planet_query is None:
-            return jsonify({"msg": f"El planeta con id {request_body['planet_id']} no existe."}), 400
-        
-    else:
-        return jsonify({"msg": f"Error: el body de la petición no incluye la propiedad planet_id"}), 400
-     
-    # Crear el diccionario con los datos de la petición
-    favorite_planet = FavoritePlanet()
-    favorite_planet.user_id = request_body['user_id']
-    favorite_planet.planet_id = request_body['planet_id']
-    # Insertar un registro mediante el diccionario
-    db.session.add(favorite_planet)
-    # Guardar los cambios realizados en la BD
-    db.session.commit()
 
-    # Devolver al frontend la lista de favoritos del usuario actualizada
-    favorite_characters_query = FavoriteCharacter.query.filter_by(user_id = request_body['user_id'])
-    serialized_favorite_characters = list(map(lambda item: item.serialize()['character'], favorite_characters_query))
+# ========== get prometheus metrics ========== #
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    if not app.config['METRICS_ENABLED']:
+        return jsonify({"msg": "Las métricas están desactivadas"}), 404
 
-    favorite_planets_query = FavoritePlanet.query.filter_by(user_id = request_body['user_id'])
-    serialized_favorite_planets = list(map(lambda item: item.serialize()['planet'], favorite_planets_query))
+    return metrics_text(), 200, {'Content-Type': METRICS_CONTENT_TYPE}
 
-    response_body = {
-        "msg": "ok",
-        "total_favorites": len(serialized_favorite_characters) + len(serialized_favorite_planets),
-        "result": {
-            "favorite_characters": serialized_favorite_characters,
-            "favorite_planets": serialized_favorite_planets
-        }
-    }
 
-    return jsonify(response_body), 200
+# ========== get favorites by user id ========== #
+@app.route('/favorites/<int:user_id>', methods=['GET'])
+@use_primary
+def get_favorites_by_user(user_id):
+    # Una sola lectura por clave primaria del cuerpo ya serializado (se reconstruye si quedó desactualizado)
+    body = favorites_json(user_id)
 
+    if body is None:
+        return jsonify({"msg": f"El usuario con id {user_id} no existe"}), 404
 
-# ========== post favorite character ========== #
-@app.route('/favorites/characters', methods=['POST'])
-def add_favorite_character():
-    request_body = request.get_json(silent=True)
+    return favorites_response(body), 200
 
+
+def check_favorite_body(request_body, item_key):
+    """Return (error, user_id, item_id) with the ids of the body as ints."""
     # Chequear si la petición trajo datos en el body
-    if request_body is not None: 
-        print("Incoming request with the following body", request_body)
-    else:
-        return jsonify({"msg": f"Error: la petición no incluye datos en el body"}), 400
+    if not isinstance(request_body, dict):
+        return "Error: la petición no incluye datos en el body", None, None
 
-    # Chequear si el body trae los datos correctos del usuario
-    if request_body.get('user_id') is not None:
-        user_query = User.query.get(request_body['user_id'])
+    # Chequear si el body trae las propiedades necesarias, con ids enteros
+    ids = []
+    for key in ('user_id', item_key):
+        if request_body.get(key) is None:
+            return f"Error: el body de la petición no incluye la propiedad {key}", None, None
+        ids.append(parse_id(request_body[key]))
+        if ids[-1] is None:
+            return f"Error: la propiedad {key} debe ser un número entero", None, None
 
-        if user_query is None:
-            return jsonify({"msg": f"El usuario con id {request_body['user_id']} no existe."}), 400
-        
-    else:
-        return jsonify({"msg": f"Error: el body de la petición no incluye la propiedad user_id"}), 400
-    
-    # Chequear si el body trae los datos correctos del personaje
-    if request_body.get('character_id') is not None:
-        character_query = Character.query.get(request_body['character_id'])
+    return None, ids[0], ids[1]
 
-        if character_query is None:
-            return jsonify({"msg": f"El personaje con id {request_body['character_id']} no existe."}), 400
-        
-    else:
-        return jsonify({"msg": f"Error: el body de la petición no incluye la propiedad character_id"}), 400
-     
-    # Crear el diccionario con los datos de la petición
-    favorite_character = FavoriteCharacter()
-    favorite_character.user_id = request_body['user_id']
-    favorite_character.character_id = request_body['character_id']
-    # Insertar un registro mediante el diccionario
-    db.session.add(favorite_character)
-    # Guardar los cambios realizados en la BD
-    db.session.commit()
 
-    # Devolver al frontend la lista de favoritos del usuario actualizada
-    favorite_characters_query = FavoriteCharacter.query.filter_by(user_id = request_body['user_id'])
-    serialized_favorite_characters = list(map(lambda item: item.serialize()['character'], favorite_characters_query))
+def add_favorite_response(kind, item_key):
+    error, user_id, item_id = check_favorite_body(request.get_json(silent=True), item_key)
+    if error is not None:
+        return jsonify({"msg": error}), 400
 
-    favorite_planets_query = FavoritePlanet.query.filter_by(user_id = request_body['user_id'])
-    serialized_favorite_planets = list(map(lambda item: item.serialize()['planet'], favorite_planets_query))
+    # Insertar el favorito; las claves foráneas validan el usuario y el planeta/personaje
+    error = add_favorite(kind, user_id, item_id)
+    if error is not None:
+        return jsonify({"msg": error}), 400
 
-    response_body = {
-        "msg": "ok",
-        "total_favorites": len(serialized_favorite_characters) + len(serialized_favorite_planets),
-        "result": {
-            "favorite_characters": serialized_favorite_characters,
-            "favorite_planets": serialized_favorite_planets
-        }
-    }
+    # Devolver al frontend la lista de favoritos del usuario actualizada
+    return favorites_response(favorites_json(user_id)), 200
 
-    return jsonify(response_body), 200
 
+def delete_favorite_response(kind, item_key):
+    error, user_id, item_id = check_favorite_body(request.get_json(silent=True), item_key)
+    if error is not None:
+        return jsonify({"msg": error}), 400
 
-# ========== delete favorite planet ========== #
-@app.route('/favorites/planets', methods=['DELETE'])
-def delete_favorite_planet():
-    request_body = request.get_json(silent=True)
+    # Eliminar el favorito con un único DELETE
+    error = remove_favorite(kind, user_id, item_id)
+    if error is not None:
+        message, status_code = error
+        return jsonify({"msg": message}), status_code
 
-    # Chequear si la petición trajo datos en el body
-    if request_body is not None: 
-        print("Incoming request with the following body", request_body)
-    else:
-        return jsonify({"msg": f"Error: la petición no incluye datos en el body"}), 400
+    # Devolver al frontend la lista de favoritos del usuario actualizada
+    return favorites_response(favorites_json(user_id)), 200
 
-    # Chequear si el body trae los datos correctos del usuario
-    if request_body.get('user_id') is not None:
-        user_query = User.query.get(request_body['user_id'])
 
-        if user_query is None:
-            return jsonify({"msg": f"El usuario con id {request_body['user_id']} no existe."}), 400
-        
-    else:
-        return jsonify({"msg": f"Error: el body de la petición no incluye la propiedad user_id"}), 400
-    
-    # Chequear si el body trae los datos correctos del planeta
-    if request_body.get('planet_id') is not None:
-        planet_query = Planet.query.get(request_body['planet_id'])
-
-        if planet_query is None:
-            return jsonify({"msg": f"El planeta con id {request_body['planet_id']} no existe."}), 400
-        
-    else:
-        return jsonify({"msg": f"Error: el body de la petición no incluye la propiedad planet_id"}), 400
-     
-    # Obtener el registro a eliminar
-    favorite_planet = FavoritePlanet.query.filter_by(user_id = request_body['user_id'], planet_id = request_body['planet_id']).first()
-
-    if favorite_planet is not None:
-        # Eliminar el registro
-        db.session.delete(favorite_planet)
-        # Guardar los cambios realizados en la BD
-        db.session.commit()
-    else:
-        return jsonify({"msg": f"El planeta con id {request_body['planet_id']} no está incluido en los favoritos del usuario con id {request_body['user_id']}."})
+# ========== post favorite planet ========== #
+@app.route('/favorites/planets', methods=['POST'])
+def add_favorite_planet():
+    return add_favorite_response('planet', 'planet_id')
 
-    # Devolver al frontend la lista de favoritos del usuario actualizada
-    favorite_characters_query = FavoriteCharacter.query.filter_by(user_id = request_body['user_id'])
-    serialized_favorite_characters = list(map(lambda item: item.serialize()['character'], favorite_characters_query))
 
-    favorite_planets_query = FavoritePlanet.query.filter_by(user_id = request_body['user_id'])
-    serialized_favorite_planets = list(map(lambda item: item.serialize()['planet'], favorite_planets_query))
+# ========== post favorite character ========== #
+@app.route('/favorites/characters', methods=['POST'])
+def add_favorite_character():
+    return add_favorite_response('character', 'character_id')
 
-    response_body = {
-        "msg": "ok",
-        "total_favorites": len(serialized_favorite_characters) + len(serialized_favorite_planets),
-        "result": {
-            "favorite_characters": serialized_favorite_characters,
-            "favorite_planets": serialized_favorite_planets
-        }
-    }
 
-    return jsonify(response_body), 200
+# ========== delete favorite planet ========== #
+@app.route('/favorites/planets', methods=['DELETE'])
+def delete_favorite_planet():
+    return delete_favorite_response('planet', 'planet_id')
 
 
 # ========== delete favorite character ========== #
 @app.route('/favorites/characters', methods=['DELETE'])
 def delete_favorite_character():
-    request_body = request.get_json(silent=True)
-
-    # Chequear si la petición trajo datos en el body
-    if request_body is not None: 
-        print("Incoming request with the following body", request_body)
-    else:
-        return jsonify({"msg": f"Error: la petición no incluye datos en el body"}), 400
-
-    # Chequear si el body trae los datos correctos del usuario
-    if request_body.get('user_id') is not None:
-        user_query = User.query.get(request_body['user_id'])
-
-        if user_query is None:
-            return jsonify({"msg": f"El usuario con id {request_body['user_id']} no existe."}), 400
-        
-    else:
-        return jsonify({"msg": f"Error: el body de la petición no incluye la propiedad user_id"}), 400
-    
-    # Chequear si el body trae los datos correctos del personaje
-    if request_body.get('character_id') is not None:
-        character_query = Character.query.get(request_body['character_id'])
-
-        if character_query is None:
-            return jsonify({"msg": f"El personaje con id {request_body['character_id']} no existe."}), 400
-        
-    else:
-        return jsonify({"msg": f"Error: el body de la petición no incluye la propiedad character_id"}), 400
-     
-    # Obtener el registro a eliminar
-    favorite_character = FavoriteCharacter.query.filter_by(user_id = request_body['user_id'], character_id = request_body['character_id']).first()
-    
-    if favorite_character is not None:
-        # Eliminar el registro
-        db.session.delete(favorite_character)
-        # Guardar los cambios realizados en la BD
-        db.session.commit()
-    else:
-        return jsonify({"msg": f"El personaje con id {request_body['character_id']} no está incluido en los favoritos del usuario con id {request_body['user_id']}."})
-
+    return delete_favorite_response('character', 'character_id')
 
-    # Devolver al frontend la lista de favoritos del usuario actualizada
-    favorite_characters_query = FavoriteCharacter.query.filter_by(user_id = request_body['user_id'])
-    serialized_favorite_characters = list(map(lambda item: item.serialize()['character'], favorite_characters_query))
+# ========== batch favorites ========== #
+@app.route('/favorites/batch', methods=['POST'])
+def batch_favorites():
+    request_body = request.get_json(silent=True)
 
-    favorite_planets_query = FavoritePlanet.query.filter_by(user_id = request_body['user_id'])
-    serialized_favorite_planets = list(map(lambda item: item.serialize()['planet'], favorite_planets_query))
-
-    response_body = {
-        "msg": "ok",
-        "total_favorites": len(serialized_favorite_characters) + len(serialized_favorite_planets),
-        "result": {
-            "favorite_characters": serialized_favorite_characters,
-            "favorite_planets": serialized_favorite_planets
-        }
-    }
+    # Chequear si la petición trajo datos en el body (un objeto JSON)
+    if request_body is None:
+        return jsonify({"msg": "Error: la petición no incluye datos en el body"}), 400
+    if not isinstance(request_body, dict):
+        return jsonify({"msg": "Error: el body de la petición debe ser un objeto JSON"}), 400
+    if request_body.get('user_id') is None:
+        return jsonify({"msg": "Error: el body de la petición no incluye la propiedad user_id"}), 400
+    user_id = parse_id(request_body['user_id'])
+    if user_id is None:
+        return jsonify({"msg": "Error: la propiedad user_id debe ser un número entero"}), 400
+
+    operations = request_body.get('operations')
+    if not isinstance(operations, list):
+        return jsonify({"msg": "Error: el body de la petición no incluye la lista operations"}), 400
+    if len(operations) > BATCH_MAX_OPERATIONS:
+        return jsonify({"msg": f"Error: se permiten como máximo {BATCH_MAX_OPERATIONS} operaciones por petición"}), 400
+
+    # Todas las operaciones se aplican en una sola transacción
+    results = apply_batch(user_id, operations)
+    if results is None:
+        return jsonify({"msg": f"El usuario con id {user_id} no existe."}), 400
+
+    # Devolver el resultado de cada operación y la lista de favoritos actualizada
+    response_body = app.json.loads(favorites_json(user_id))
+    response_body["operations"] = results
 
     return jsonify(response_body), 200
 
 
-
 # this only runs if `$ python src/app.py` is executed
 if __name__ == '__main__':
     PORT = int(os.environ.get('PORT', 3000))
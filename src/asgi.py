@@ -0,0 +1,287 @@
+"""
+ASGI entry point with async handlers for the read endpoints
+
+    uvicorn asgi:application --app-dir src --workers 4
+
+GET /users, /users/<id>, /planets, /planets/<id>, /characters,
+/characters/<id> and /favorites/<user_id> run as coroutines on an async
+SQLAlchemy engine (aiosqlite / asyncpg), so a worker keeps serving other
+requests while it waits on the database. They reuse the argument parsing,
+statements, encoders, cache and ETag helpers of the Flask views inside a Flask
+request context. Everything else (writes, /search, streaming exports, admin)
+is served by the Flask app itself through asgiref's WSGI adapter; the sync
+`wsgi.py` entry point is unchanged.
+"""
+import io
+import re
+import sys
+from asgiref.wsgi import WsgiToAsgi
+from flask import g, jsonify, request
+from sqlalchemy.ext.asyncio import create_async_engine
+from app import app
+from cache import catalog_cache
+from conditional import add_validators, is_not_modified, request_versions, validators
+from favorites import dump_favorites, favorites_from_rows, favorites_response, favorites_statement, is_fresh, \
+    snapshot_statement
+from models import User, Planet, Character
+from pagination import count_query, encode_related, field_args, filtered_query, ids_arg, include_args, include_keys, \
+    list_args, lookup_body, lookup_query, page_body, page_query, projected_query, related_ids, related_statement, \
+    remember_count
+from pool import engine_options
+from serializers import row_encoder, selected_columns
+from streaming import wants_stream
+from utils import APIException
+from versioning import versions_from_rows, versions_statement
+
+# sync driver -> async driver for the same database
+ASYNC_DRIVERS = {
+    'sqlite': 'sqlite+aiosqlite',
+    'postgresql': 'postgresql+asyncpg',
+    'postgresql+psycopg2': 'postgresql+asyncpg',
+}
+
+
+def async_database_url(url):
+    scheme, separator, rest = url.partition('://')
+    if scheme not in ASYNC_DRIVERS:
+        raise RuntimeError(f"No async driver configured for '{scheme}' databases")
+    return ASYNC_DRIVERS[scheme] + separator + rest
+
+
+ASYNC_DATABASE_URL = async_database_url(app.config['SQLALCHEMY_DATABASE_URI'])
+engine = create_async_engine(ASYNC_DATABASE_URL, **engine_options(ASYNC_DATABASE_URL, instrumented=False))
+flask_application = WsgiToAsgi(app)
+
+
+# ========== handlers ========== #
+
+async def conditional_response(connection, tables, view):
+    # Same ETag / Last-Modified / 304 handling as the @conditional decorator
+    versions = versions_from_rows(tables, await connection.execute(versions_statement(*tables)))
+    etag, last_modified = validators(versions)
+    g._table_versions = versions
+
+    if is_not_modified(etag, last_modified):
+        return add_validators(app.response_class(status=304), etag, last_modified)
+
+    response = app.make_response(await view())
+    if response.status_code != 200:
+        return response
+    return add_validators(response, etag, last_modified)
+
+
+async def load_related(connection, related, ids):
+    if not ids:
+        return {}
+    return encode_related(related, (await connection.execute(related_statement(related, ids))).all())
+
+
+async def load_includes(connection, rows, includes):
+    return {name: (key, await load_related(connection, related, related_ids(rows, key)))
+            for name, (key, related) in includes.items()}
+
+
+async def list_response(connection, model, name):
+    ids = ids_arg()
+    if ids is not None:
+        fields = field_args(model)
+        includes = include_args(model)
+        rows = (await connection.execute(lookup_query(model, ids, fields, includes).statement)).all()
+        return jsonify(lookup_body(model, ids, rows, fields, await load_includes(connection, rows, includes))), 200
+
+    limit, cursor, fields, keys = list_args(model)
+    includes = include_args(model)
+    base_query = filtered_query(model, fields, keys, include_keys(includes))
+    result = await connection.execute(page_query(base_query, model, keys, limit, cursor).statement)
+    rows = result.all()
+
+    filtered = base_query if request.args.get('filter') else None
+    total, statement = count_query(model, filtered)
+    if statement is not None:
+        total = (await connection.execute(statement)).scalar()
+        remember_count(model, total, filtered)
+
+    rows, has_more = rows[:limit], len(rows) > limit
+    included = await load_includes(connection, rows, includes)
+    return jsonify(page_body(model, name, rows, has_more, fields, keys, total, included)), 200
+
+
+async def load_item(connection, model, item_id):
+    fields = tuple(model.projection())
+    result = await connection.execute(projected_query(model, fields).filter(model.id == item_id).statement)
+    row = result.first()
+    return row_encoder(selected_columns(model, fields), fields)(row) if row is not None else None
+
+
+async def cached_item(connection, namespace, model, item_id):
+    # Keyed by the versions conditional_response() built the ETag from
+    versions = request_versions()
+    value = catalog_cache.get(namespace, item_id, versions)
+    if value is None:
+        value = await load_item(connection, model, item_id)
+        catalog_cache.set(namespace, item_id, versions, value)
+    return value
+
+
+async def get_users(connection):
+    return await list_response(connection, User, 'users')
+
+
+async def get_user(connection, user_id):
+    user = await load_item(connection, User, user_id)
+    if user is None:
+        return jsonify({"msg": f"El usuario con id {user_id} no existe"}), 404
+    return jsonify(user), 200
+
+
+async def get_planets(connection):
+    async def view():
+        return await list_response(connection, Planet, 'planets')
+
+    return await conditional_response(connection, ('Planets',), view)
+
+
+async def get_planet(connection, planet_id):
+    async def view():
+        planet = await cached_item(connection, 'planets', Planet, planet_id)
+        if planet is None:
+            return jsonify({"msg": f"El planeta con id {planet_id} no existe"}), 404
+        return jsonify(planet), 200
+
+    return await conditional_response(connection, ('Planets',), view)
+
+
+async def get_characters(connection):
+    async def view():
+        return await list_response(connection, Character, 'characters')
+
+    return await conditional_response(connection, ('Characters', 'Planets'), view)
+
+
+async def get_character(connection, character_id):
+    async def view():
+        includes = include_args(Character)
+        character = await cached_item(connection, 'characters', Character, character_id)
+        if character is None:
+            return jsonify({"msg": f"El personaje con id {character_id} no existe"}), 404
+        if includes:
+            character = dict(character)
+            for name, (key, related) in includes.items():
+                character[name] = (await load_related(connection, related, {character[key]} - {None})).get(character[key])
+        return jsonify(character), 200
+
+    return await conditional_response(connection, ('Characters', 'Planets'), view)
+
+
+async def get_favorites_by_user(connection, user_id):
+    snapshot = (await connection.execute(snapshot_statement(user_id))).first()
+    if snapshot is not None and is_fresh(snapshot):
+        return favorites_response(snapshot.body), 200
+
+    # Missing or stale snapshot: built from the tables as in favorites_json(), without storing it
+    favorites = favorites_from_rows(await connection.execute(favorites_statement(user_id))) \
+        if snapshot is not None else None
+    if favorites is None:
+        return jsonify({"msg": f"El usuario con id {user_id} no existe"}), 404
+
+    return favorites_response(dump_favorites(favorites)), 200
+
+
+# path -> handler; the named groups are passed as int keyword arguments
+ROUTES = [
+    (re.compile(r'^/users/?$'), get_users),
+    (re.compile(r'^/users/(?P<user_id>\d+)/?$'), get_user),
+    (re.compile(r'^/planets/?$'), get_planets),
+    (re.compile(r'^/planets/(?P<planet_id>\d+)/?$'), get_planet),
+    (re.compile(r'^/characters/?$'), get_characters),
+    (re.compile(r'^/characters/(?P<character_id>\d+)/?$'), get_character),
+    (re.compile(r'^/favorites/(?P<user_id>\d+)/?$'), get_favorites_by_user),
+]
+
+# Streaming exports stay on the Flask views
+STREAMING_HANDLERS = (get_planets, get_characters)
+
+
+def wsgi_environ(scope):
+    # Enough of a WSGI environ for Flask to build the request of a GET
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf8').decode('latin1'),
+        'PATH_INFO': scope['path'].encode('utf8').decode('latin1'),
+        'QUERY_STRING': scope['query_string'].decode('latin1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': scope['client'][0] if scope.get('client') else '',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin1').upper().replace('-', '_')
+        key = name if name in ('CONTENT_TYPE', 'CONTENT_LENGTH') else f'HTTP_{name}'
+        value = value.decode('latin1')
+        environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
+
+
+def match_route(scope):
+    if scope['type'] != 'http' or scope['method'] != 'GET':
+        return None, None
+    for pattern, handler in ROUTES:
+        match = pattern.match(scope['path'])
+        if match is not None:
+            return handler, {name: int(value) for name, value in match.groupdict().items()}
+    return None, None
+
+
+async def dispatch(handler, params, scope):
+    """Run `handler` in a Flask request context; None means Flask should serve it."""
+    with app.request_context(wsgi_environ(scope)):
+        if handler in STREAMING_HANDLERS and wants_stream():
+            return None
+        try:
+            async with engine.connect() as connection:
+                rv = await handler(connection, **params)
+        except APIException as error:
+            rv = app.handle_user_exception(error)
+        # after_request handlers (CORS headers) run as for any Flask view
+        return app.process_response(app.make_response(rv))
+
+
+async def send_response(response, send):
+    await send({
+        'type': 'http.response.start',
+        'status': response.status_code,
+        'headers': [(name.lower().encode('latin1'), value.encode('latin1')) for name, value in response.headers.items()],
+    })
+    await send({'type': 'http.response.body', 'body': response.get_data()})
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await engine.dispose()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+
+    handler, params = match_route(scope)
+    if handler is not None:
+        response = await dispatch(handler, params, scope)
+        if response is not None:
+            return await send_response(response, send)
+
+    await flask_application(scope, receive, send)
@@ -0,0 +1,201 @@
+"""
+Read-through cache for catalog reads (planets and characters)
+
+Serialized rows are kept in an in-process LRU with a TTL and, optionally, in a
+shared backend (anything with a redis-like get/set/delete API). Entry keys
+include the TableVersions the row depends on, the same ones its ETag is built
+from (see conditional.py). Any write to those tables, in any process, moves
+every reader to new keys, so a cached body always matches its ETag. The
+entries of old versions are never read again and age out of the LRU / TTL.
+"""
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from models import Planet, Character
+
+# namespace -> TableVersions whose changes alter its entries (characters embed their home world name)
+NAMESPACE_TABLES = {
+    'planets': (Planet.__tablename__,),
+    'characters': (Character.__tablename__, Planet.__tablename__),
+}
+
+
+class LRUCache:
+    def __init__(self, maxsize=1024, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self, prefix=''):
+        with self._lock:
+            for key in [key for key in self._data if key.startswith(prefix)]:
+                del self._data[key]
+
+    def __len__(self):
+        return len(self._data)
+
+
+class MemoryClient:
+    """Local stand-in for a shared cache server (same calls as redis-py)."""
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or (entry[1] is not None and entry[1] < time.monotonic()):
+                return None
+            return entry[0]
+
+    def set(self, key, value, ex=None):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + ex if ex else None)
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def incr(self, key):
+        with self._lock:
+            value = int((self._data.get(key) or (0, None))[0]) + 1
+            self._data[key] = (value, None)
+            return value
+
+
+def versioned_key(namespace, key, versions):
+    # versions: {table name: (version, updated_at)}, as used for the ETag
+    return f"{key}@" + ".".join(str(versions[name][0]) for name in NAMESPACE_TABLES[namespace])
+
+
+class CatalogCache:
+    def __init__(self, local=None, shared=None, ttl=300, prefix='catalog'):
+        self.local = local if local is not None else LRUCache(ttl=ttl)
+        self.shared = shared
+        self.ttl = ttl
+        self.prefix = prefix
+        self.hits = 0
+        self.misses = 0
+        self.shared_hits = 0
+        # Requests of several threads update the counters
+        self._stats_lock = threading.Lock()
+
+    def _count(self, hit, shared=False):
+        with self._stats_lock:
+            if hit:
+                self.hits += 1
+                if shared:
+                    self.shared_hits += 1
+            else:
+                self.misses += 1
+
+    def _shared_key(self, namespace, key):
+        # Clearing a namespace bumps its generation, which orphans the old keys
+        generation = self.shared.get(f"{self.prefix}:{namespace}:generation") or 0
+        return f"{self.prefix}:{namespace}:{int(generation)}:{key}"
+
+    def get(self, namespace, key, versions):
+        key = versioned_key(namespace, key, versions)
+        local_key = f"{namespace}:{key}"
+        value = self.local.get(local_key)
+        if value is not None:
+            self._count(True)
+            return value
+
+        if self.shared is not None:
+            raw = self.shared.get(self._shared_key(namespace, key))
+            if raw is not None:
+                value = json.loads(raw)
+                self.local.set(local_key, value)
+                self._count(True, shared=True)
+                return value
+
+        self._count(False)
+        return None
+
+    def set(self, namespace, key, versions, value):
+        # `None` results are not cached so new rows show up immediately
+        if value is None:
+            return
+        key = versioned_key(namespace, key, versions)
+        self.local.set(f"{namespace}:{key}", value)
+        if self.shared is not None:
+            self.shared.set(self._shared_key(namespace, key), json.dumps(value), ex=self.ttl)
+
+    def get_or_load(self, namespace, key, versions, loader):
+        """Return the cached value for `key` at `versions` or call `loader()` and cache it."""
+        value = self.get(namespace, key, versions)
+        if value is None:
+            value = loader()
+            self.set(namespace, key, versions, value)
+        return value
+
+    def clear(self, namespace):
+        # Writes need no clear (they bump the versions); this empties the LRU of
+        # this process and orphans the shared entries
+        self.local.clear(f"{namespace}:")
+        if self.shared is not None:
+            self.shared.incr(f"{self.prefix}:{namespace}:generation")
+
+    def stats(self):
+        with self._stats_lock:
+            hits, misses, shared_hits = self.hits, self.misses, self.shared_hits
+        lookups = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "shared_hits": shared_hits,
+            "hit_ratio": hits / lookups if lookups else 0.0,
+            "local_entries": len(self.local),
+        }
+
+
+catalog_cache = CatalogCache()
+
+
+def _shared_client(url):
+    if url == 'memory://':
+        return MemoryClient()
+    import redis
+    return redis.Redis.from_url(url)
+
+
+def setup_cache(app):
+    app.config.setdefault('CATALOG_CACHE_SIZE', int(os.getenv('CATALOG_CACHE_SIZE', 1024)))
+    app.config.setdefault('CATALOG_CACHE_TTL', float(os.getenv('CATALOG_CACHE_TTL', 300)))
+    app.config.setdefault('CATALOG_CACHE_URL', os.getenv('CATALOG_CACHE_URL'))
+
+    ttl = app.config['CATALOG_CACHE_TTL']
+    catalog_cache.ttl = ttl
+    catalog_cache.local = LRUCache(maxsize=app.config['CATALOG_CACHE_SIZE'], ttl=ttl)
+    if app.config['CATALOG_CACHE_URL']:
+        catalog_cache.shared = _shared_client(app.config['CATALOG_CACHE_URL'])
+
@@ -0,0 +1,327 @@
+"""
+In-memory catalog snapshot (CATALOG_SNAPSHOT=1)
+
+Planets and characters are small, read-mostly reference data. With the snapshot
+on, every worker loads both tables on its first request into an immutable
+CatalogSnapshot. These GETs are then served from it without touching the
+database:
+- /planets/<id> and /characters/<id>;
+- the plain list pages (only ?limit, ?after and ?count);
+- their ETags, computed from the table versions the snapshot was loaded at.
+Other requests (?fields, ?filter, ?sort, ?include, streams, residents) read
+the database and take their ETag and cache keys from the TableVersions, as
+with the snapshot off, so a body is never paired with the versions of another
+copy of the data.
+
+Each table is a few parallel, compact structures sorted by id:
+- ids: an array('q'), binary searched;
+- bodies: a tuple with the JSON bytes of each row, exactly as
+  GET /<kind>/<id> sends it;
+- a name index: the names sorted in a tuple, plus an array('l') of positions.
+
+Measured with `python -m benchmarks.catalog_snapshot` (10k planets, 100k
+characters): about 300 bytes per planet and 345 per character, 340 per row as
+seen by tracemalloc. The JSON bytes are about 75% of that, the name index
+about 78 bytes and the id array 8. Loading takes about 1.2 s.
+
+A background thread compares the TableVersions with the snapshot every
+CATALOG_SNAPSHOT_POLL_SECONDS. On Postgres it also wakes up on NOTIFY
+catalog_versions, which every version bump sends. When the versions changed, it
+loads a new snapshot and swaps the reference. A request keeps the snapshot it
+started with, so it never sees half of a refresh. After this process commits a
+catalog write, reads go to the database until the next snapshot is loaded.
+"""
+import os
+import select
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from flask import current_app, g, has_request_context, request, url_for
+from sqlalchemy import event
+from sqlalchemy import select as select_statement
+from sqlalchemy.orm import Session
+from models import db, Planet, Character
+from pagination import encode_cursor, page_args
+from serializers import row_encoder
+from streaming import wants_stream
+from versioning import NOTIFY_CHANNEL, changed_tables, versions_from_rows, versions_statement
+
+TABLES = (Planet.__tablename__, Character.__tablename__)
+# Query arguments a list page can have and still be served from the snapshot
+PLAIN_LIST_ARGS = {'limit', 'after', 'count'}
+# Views that read from the snapshot
+SNAPSHOT_ENDPOINTS = {'get_planets', 'get_planet', 'get_characters', 'get_character'}
+
+
+class CatalogTable:
+    """Rows of one table sorted by id; never modified after construction."""
+
+    __slots__ = ('ids', 'bodies', 'names', 'name_positions')
+
+    def __init__(self, rows):
+        # rows: [(id, name, JSON bytes)] sorted by id
+        self.ids = array('q', [row[0] for row in rows])
+        self.bodies = tuple(row[2] for row in rows)
+        by_name = sorted(range(len(rows)), key=lambda index: rows[index][1])
+        self.names = tuple(rows[index][1] for index in by_name)
+        self.name_positions = array('l', by_name)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def body(self, item_id):
+        index = bisect_left(self.ids, item_id)
+        if index < len(self.ids) and self.ids[index] == item_id:
+            return self.bodies[index]
+        return None
+
+    def find(self, name):
+        """JSON bytes of the row called `name`, or None."""
+        index = bisect_left(self.names, name)
+        if index < len(self.names) and self.names[index] == name:
+            return self.bodies[self.name_positions[index]]
+        return None
+
+    def page(self, after_id, limit):
+        """(position of the first row, JSON bytes of up to `limit` rows with an id > after_id)."""
+        start = bisect_right(self.ids, after_id) if after_id is not None else 0
+        return start, self.bodies[start:start + limit]
+
+
+class CatalogSnapshot:
+    __slots__ = ('planets', 'characters', 'versions', 'separators')
+
+    def __init__(self, planets, characters, versions, separators):
+        self.planets = planets
+        self.characters = characters
+        self.versions = versions
+        self.separators = separators
+
+    def versions_of(self, tables):
+        return {name: self.versions[name] for name in tables}
+
+
+def _separators(dumps):
+    # (item separator, key separator) of the JSON backend, e.g. (',', ':') or (', ', ': ')
+    probe = dumps({"a": [0, 0]})
+    return probe[probe.index('0') + 1:probe.rindex('0')], probe[4:probe.index('[')]
+
+
+def load_snapshot(connection):
+    """Read both tables into a new CatalogSnapshot; runs in an app context."""
+    dumps = current_app.json.dumps
+    # Versions first: a write committed meanwhile makes the snapshot look older than
+    # its rows, which only causes one more reload
+    versions = versions_from_rows(TABLES, connection.execute(versions_statement(*TABLES)))
+    tables = []
+    for model in (Planet, Character):
+        columns = model.projection()
+        names = tuple(columns)
+        encode = row_encoder(names, names)
+        statement = select_statement(*[column.label(name) for name, column in columns.items()]).order_by(model.id)
+        tables.append(CatalogTable([(row.id, row.name, dumps(encode(row)).encode())
+                                    for row in connection.execute(statement)]))
+    return CatalogSnapshot(tables[0], tables[1], versions, _separators(dumps))
+
+
+class SnapshotEngine:
+    def __init__(self, poll_seconds=2.0, notify=True):
+        self.poll_seconds = poll_seconds
+        self.notify = notify
+        self.snapshot = None
+        self.loads = 0
+        self.load_seconds = None
+        self.pid = None
+        # Catalog commits of this process; reads skip the snapshot until one loaded after them
+        self.writes = 0
+        self.loaded_writes = 0
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+
+    def current(self):
+        if self.writes != self.loaded_writes:
+            return None
+        return self.snapshot
+
+    def mark_stale(self):
+        self.writes += 1
+        self._wake.set()
+
+    def refresh(self, force=False):
+        writes = self.writes
+        with db.engine.connect() as connection:
+            if not force and self.snapshot is not None:
+                versions = versions_from_rows(TABLES, connection.execute(versions_statement(*TABLES)))
+                if versions == self.snapshot.versions:
+                    self.loaded_writes = writes
+                    return False
+            started = time.perf_counter()
+            snapshot = load_snapshot(connection)
+        self.snapshot = snapshot
+        self.loaded_writes = writes
+        self.loads += 1
+        self.load_seconds = time.perf_counter() - started
+        return True
+
+    def ensure_started(self, app):
+        # First request of each process (after gunicorn forks): load, then keep it fresh
+        if self.pid == os.getpid():
+            return
+        with self._lock:
+            if self.pid == os.getpid():
+                return
+            try:
+                self.refresh(force=True)
+            except Exception:
+                # Missing tables, unreachable database...: served from the database until a poll succeeds
+                app.logger.exception('Could not load the catalog snapshot')
+            self.pid = os.getpid()
+            threading.Thread(target=self._run, args=(app,), name='catalog-snapshot', daemon=True).start()
+
+    def _listen(self):
+        # Postgres (psycopg2) connection waiting for NOTIFY catalog_versions, or None
+        if not self.notify or db.engine.dialect.name != 'postgresql' or db.engine.dialect.driver != 'psycopg2':
+            return None
+        # A connection of its own, outside the pool: it would hold a pool slot forever
+        # and show up in the pool statistics
+        cargs, cparams = db.engine.dialect.create_connect_args(db.engine.url)
+        connection = db.engine.dialect.connect(*cargs, **cparams)
+        connection.autocommit = True
+        with connection.cursor() as cursor:
+            cursor.execute(f'LISTEN {NOTIFY_CHANNEL}')
+        return connection
+
+    def _wait(self, listener):
+        if listener is None:
+            self._wake.wait(self.poll_seconds)
+        elif not self._wake.is_set():
+            select.select([listener], [], [], self.poll_seconds)
+            listener.poll()
+            listener.notifies.clear()
+        self._wake.clear()
+
+    def _run(self, app):
+        listener = None
+        while True:
+            try:
+                with app.app_context():
+                    if listener is None:
+                        listener = self._listen()
+                    self._wait(listener)
+                    self.refresh()
+            except Exception:
+                app.logger.exception('Could not refresh the catalog snapshot')
+                listener = None
+                time.sleep(self.poll_seconds)
+
+    def status(self):
+        snapshot = self.snapshot
+        return {
+            "loaded": snapshot is not None,
+            "planets": len(snapshot.planets) if snapshot else 0,
+            "characters": len(snapshot.characters) if snapshot else 0,
+            "versions": {name: version for name, (version, updated_at) in snapshot.versions.items()}
+            if snapshot else None,
+            "loads": self.loads,
+            "last_load_seconds": self.load_seconds,
+            "waiting_for_reload": self.writes != self.loaded_writes,
+        }
+
+
+_engine = None
+
+
+def catalog_snapshot():
+    """The snapshot this request reads from, or None to use the database."""
+    if _engine is None or not has_request_context():
+        return None
+    if '_catalog_snapshot' not in g:
+        _engine.ensure_started(current_app._get_current_object())
+        g._catalog_snapshot = _engine.current()
+    return g._catalog_snapshot
+
+
+def serves_request():
+    """Whether the snapshot can answer the current request as it is."""
+    if request.endpoint not in SNAPSHOT_ENDPOINTS or set(request.args) - PLAIN_LIST_ARGS or wants_stream():
+        return False
+    # The cursor of a sorted list needs its ORDER BY
+    limit, cursor = page_args()
+    return cursor is None or not cursor.get('keys')
+
+
+def request_snapshot():
+    """The snapshot that answers this request, or None when the body comes from the database.
+
+    conditional() builds the validators from it and the views read from it, so
+    both always agree on where the body comes from.
+    """
+    snapshot = catalog_snapshot()
+    if snapshot is None:
+        return None
+    if '_request_snapshot' not in g:
+        g._request_snapshot = snapshot if serves_request() else None
+    return g._request_snapshot
+
+
+def snapshot_status():
+    return _engine.status() if _engine is not None else None
+
+
+def json_response(body):
+    return current_app.response_class(body + b"\n", mimetype=current_app.json.mimetype)
+
+
+def page_response(snapshot, table, name):
+    """Response of a plain list page read from `table`, for a request_snapshot() request."""
+    limit, cursor = page_args()
+    start, bodies = table.page(cursor['id'] if cursor else None, limit)
+    next_cursor = next_url = None
+    if start + limit < len(table):
+        next_cursor = encode_cursor({"id": table.ids[start + limit - 1], "keys": []})
+        args = request.args.to_dict()
+        args['after'] = next_cursor
+        next_url = url_for(request.endpoint, **args)
+
+    # Same document as page_body() with the rows spliced in as pre-encoded bytes
+    item_separator, key_separator = snapshot.separators
+    dumps = current_app.json.dumps
+    head = dumps({"msg": "ok", "next": next_url, "next_cursor": next_cursor})[:-1]
+    parts = [head, item_separator, '"result"', key_separator, '[']
+    tail = [']']
+    if request.args.get('count', 'estimate') != 'none':
+        tail += [item_separator, dumps(f'total_{name}'), key_separator, str(len(table))]
+    tail.append('}')
+    body = ''.join(parts).encode() + item_separator.encode().join(bodies) + ''.join(tail).encode()
+    return json_response(body)
+
+
+def _after_flush(session, flush_context):
+    if changed_tables(session):
+        session.info['catalog_snapshot_stale'] = True
+
+
+def _after_commit(session):
+    if session.info.pop('catalog_snapshot_stale', False) and _engine is not None:
+        _engine.mark_stale()
+
+
+def _after_rollback(session):
+    session.info.pop('catalog_snapshot_stale', None)
+
+
+def setup_catalog_snapshot(app):
+    global _engine
+    app.config.setdefault('CATALOG_SNAPSHOT', os.getenv('CATALOG_SNAPSHOT', '0').lower() in ('1', 'true', 'yes'))
+    app.config.setdefault('CATALOG_SNAPSHOT_POLL_SECONDS', float(os.getenv('CATALOG_SNAPSHOT_POLL_SECONDS', 2)))
+    app.config.setdefault('CATALOG_SNAPSHOT_NOTIFY',
+                          os.getenv('CATALOG_SNAPSHOT_NOTIFY', '1').lower() in ('1', 'true', 'yes'))
+    if not app.config['CATALOG_SNAPSHOT']:
+        return
+
+    _engine = SnapshotEngine(app.config['CATALOG_SNAPSHOT_POLL_SECONDS'], app.config['CATALOG_SNAPSHOT_NOTIFY'])
+    if not event.contains(Session, 'after_flush', _after_flush):
+        event.listen(Session, 'after_flush', _after_flush)
+        event.listen(Session, 'after_commit', _after_commit)
+        event.listen(Session, 'after_rollback', _after_rollback)
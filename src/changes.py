@@ -0,0 +1,273 @@
+"""
+Change log for incremental sync (GET /changes?since=<version>)
+
+Every committed transaction that writes planets, characters, users or
+favorites adds one ChangeLog row per changed row. All rows of a transaction
+share one version, taken from the "ChangeLog" counter in TableVersions right
+before COMMIT. Writers wait on that row lock, so versions follow the commit
+order: a client that has seen version N can never miss a change with a lower
+version that commits later.
+
+Sources:
+- ORM writes (admin views and scripts), through mapper events;
+- the favorites service and the resident counters, which write with Core
+  statements and call record_change() themselves;
+- bulk loads, which skip both and add a "reset" entry instead.
+
+Clients apply the changes in order, treating insert and update as upserts,
+and keep the returned version. A "reset" newer than their version means they
+have to download everything again and continue from the version of that
+response. `flask compact-changes` first drops every entry superseded by a
+later change of the same row, which loses nothing. It then drops the entries
+older than --days and leaves a reset entry at the horizon.
+"""
+from datetime import datetime, timedelta
+import click
+from flask import request, url_for
+from sqlalchemy import delete, event, exists, func, insert, or_, select, update
+from sqlalchemy.orm import Session, aliased, object_session
+from sqlalchemy.orm.attributes import get_history
+from models import db, User, Planet, Character, FavoritePlanet, FavoriteCharacter, TableVersion, ChangeLog
+from pagination import DEFAULT_LIMIT, MAX_LIMIT, encode_related, related_statement
+from utils import APIException
+
+COUNTER = 'ChangeLog'
+RESET = 'reset'
+
+# model -> (kind, attribute with the row id, attribute with the owner user id or None)
+LOGGED_MODELS = {
+    Planet: ('planets', 'id', None),
+    Character: ('characters', 'id', None),
+    User: ('users', 'id', 'id'),
+    FavoritePlanet: ('favorite_planets', 'planet_id', 'user_id'),
+    FavoriteCharacter: ('favorite_characters', 'character_id', 'user_id'),
+}
+# kind -> model whose current row is sent with inserts and updates
+DATA_MODELS = {
+    'planets': Planet,
+    'characters': Character,
+    'users': User,
+    'favorite_planets': Planet,
+    'favorite_characters': Character,
+}
+
+
+def record_change(session, kind, row_id, operation, user_id=None):
+    """Queue a change, written to the ChangeLog when `session` commits."""
+    pending = session.info.setdefault('change_log', {})
+    key = (kind, row_id, user_id)
+    previous = pending.pop(key, None)
+    if previous == 'insert':
+        if operation == 'delete':
+            # Nobody ever saw the row
+            return
+        operation = 'insert'
+    pending[key] = operation
+
+
+def _keys(target, history_index=None):
+    # (row id, user id) of a logged object; history_index 0 = before the flush
+    kind, row_attribute, user_attribute = LOGGED_MODELS[type(target)]
+    values = []
+    for attribute in (row_attribute, user_attribute):
+        if attribute is None:
+            values.append(None)
+        elif history_index is None:
+            values.append(getattr(target, attribute))
+        else:
+            history = get_history(target, attribute)
+            values.append((history.deleted or history.unchanged or history.added or [None])[0])
+    return kind, values[0], values[1]
+
+
+def _inserted(mapper, connection, target):
+    kind, row_id, user_id = _keys(target)
+    record_change(object_session(target), kind, row_id, 'insert', user_id)
+
+
+def _updated(mapper, connection, target):
+    session = object_session(target)
+    if not session.is_modified(target, include_collections=False):
+        return
+    kind, old_row_id, old_user_id = _keys(target, 0)
+    kind, row_id, user_id = _keys(target)
+    if (old_row_id, old_user_id) != (row_id, user_id):
+        # e.g. a favorite moved to another planet through the admin
+        record_change(session, kind, old_row_id, 'delete', old_user_id)
+        record_change(session, kind, row_id, 'insert', user_id)
+    else:
+        record_change(session, kind, row_id, 'update', user_id)
+
+
+def _deleting(mapper, connection, target):
+    # Before the DELETE, while expired attributes can still be loaded
+    kind, row_id, user_id = _keys(target, 0)
+    record_change(object_session(target), kind, row_id, 'delete', user_id)
+
+
+def next_version(connection):
+    """Bump the ChangeLog counter; the row stays locked until the transaction ends."""
+    table = TableVersion.__table__
+    now = datetime.utcnow()
+    result = connection.execute(
+        update(table).where(table.c.name == COUNTER).values(version=table.c.version + 1, updated_at=now))
+    if result.rowcount == 0:
+        connection.execute(insert(table).values(name=COUNTER, version=1, updated_at=now))
+    return connection.execute(select(table.c.version).where(table.c.name == COUNTER)).scalar()
+
+
+def current_version(connection):
+    table = TableVersion.__table__
+    return connection.execute(select(table.c.version).where(table.c.name == COUNTER)).scalar() or 0
+
+
+def log_reset(connection):
+    """Tell every client to download everything again, after writes that skip the mapper events."""
+    connection.execute(insert(ChangeLog.__table__).values(
+        version=next_version(connection), kind='*', row_id=0, operation=RESET, changed_at=datetime.utcnow()))
+
+
+def _before_commit(session):
+    # The last flush of commit() runs after this hook
+    session.flush()
+    pending = session.info.pop('change_log', None)
+    if not pending:
+        return
+    connection = session.connection()
+    version = next_version(connection)
+    now = datetime.utcnow()
+    connection.execute(insert(ChangeLog.__table__), [
+        {'version': version, 'kind': kind, 'row_id': row_id, 'user_id': user_id, 'operation': operation,
+         'changed_at': now}
+        for (kind, row_id, user_id), operation in pending.items()
+    ])
+
+
+def _after_rollback(session):
+    session.info.pop('change_log', None)
+
+
+# ========== feed ========== #
+
+def _page(since, user_id, limit):
+    table = ChangeLog.__table__
+    scope = table.c.user_id.is_(None) if user_id is None else or_(table.c.user_id.is_(None),
+                                                                  table.c.user_id == user_id)
+    statement = select(table.c.id, table.c.version, table.c.kind, table.c.row_id, table.c.operation) \
+        .where(table.c.version > since, scope).order_by(table.c.version, table.c.id)
+    rows = db.session.execute(statement.limit(limit + 1)).all()
+    if len(rows) <= limit:
+        return rows, False
+
+    # Pages end between two versions, so the next one can start after the last version sent
+    cut = rows[limit].version
+    if rows[0].version == cut:
+        # A transaction bigger than a page is sent whole
+        return db.session.execute(statement.where(table.c.version == cut)).all(), True
+    return [row for row in rows if row.version < cut], True
+
+
+def _data(latest):
+    # One IN query per model for the current rows of the inserts and updates
+    ids = {}
+    for row in latest:
+        if row.operation != 'delete':
+            ids.setdefault(DATA_MODELS[row.kind], set()).add(row.row_id)
+    return {model: encode_related(model, db.session.execute(related_statement(model, model_ids)))
+            for model, model_ids in ids.items()}
+
+
+def changes_body(since, user_id, limit):
+    """Body of GET /changes: the changes after `since`, newest state of each row only."""
+    table = ChangeLog.__table__
+    # Read first: every version up to it is committed, so a page that reaches the end may skip to it
+    version = current_version(db.session.connection())
+    reset = db.session.execute(
+        select(func.max(table.c.version)).where(table.c.version > since, table.c.operation == RESET)).scalar()
+    if reset is not None or since > version:
+        # since > version: a client of a database restored from an older backup
+        return {"msg": "ok", "reset": True, "since": since, "version": max(version, reset or 0), "has_more": False,
+                "next": None, "changes": []}
+
+    rows, has_more = _page(since, user_id, limit)
+    latest = {}
+    for row in rows:
+        latest.pop((row.kind, row.row_id), None)
+        latest[(row.kind, row.row_id)] = row
+    data = _data(latest.values())
+
+    changes = [{
+        "version": row.version,
+        "type": row.kind,
+        "id": row.row_id,
+        "op": row.operation,
+        "data": None if row.operation == 'delete' else data[DATA_MODELS[row.kind]].get(row.row_id),
+    } for row in latest.values()]
+
+    last = rows[-1].version if rows else since
+    new_version = last if has_more else max(last, version)
+    next_url = None
+    if has_more:
+        args = request.args.to_dict()
+        args['since'] = new_version
+        next_url = url_for(request.endpoint, **args)
+    return {"msg": "ok", "reset": False, "since": since, "version": new_version, "has_more": has_more,
+            "next": next_url, "changes": changes}
+
+
+def changes_args():
+    """(since, user_id, limit) of GET /changes."""
+    since = request.args.get('since', type=int)
+    if since is None or since < 0:
+        raise APIException("El parámetro since debe ser una versión (0 para empezar)", status_code=400)
+    user_id = request.args.get('user_id', type=int)
+    if 'user_id' in request.args and user_id is None:
+        raise APIException("El parámetro user_id no es válido", status_code=400)
+    limit = max(1, min(request.args.get('limit', DEFAULT_LIMIT, type=int), MAX_LIMIT))
+    return since, user_id, limit
+
+
+# ========== compaction ========== #
+
+def collapse(connection):
+    """Delete the entries superseded by a later change of the same row; returns how many."""
+    table = ChangeLog.__table__
+    later = aliased(table)
+    superseded = exists().where(later.c.kind == table.c.kind, later.c.row_id == table.c.row_id,
+                                later.c.user_id.is_not_distinct_from(table.c.user_id),
+                                later.c.version > table.c.version)
+    return connection.execute(delete(table).where(superseded)).rowcount
+
+
+def truncate(connection, before):
+    """Delete the entries older than `before`, leaving a reset entry at the newest version deleted."""
+    table = ChangeLog.__table__
+    horizon = connection.execute(select(func.max(table.c.version))
+                                 .where(table.c.changed_at < before, table.c.operation != RESET)).scalar()
+    if horizon is None:
+        return 0, None
+    deleted = connection.execute(delete(table).where(table.c.version <= horizon)).rowcount
+    connection.execute(insert(table).values(version=horizon, kind='*', row_id=0, operation=RESET,
+                                            changed_at=datetime.utcnow()))
+    return deleted, horizon
+
+
+def setup_changes(app):
+    if not event.contains(Session, 'before_commit', _before_commit):
+        for model in LOGGED_MODELS:
+            event.listen(model, 'after_insert', _inserted)
+            event.listen(model, 'after_update', _updated)
+            event.listen(model, 'before_delete', _deleting)
+        event.listen(Session, 'before_commit', _before_commit)
+        event.listen(Session, 'after_rollback', _after_rollback)
+
+    @app.cli.command('compact-changes')
+    @click.option('--days', type=float, default=30, show_default=True,
+                  help='Keep this many days of history; older clients resync from scratch')
+    def compact_changes(days):
+        """Compact the change log behind GET /changes."""
+        with db.engine.begin() as connection:
+            collapsed = collapse(connection)
+            truncated, horizon = truncate(connection, datetime.utcnow() - timedelta(days=days))
+        click.echo(f'{collapsed} superseded entries removed, {truncated} entries older than {days:g} days removed'
+                   + (f' (clients before version {horizon} resync)' if horizon is not None else ''))
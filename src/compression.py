@@ -0,0 +1,179 @@
+"""
+Response compression: gzip, plus brotli and zstd when the `brotli` /
+`zstandard` packages are installed
+
+JSON, NDJSON and text responses of at least COMPRESSION_MIN_SIZE bytes are
+compressed with the best encoding of the request's Accept-Encoding
+(COMPRESSION_ENCODINGS breaks ties, in server preference order). Streamed
+exports are compressed chunk by chunk.
+
+Responses with a strong ETag (the catalog endpoints, see conditional.py) always
+have the same body for the same ETag, so their compressed bodies are kept in an
+LRU keyed by ETag and encoding, and a repeated hit skips the compression.
+Compressed responses get the ETag of the identity body with "-<encoding>"
+appended, so caches never mix the two, and conditional requests accept either.
+"""
+import gzip
+import os
+import time
+import zlib
+from flask import current_app, request
+from cache import LRUCache
+from profiler import current_profile
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COMPRESSIBLE_MIMETYPES = ('application/json', 'application/x-ndjson', 'text/html', 'text/plain', 'text/css',
+                          'text/javascript', 'application/javascript')
+ALL_ENCODINGS = ('br', 'zstd', 'gzip')
+
+# ETag:encoding -> compressed body
+compressed_bodies = LRUCache()
+
+
+def _gzip(level):
+    # mtime=0: the same body always compresses to the same bytes
+    def compress(data):
+        return gzip.compress(data, compresslevel=level, mtime=0)
+
+    def stream():
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+        return lambda data: compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH), compressor.flush
+
+    return compress, stream
+
+
+def _brotli(quality):
+    def compress(data):
+        return brotli.compress(data, quality=quality)
+
+    def stream():
+        compressor = brotli.Compressor(quality=quality)
+        return lambda data: compressor.process(data) + compressor.flush(), compressor.finish
+
+    return compress, stream
+
+
+def _zstd(level):
+    def compress(data):
+        return zstandard.ZstdCompressor(level=level).compress(data)
+
+    def stream():
+        compressor = zstandard.ZstdCompressor(level=level).compressobj()
+        return lambda data: compressor.compress(data) + compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK), \
+            compressor.flush
+
+    return compress, stream
+
+
+def available_encoders(config):
+    """{encoding: (compress(bytes), stream())} for the configured encodings that can be used."""
+    factories = {
+        'gzip': lambda: _gzip(config['COMPRESSION_GZIP_LEVEL']),
+        'br': (lambda: _brotli(config['COMPRESSION_BROTLI_QUALITY'])) if brotli is not None else None,
+        'zstd': (lambda: _zstd(config['COMPRESSION_ZSTD_LEVEL'])) if zstandard is not None else None,
+    }
+    return {name: factories[name]() for name in config['COMPRESSION_ENCODINGS'] if factories.get(name) is not None}
+
+
+def encoded_etag(etag, encoding):
+    return f'{etag}-{encoding}'
+
+
+def etag_variants(etag):
+    """The ETag of the identity body and of every compressed one."""
+    return (etag,) + tuple(encoded_etag(etag, encoding) for encoding in ALL_ENCODINGS)
+
+
+def negotiate(encoders):
+    if not encoders:
+        return None
+    return request.accept_encodings.best_match(list(encoders))
+
+
+def _compress_stream(chunks, stream):
+    compress, finish = stream()
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode()
+        data = compress(chunk)
+        if data:
+            yield data
+    yield finish()
+
+
+def _compress_response(response):
+    config = current_app.config
+    if response.status_code == 304:
+        # Same ETag as the 200 the client has
+        encoders = current_app.extensions['compression']
+        encoding = negotiate(encoders)
+        etag, weak = response.get_etag()
+        if encoding and etag and request.if_none_match.contains(encoded_etag(etag, encoding)):
+            response.set_etag(encoded_etag(etag, encoding), weak)
+        return response
+
+    if response.status_code < 200 or response.status_code == 204 or request.method == 'HEAD' \
+            or 'Content-Encoding' in response.headers or response.mimetype not in COMPRESSIBLE_MIMETYPES \
+            or response.direct_passthrough:
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encoders = current_app.extensions['compression']
+    encoding = negotiate(encoders)
+    if encoding is None:
+        return response
+    compress, stream = encoders[encoding]
+    etag, weak = response.get_etag()
+
+    if response.is_streamed:
+        response.response = _compress_stream(response.response, stream)
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < config['COMPRESSION_MIN_SIZE']:
+            return response
+
+        started = time.perf_counter()
+        key = f'{etag}:{encoding}' if etag and not weak else None
+        compressed = compressed_bodies.get(key) if key else None
+        if compressed is None:
+            compressed = compress(data)
+            if key:
+                compressed_bodies.set(key, compressed)
+        response.set_data(compressed)
+
+        profile = current_profile()
+        if profile is not None:
+            profile.compress_seconds += time.perf_counter() - started
+
+    response.headers['Content-Encoding'] = encoding
+    if etag:
+        response.set_etag(encoded_etag(etag, encoding), weak)
+    return response
+
+
+def setup_compression(app):
+    """Register the compression hook; call after setup_metrics() so /metrics counts the bytes sent."""
+    app.config.setdefault('COMPRESSION_ENABLED', os.getenv('COMPRESSION_ENABLED', '1').lower() in ('1', 'true', 'yes'))
+    app.config.setdefault('COMPRESSION_MIN_SIZE', int(os.getenv('COMPRESSION_MIN_SIZE', 1024)))
+    app.config.setdefault('COMPRESSION_ENCODINGS',
+                          [name.strip() for name in os.getenv('COMPRESSION_ENCODINGS', 'zstd,br,gzip').split(',')])
+    app.config.setdefault('COMPRESSION_GZIP_LEVEL', int(os.getenv('COMPRESSION_GZIP_LEVEL', 6)))
+    app.config.setdefault('COMPRESSION_BROTLI_QUALITY', int(os.getenv('COMPRESSION_BROTLI_QUALITY', 4)))
+    app.config.setdefault('COMPRESSION_ZSTD_LEVEL', int(os.getenv('COMPRESSION_ZSTD_LEVEL', 3)))
+    app.config.setdefault('COMPRESSION_CACHE_SIZE', int(os.getenv('COMPRESSION_CACHE_SIZE', 256)))
+    if not app.config['COMPRESSION_ENABLED']:
+        return
+
+    compressed_bodies.maxsize = app.config['COMPRESSION_CACHE_SIZE']
+    app.extensions['compression'] = available_encoders(app.config)
+    app.after_request(_compress_response)
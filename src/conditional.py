@@ -0,0 +1,85 @@
+"""
+HTTP conditional requests (ETag / Last-Modified / 304) for the catalog endpoints
+"""
+import hashlib
+import os
+from functools import wraps
+from flask import current_app, g, make_response, request
+from catalog_snapshot import request_snapshot
+from compression import etag_variants
+from versioning import table_versions
+
+DEFAULT_CACHE_CONTROL = os.getenv("CACHE_CONTROL_DEFAULT", "no-cache")
+
+
+def cache_control_for(endpoint, default):
+    # Per route override: CACHE_CONTROL = {"get_planets": "public, max-age=60"}
+    # in the app config or CACHE_CONTROL_GET_PLANETS in the environment
+    configured = current_app.config.get('CACHE_CONTROL', {})
+    if endpoint in configured:
+        return configured[endpoint]
+    return os.getenv(f"CACHE_CONTROL_{endpoint.upper()}", default)
+
+
+def make_etag(versions):
+    # The same URL, representation and table versions always give the same
+    # body, so this is a strong validator
+    parts = [request.full_path, request.headers.get('Accept', '')]
+    parts += [f"{name}:{versions[name][0]}" for name in sorted(versions)]
+    return hashlib.sha1('|'.join(parts).encode()).hexdigest()[:20]
+
+
+def validators(versions):
+    """Return the (ETag, Last-Modified) of the current request for `versions`."""
+    modified = [updated_at for version, updated_at in versions.values() if updated_at is not None]
+    return make_etag(versions), max(modified).replace(microsecond=0) if modified else None
+
+
+def is_not_modified(etag, last_modified):
+    if request.if_none_match:
+        # Clients that got a compressed body send back its ETag
+        return any(request.if_none_match.contains(tag) for tag in etag_variants(etag))
+    if request.if_modified_since is not None and last_modified is not None:
+        return last_modified <= request.if_modified_since.replace(tzinfo=None)
+    return False
+
+
+def add_validators(response, etag, last_modified, cache_control=None):
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.headers['Cache-Control'] = cache_control_for(request.endpoint, cache_control or DEFAULT_CACHE_CONTROL)
+    response.vary.add('Accept')
+    return response
+
+
+def request_versions():
+    """The TableVersions the ETag of this request was computed from."""
+    return g._table_versions
+
+
+def conditional(*tables, cache_control=None):
+    """Answer If-None-Match / If-Modified-Since with 304 before running the view.
+
+    `tables` are the TableVersions names whose changes can alter the body.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            # The versions the catalog snapshot was loaded at when it answers the request
+            snapshot = request_snapshot()
+            versions = snapshot.versions_of(tables) if snapshot is not None else table_versions(*tables)
+            etag, last_modified = validators(versions)
+            # The catalog cache keys its entries by the same versions
+            g._table_versions = versions
+
+            if is_not_modified(etag, last_modified):
+                response = current_app.response_class(status=304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+
+            return add_validators(response, etag, last_modified, cache_control)
+        return wrapper
+    return decorator
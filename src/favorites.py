@@ -0,0 +1,460 @@
+"""
+Favorites service shared by the /favorites endpoints
+
+Writes are a single INSERT ... ON CONFLICT DO NOTHING or DELETE that rely on
+the foreign keys to validate user and planet/character ids; the existence
+queries only run on the error path. Every write also adjusts the favorite
+counts of the leaderboards (popularity.py). The favorites list of a user is read with
+one UNION ALL query that also tells whether the user exists.
+
+GET /favorites/<user_id> is served from FavoriteSnapshots, the response body
+already serialized to JSON, with one primary-key lookup. Writes lock the
+user's snapshot row, so the writes of one user run one at a time, and patch
+the stored body with the added/removed items in the same transaction. A
+snapshot built from older Planets/Characters versions (or one invalidated by
+an admin edit) is answered with the UNION ALL query instead, without writing
+anything: reads stay read-only. The user's next favorites write stores a
+fresh snapshot, and `flask refresh-favorites` rebuilds every missing or stale
+one (bulk loads run it too). Run it after `flask db upgrade` and after catalog
+edits, or periodically, so that users who only read get the one-lookup path.
+"""
+import os
+from itertools import chain
+import click
+from flask import current_app
+from sqlalchemy import Integer, cast, delete, event, func, inspect, insert, literal, literal_column, null, or_, select, \
+    union_all, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from changes import record_change
+from popularity import count_favorites
+from models import db, User, Planet, Character, FavoritePlanet, FavoriteCharacter, FavoriteSnapshot, TableVersion
+from serializers import row_encoder
+
+BATCH_MAX_OPERATIONS = int(os.getenv("BATCH_MAX_OPERATIONS", 500))
+REFRESH_BATCH_SIZE = int(os.getenv("FAVORITES_REFRESH_BATCH_SIZE", 500))
+# Largest value of an Integer primary key
+MAX_ID = 2 ** 31 - 1
+
+# kind -> (favorite model, catalog model, id property in the request, name used in messages)
+KINDS = {
+    'planet': (FavoritePlanet, Planet, 'planet_id', 'El planeta'),
+    'character': (FavoriteCharacter, Character, 'character_id', 'El personaje'),
+}
+# kind -> list in the favorites body
+RESULT_KEYS = {'planet': 'favorite_planets', 'character': 'favorite_characters'}
+
+
+def _insert_ignoring_duplicates(table):
+    dialect = db.engine.dialect.name
+    if dialect == 'postgresql':
+        return postgresql.insert(table).on_conflict_do_nothing()
+    if dialect == 'sqlite':
+        return sqlite.insert(table).on_conflict_do_nothing()
+    return insert(table)
+
+
+def parse_id(value):
+    """The id sent in a JSON body as an int, or None when it is not one.
+
+    Numeric strings ("2") are accepted as before; the stored snapshots compare
+    ids as ints.
+    """
+    if isinstance(value, str) and value.isdigit():
+        value = int(value)
+    if not isinstance(value, int) or isinstance(value, bool) or not 0 <= value <= MAX_ID:
+        return None
+    return value
+
+
+def _exists(model, item_id):
+    return db.session.query(model.id).filter(model.id == item_id).first() is not None
+
+
+def _missing_reference(kind, user_id, item_id):
+    # Only runs after a failed write, to tell the client which id was wrong
+    favorite_model, item_model, id_key, label = KINDS[kind]
+    if not _exists(User, user_id):
+        return f"El usuario con id {user_id} no existe."
+    if not _exists(item_model, item_id):
+        return f"{label} con id {item_id} no existe."
+    return None
+
+
+def add_favorite(kind, user_id, item_id):
+    """Add a favorite; return None or an error message for a 400."""
+    favorite_model, item_model, id_key, label = KINDS[kind]
+    statement = _insert_ignoring_duplicates(favorite_model.__table__).values(**{'user_id': user_id, id_key: item_id})
+
+    try:
+        snapshot = lock_snapshot(user_id)
+        result = db.session.execute(statement)
+        if result.rowcount:
+            count_favorites(db.session, kind, added=[item_id])
+        if snapshot is not None and (result.rowcount or not is_fresh(snapshot)):
+            # A duplicate only rebuilds a stale snapshot; it is no change for the log
+            write_snapshot(snapshot, {kind: ([item_id], ())} if result.rowcount else {})
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return _missing_reference(kind, user_id, item_id) or "Error: no se pudo guardar el favorito."
+    return None
+
+
+def remove_favorite(kind, user_id, item_id):
+    """Remove a favorite; return None or an (error message, status code) tuple."""
+    favorite_model, item_model, id_key, label = KINDS[kind]
+    table = favorite_model.__table__
+    snapshot = lock_snapshot(user_id)
+    result = db.session.execute(
+        delete(table).where(table.c.user_id == user_id, table.c[id_key] == item_id)
+    )
+    if result.rowcount:
+        count_favorites(db.session, kind, removed=[item_id])
+    if snapshot is not None and (result.rowcount or not is_fresh(snapshot)):
+        write_snapshot(snapshot, {kind: ((), {item_id})} if result.rowcount else {})
+    db.session.commit()
+
+    if result.rowcount > 0:
+        return None
+
+    missing = _missing_reference(kind, user_id, item_id)
+    if missing is not None:
+        return missing, 400
+    return f"{label} con id {item_id} no está incluido en los favoritos del usuario con id {user_id}.", 200
+
+
+def _validate_operation(operation):
+    if not isinstance(operation, dict):
+        return "La operación debe ser un objeto"
+    if operation.get('op') not in ('add', 'remove'):
+        return "La propiedad op debe ser 'add' o 'remove'"
+    if operation.get('type') not in KINDS:
+        return "La propiedad type debe ser 'planet' o 'character'"
+    if parse_id(operation.get('id')) is None:
+        return "La propiedad id debe ser un número entero"
+    return None
+
+
+def apply_batch(user_id, operations):
+    """Apply add/remove operations for one user in a single transaction.
+
+    Returns the per-operation results, or None when the user does not exist.
+    Operations are replayed in order against the user's current favorites, so
+    only the net difference is written: one bulk INSERT and one bulk DELETE
+    per favorites table.
+    """
+    # Also tells whether the user exists
+    snapshot = lock_snapshot(user_id)
+    if snapshot is None:
+        db.session.rollback()
+        return None
+
+    results = []
+    requested = {kind: set() for kind in KINDS}
+    for operation in operations:
+        error = _validate_operation(operation)
+        fields = operation if isinstance(operation, dict) else {}
+        results.append({
+            "op": fields.get('op'),
+            "type": fields.get('type'),
+            "id": fields.get('id') if error else parse_id(fields['id']),
+            "status": "invalid" if error else None,
+            "msg": error
+        })
+        if error is None:
+            requested[operation['type']].add(results[-1]["id"])
+
+    # One IN (...) query per table for the referenced ids and the current favorites
+    existing_items = {}
+    current = {}
+    for kind, ids in requested.items():
+        favorite_model, item_model, id_key, label = KINDS[kind]
+        existing_items[kind] = set()
+        current[kind] = set()
+        if not ids:
+            continue
+        existing_items[kind] = {row[0] for row in db.session.query(item_model.id).filter(item_model.id.in_(ids))}
+        item_column = getattr(favorite_model, id_key)
+        current[kind] = {row[0] for row in db.session.query(item_column).filter(
+            favorite_model.user_id == user_id, item_column.in_(ids))}
+
+    final = {kind: set(ids) for kind, ids in current.items()}
+    for result in results:
+        if result["status"] is not None:
+            continue
+        kind, item_id = result["type"], result["id"]
+        if result["op"] == 'add':
+            if item_id not in existing_items[kind]:
+                result["status"] = "not_found"
+                result["msg"] = f"{KINDS[kind][3]} con id {item_id} no existe."
+            elif item_id in final[kind]:
+                result["status"] = "unchanged"
+            else:
+                final[kind].add(item_id)
+                result["status"] = "added"
+        elif item_id in final[kind]:
+            final[kind].discard(item_id)
+            result["status"] = "removed"
+        else:
+            result["status"] = "not_favorite"
+
+    changes = {}
+    for kind in KINDS:
+        favorite_model, item_model, id_key, label = KINDS[kind]
+        table = favorite_model.__table__
+        to_insert = sorted(final[kind] - current[kind])
+        to_delete = current[kind] - final[kind]
+        if to_insert:
+            db.session.execute(_insert_ignoring_duplicates(table),
+                               [{'user_id': user_id, id_key: item_id} for item_id in to_insert])
+        if to_delete:
+            db.session.execute(delete(table).where(table.c.user_id == user_id, table.c[id_key].in_(to_delete)))
+        if to_insert or to_delete:
+            count_favorites(db.session, kind, to_insert, to_delete)
+            changes[kind] = (to_insert, to_delete)
+
+    if changes or not is_fresh(snapshot):
+        write_snapshot(snapshot, changes)
+    db.session.commit()
+    return results
+
+
+def _union_columns():
+    # Labels of the favorites UNION ALL rows, in order
+    names = list(dict.fromkeys(list(Character.projection()) + list(Planet.projection())))
+    return ('kind', 'favorite_id', *names)
+
+
+def favorites_statement(user_id):
+    planet_columns = Planet.projection()
+    character_columns = Character.projection()
+    names = _union_columns()[2:]
+    types = {name: {**planet_columns, **character_columns}[name].type for name in names}
+
+    def branch(kind, favorite_id, columns):
+        # Every branch has the same columns; the ones a kind lacks are typed NULLs
+        selected = [literal(kind).label('kind'), favorite_id.label('favorite_id')]
+        for name in names:
+            column = columns[name] if name in columns else cast(null(), types[name])
+            selected.append(column.label(name))
+        return select(*selected)
+
+    user = branch('user', cast(null(), Integer), {'id': User.id}).where(User.id == user_id)
+    characters = branch('character', FavoriteCharacter.id, character_columns) \
+        .join_from(FavoriteCharacter, Character, FavoriteCharacter.character_id == Character.id) \
+        .where(FavoriteCharacter.user_id == user_id)
+    planets = branch('planet', FavoritePlanet.id, planet_columns) \
+        .join_from(FavoritePlanet, Planet, FavoritePlanet.planet_id == Planet.id) \
+        .where(FavoritePlanet.user_id == user_id)
+
+    return union_all(user, characters, planets).order_by(literal_column('favorite_id'))
+
+
+def favorites_from_rows(rows):
+    """Build the favorites of a user from the UNION ALL rows, or None when the user does not exist."""
+    encode_character = row_encoder(_union_columns(), tuple(Character.projection()))
+    encode_planet = row_encoder(_union_columns(), tuple(Planet.projection()))
+    user_exists = False
+    favorite_characters = []
+    favorite_planets = []
+
+    for row in rows:
+        if row[0] == 'user':
+            user_exists = True
+        elif row[0] == 'character':
+            favorite_characters.append(encode_character(row))
+        else:
+            favorite_planets.append(encode_planet(row))
+
+    if not user_exists:
+        return None
+    return {
+        "favorite_characters": favorite_characters,
+        "favorite_planets": favorite_planets
+    }
+
+
+def favorites_of(user_id):
+    """Return the user's favorites, or None when the user does not exist."""
+    return favorites_from_rows(db.session.execute(favorites_statement(user_id)))
+
+
+def favorites_body(favorites):
+    return {
+        "msg": "ok",
+        "total_favorites": len(favorites["favorite_characters"]) + len(favorites["favorite_planets"]),
+        "result": favorites
+    }
+
+
+def dump_favorites(favorites):
+    # Same text jsonify() would send, without the trailing newline
+    return current_app.json.dumps(favorites_body(favorites))
+
+
+def favorites_response(body):
+    return current_app.response_class(body + "\n", mimetype=current_app.json.mimetype)
+
+
+# ========== snapshots ========== #
+
+def _current_version(name):
+    return func.coalesce(select(TableVersion.version).where(TableVersion.name == name).scalar_subquery(), 0)
+
+
+def _snapshot_columns(user_id_column):
+    return (
+        user_id_column.label('user_id'),
+        FavoriteSnapshot.body,
+        FavoriteSnapshot.revision,
+        FavoriteSnapshot.planets_version,
+        FavoriteSnapshot.characters_version,
+        _current_version(Planet.__tablename__).label('current_planets_version'),
+        _current_version(Character.__tablename__).label('current_characters_version'),
+    )
+
+
+def snapshot_statement(user_id):
+    """One row with the user's snapshot and the current catalog versions; no row when the user does not exist."""
+    return select(*_snapshot_columns(User.id)) \
+        .outerjoin(FavoriteSnapshot, FavoriteSnapshot.user_id == User.id) \
+        .where(User.id == user_id)
+
+
+def is_fresh(snapshot):
+    return snapshot.body is not None and \
+        snapshot.planets_version == snapshot.current_planets_version and \
+        snapshot.characters_version == snapshot.current_characters_version
+
+
+def lock_snapshot(user_id):
+    """Create (if needed) and lock the user's snapshot row; None when the user does not exist."""
+    table = FavoriteSnapshot.__table__
+    db.session.execute(_insert_ignoring_duplicates(table).from_select(
+        ['user_id', 'revision', 'planets_version', 'characters_version'],
+        select(User.id, literal(0), literal(0), literal(0)).where(User.id == user_id)))
+    return db.session.execute(
+        select(*_snapshot_columns(FavoriteSnapshot.user_id))
+        .where(FavoriteSnapshot.user_id == user_id)
+        .with_for_update(of=table)
+    ).first()
+
+
+def _catalog_items(kind, ids):
+    # Serialized planets/characters in the order of `ids`, as the favorites list shows them
+    if not ids:
+        return []
+    favorite_model, item_model, id_key, label = KINDS[kind]
+    columns = item_model.projection()
+    names = tuple(columns)
+    encode = row_encoder(names, names)
+    rows = db.session.execute(
+        select(*[column.label(name) for name, column in columns.items()]).where(item_model.id.in_(ids)))
+    items = {row.id: encode(row) for row in rows}
+    return [items[item_id] for item_id in ids if item_id in items]
+
+
+def write_snapshot(snapshot, changes):
+    """Store the body of the locked `snapshot` with `changes` ({kind: (added ids, removed ids)}) applied.
+
+    Runs in the transaction of the favorites write. A stale snapshot is rebuilt
+    from the tables, which already include the write. The changes also go to
+    the change log (GET /changes).
+    """
+    for kind, (added, removed) in changes.items():
+        for item_id in added:
+            record_change(db.session, RESULT_KEYS[kind], item_id, 'insert', snapshot.user_id)
+        for item_id in removed:
+            record_change(db.session, RESULT_KEYS[kind], item_id, 'delete', snapshot.user_id)
+
+    if is_fresh(snapshot):
+        favorites = current_app.json.loads(snapshot.body)["result"]
+        for kind, (added, removed) in changes.items():
+            key = RESULT_KEYS[kind]
+            favorites[key] = [item for item in favorites[key] if item["id"] not in removed]
+            favorites[key] += _catalog_items(kind, added)
+    else:
+        favorites = favorites_of(snapshot.user_id)
+
+    table = FavoriteSnapshot.__table__
+    db.session.execute(update(table).where(table.c.user_id == snapshot.user_id).values(
+        body=dump_favorites(favorites),
+        revision=table.c.revision + 1,
+        planets_version=snapshot.current_planets_version,
+        characters_version=snapshot.current_characters_version,
+    ))
+
+
+def favorites_json(user_id):
+    """Return the GET /favorites/<user_id> body as JSON text, or None when the user does not exist."""
+    snapshot = db.session.execute(snapshot_statement(user_id)).first()
+    if snapshot is None:
+        return None
+    if is_fresh(snapshot):
+        return snapshot.body
+
+    # Stale or missing snapshot: built from the tables, stored by the next write
+    favorites = favorites_of(user_id)
+    if favorites is None:
+        return None
+    return dump_favorites(favorites)
+
+
+def stale_snapshots_statement(after, limit):
+    """Ids of the users after `after` whose snapshot is missing, invalidated or built from older catalog versions."""
+    return select(User.id).outerjoin(FavoriteSnapshot, FavoriteSnapshot.user_id == User.id) \
+        .where(User.id > after, or_(
+            FavoriteSnapshot.body.is_(None),
+            FavoriteSnapshot.planets_version != _current_version(Planet.__tablename__),
+            FavoriteSnapshot.characters_version != _current_version(Character.__tablename__),
+        )).order_by(User.id).limit(limit)
+
+
+def refresh_snapshots(batch_size=REFRESH_BATCH_SIZE):
+    """Rebuild every missing or stale snapshot, `batch_size` users per transaction; returns how many were rebuilt."""
+    rebuilt = 0
+    after = 0
+    while True:
+        user_ids = db.session.execute(stale_snapshots_statement(after, batch_size)).scalars().all()
+        if not user_ids:
+            return rebuilt
+        # Locked in id order, like the favorites writes of each user
+        for user_id in user_ids:
+            snapshot = lock_snapshot(user_id)
+            if snapshot is not None and not is_fresh(snapshot):
+                write_snapshot(snapshot, {})
+                rebuilt += 1
+        db.session.commit()
+        after = user_ids[-1]
+
+
+def _changed_users(session):
+    # Users whose favorites are written through the ORM (admin views) in this flush
+    user_ids = set()
+    for obj in chain(session.new, session.dirty, session.deleted):
+        if isinstance(obj, (FavoritePlanet, FavoriteCharacter)):
+            history = inspect(obj).attrs.user_id.history
+            user_ids.update(user_id for user_id in chain(history.unchanged, history.added, history.deleted)
+                            if user_id is not None)
+    return user_ids
+
+
+def _after_flush(session, flush_context):
+    user_ids = _changed_users(session)
+    if user_ids:
+        table = FavoriteSnapshot.__table__
+        session.connection().execute(update(table).where(table.c.user_id.in_(user_ids))
+                                     .values(body=None, revision=table.c.revision + 1))
+
+
+def setup_favorites(app):
+    if not event.contains(Session, 'after_flush', _after_flush):
+        event.listen(Session, 'after_flush', _after_flush)
+
+    @app.cli.command('refresh-favorites')
+    @click.option('--batch-size', type=int, default=REFRESH_BATCH_SIZE, show_default=True)
+    def refresh_favorites(batch_size):
+        """Rebuild the missing and stale snapshots behind GET /favorites/<user_id>."""
+        click.echo(f'{refresh_snapshots(batch_size)} favorites snapshots rebuilt')
@@ -0,0 +1,271 @@
+"""
+`flask import-swapi`: bulk import of SWAPI planets and people dumps
+
+    flask import-swapi --planets planets.json --characters people.ndjson
+
+Files can be a JSON array, SWAPI API pages ({"results": [...]}, one or many in
+a row) or NDJSON, and are read incrementally. Rows are written in chunks of
+--chunk-size, each in its own transaction, with COPY on Postgres and
+executemany INSERTs elsewhere. Names are unique, so rows whose name is already
+in the database are skipped: running the command again after a failure resumes
+where the last committed chunk ended. `homeworld` may be a planet name or a
+SWAPI planet URL from the planets file of the same run.
+"""
+import csv
+import io
+import json
+import time
+from datetime import datetime
+import click
+from sqlalchemy import String, select
+from changes import log_reset
+from favorites import refresh_snapshots
+from popularity import reconcile_counts
+from models import db, Planet, Character
+from residents import refresh_resident_counts
+from search import rebuild_search_index
+from utils import parse_swapi_number
+from versioning import bump_versions
+
+CHUNK_SIZE = 5000
+READ_SIZE = 1 << 16
+
+# SWAPI field -> (column, converter)
+PLANET_FIELDS = {
+    'name': ('name', str),
+    'climate': ('climate', str),
+    'terrain': ('terrain', str),
+    'diameter': ('diameter', lambda value: parse_swapi_number(value, int)),
+    'rotation_period': ('rotation_period', str),
+    'orbital_period': ('orbital_period', str),
+    'gravity': ('gravity', lambda value: parse_swapi_number(value, float)),
+    'population': ('population', lambda value: parse_swapi_number(value, int)),
+}
+CHARACTER_FIELDS = {
+    'name': ('name', str),
+    'height': ('height', lambda value: parse_swapi_number(value, int)),
+    'mass': ('mass', lambda value: parse_swapi_number(value, float)),
+    'hair_color': ('hair_color', str),
+    'skin_color': ('skin_color', str),
+    'eye_color': ('eye_color', str),
+    'birth_year': ('birth_year', str),
+    'gender': ('gender', str),
+}
+
+
+# ========== reading ========== #
+
+def _decoded(buffer, position, file, decoder):
+    # Decode the next JSON value, reading more of the file while it is incomplete
+    while True:
+        try:
+            value, end = decoder.raw_decode(buffer, position)
+            return value, end, buffer
+        except json.JSONDecodeError:
+            more = file.read(READ_SIZE)
+            if not more:
+                raise
+            buffer = buffer[position:] + more
+            position = 0
+
+
+def _skip(buffer, position, file, characters):
+    # Skip `characters` (whitespace, separators), reading more when the buffer runs out
+    while True:
+        while position < len(buffer) and buffer[position] in characters:
+            position += 1
+        if position < len(buffer):
+            return buffer, position
+        buffer = file.read(READ_SIZE)
+        position = 0
+        if not buffer:
+            return buffer, position
+
+
+def iter_records(file):
+    """Yield the objects of a JSON array, SWAPI pages or NDJSON without loading the whole file."""
+    decoder = json.JSONDecoder()
+    buffer, position = _skip(file.read(READ_SIZE), 0, file, ' \t\r\n')
+    in_array = buffer[position:position + 1] == '['
+    if in_array:
+        position += 1
+
+    while True:
+        buffer, position = _skip(buffer, position, file, ' \t\r\n,')
+        if not buffer or (in_array and buffer[position] == ']'):
+            return
+        value, position, buffer = _decoded(buffer, position, file, decoder)
+        if not in_array and isinstance(value, dict) and isinstance(value.get('results'), list):
+            yield from value['results']
+        else:
+            yield value
+
+
+def _limited(column, value):
+    # Truncate text to the column size, Postgres rejects longer values
+    length = getattr(column.type, 'length', None)
+    if isinstance(column.type, String) and length and isinstance(value, str):
+        return value[:length]
+    return value
+
+
+def to_row(model, fields, record):
+    row = {}
+    for field, (column_name, convert) in fields.items():
+        value = record.get(field)
+        value = None if value in (None, '') else convert(value)
+        row[column_name] = _limited(model.__table__.c[column_name], value)
+    return row
+
+
+def chunks(records, size):
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+# ========== writing ========== #
+
+def copy_rows(connection, table, rows):
+    # COPY ... FROM STDIN through psycopg2; NULLs are unquoted empty fields
+    columns = list(rows[0])
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow(['' if row[name] is None else row[name] for name in columns])
+    buffer.seek(0)
+    column_list = ', '.join(f'"{name}"' for name in columns)
+    cursor = connection.connection.cursor()
+    try:
+        cursor.copy_expert(f'COPY "{table.name}" ({column_list}) FROM STDIN WITH (FORMAT csv)', buffer)
+    finally:
+        cursor.close()
+
+
+def write_rows(connection, table, rows):
+    if connection.dialect.name == 'postgresql' and connection.dialect.driver == 'psycopg2':
+        # COPY skips the column defaults of the model
+        now = datetime.utcnow()
+        copy_rows(connection, table, [dict(row, updated_at=now) for row in rows])
+    else:
+        connection.execute(table.insert(), rows)
+
+
+def names_to_ids(connection, model, names=None):
+    statement = select(model.name, model.id)
+    if names is not None:
+        statement = statement.where(model.name.in_(names))
+    return dict(connection.execute(statement).all())
+
+
+def refresh_after_bulk_load(connection):
+    """Bring the search index, counters and table versions up to date after writes that skip mapper events."""
+    rebuild_search_index(connection)
+    refresh_resident_counts(connection)
+    reconcile_counts(connection)
+    log_reset(connection)
+    bump_versions(connection, {Planet.__tablename__, Character.__tablename__})
+
+
+class ImportStats:
+    def __init__(self, table):
+        self.table = table
+        self.read = 0
+        self.inserted = 0
+        self.skipped = 0
+        self.unresolved = 0
+        self.started = time.perf_counter()
+
+    def line(self):
+        seconds = time.perf_counter() - self.started
+        rate = self.inserted / seconds if seconds else 0.0
+        return (f'{self.table}: {self.read} read, {self.inserted} inserted, {self.skipped} skipped, '
+                f'{self.unresolved} without home world, {seconds:.1f}s, {rate:,.0f} rows/s')
+
+
+def import_planets(records, chunk_size, planet_ids, planet_urls):
+    """Insert new planets; fills `planet_ids` (name -> id) and `planet_urls` (SWAPI url -> name)."""
+    stats = ImportStats('planets')
+    table = Planet.__table__
+    for chunk in chunks(records, chunk_size):
+        stats.read += len(chunk)
+        rows = []
+        for record in chunk:
+            row = to_row(Planet, PLANET_FIELDS, record)
+            if record.get('url') and row['name']:
+                planet_urls[record['url']] = row['name']
+            if not row['name'] or row['name'] in planet_ids:
+                stats.skipped += 1
+                continue
+            planet_ids[row['name']] = None
+            rows.append(row)
+
+        if rows:
+            with db.engine.begin() as connection:
+                write_rows(connection, table, rows)
+                planet_ids.update(names_to_ids(connection, Planet, [row['name'] for row in rows]))
+            stats.inserted += len(rows)
+        click.echo(stats.line())
+    return stats
+
+
+def import_characters(records, chunk_size, planet_ids, planet_urls, character_names):
+    stats = ImportStats('characters')
+    table = Character.__table__
+    for chunk in chunks(records, chunk_size):
+        stats.read += len(chunk)
+        rows = []
+        for record in chunk:
+            row = to_row(Character, CHARACTER_FIELDS, record)
+            if not row['name'] or row['name'] in character_names:
+                stats.skipped += 1
+                continue
+            home_world = record.get('homeworld', record.get('home_world'))
+            row['home_world_id'] = planet_ids.get(planet_urls.get(home_world, home_world))
+            if home_world and row['home_world_id'] is None:
+                stats.unresolved += 1
+            character_names.add(row['name'])
+            rows.append(row)
+
+        if rows:
+            with db.engine.begin() as connection:
+                write_rows(connection, table, rows)
+            stats.inserted += len(rows)
+        click.echo(stats.line())
+    return stats
+
+
+def setup_importer(app):
+    @app.cli.command('import-swapi')
+    @click.option('--planets', 'planets_path', type=click.Path(exists=True, dir_okay=False))
+    @click.option('--characters', 'characters_path', type=click.Path(exists=True, dir_okay=False))
+    @click.option('--chunk-size', type=int, default=CHUNK_SIZE, show_default=True)
+    def import_swapi(planets_path, characters_path, chunk_size):
+        """Bulk import SWAPI planets / people dumps (JSON, API pages or NDJSON)."""
+        if not planets_path and not characters_path:
+            raise click.UsageError('Pass --planets and/or --characters')
+
+        # In-memory name -> id maps, also what makes a second run skip imported rows
+        with db.engine.connect() as connection:
+            planet_ids = names_to_ids(connection, Planet)
+            character_names = set(names_to_ids(connection, Character))
+        planet_urls = {}
+
+        if planets_path:
+            with open(planets_path, encoding='utf-8') as file:
+                import_planets(iter_records(file), chunk_size, planet_ids, planet_urls)
+        if characters_path:
+            with open(characters_path, encoding='utf-8') as file:
+                import_characters(iter_records(file), chunk_size, planet_ids, planet_urls, character_names)
+
+        with db.engine.begin() as connection:
+            # Bumps the Planets and Characters versions: every worker's cache and ETags move to new entries
+            refresh_after_bulk_load(connection)
+        click.echo('Search index and table versions updated')
+        # After the version bump, or every snapshot would be stale again
+        click.echo(f'{refresh_snapshots()} favorites snapshots rebuilt')
@@ -0,0 +1,331 @@
+"""
+Prometheus metrics for GET /metrics
+
+Every process counts requests, latency (histogram), status codes and response
+bytes per endpoint in memory; the after_request hook only takes a lock and
+bumps a few numbers. Pool and cache stats are read when the metrics are
+written out; the pool ones have a bind label per engine ("default", "replica").
+
+With several gunicorn workers set METRICS_DIR to a directory shared by them
+(and emptied on deploy): a background thread in each process writes its
+snapshot to `<METRICS_DIR>/<pid>-<start>.json` every METRICS_FLUSH_SECONDS and
+/metrics adds up the files. The start time in the name keeps a worker that
+got the pid of an exited one from overwriting its file. When a worker exits,
+the child_exit hook of gunicorn.conf.py moves its counters into `exited.json`
+and deletes its file, so the directory holds one file per live worker plus
+that one. Gauges only come from live processes. Without METRICS_DIR the
+metrics are those of the process that answers. Requests answered by the async
+handlers of asgi.py are not counted.
+"""
+import atexit
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from flask import g, request
+from cache import catalog_cache
+from pool import instrumented_engines, pool_stats, pool_status
+
+# Upper bounds of the latency histogram, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class RequestMetrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (endpoint, method, status) -> requests
+        self.requests = defaultdict(int)
+        # endpoint -> [count per bucket..., +Inf], sum of seconds, bytes
+        self.buckets = defaultdict(lambda: [0] * (len(LATENCY_BUCKETS) + 1))
+        self.seconds = defaultdict(float)
+        self.bytes = defaultdict(int)
+
+    def observe(self, endpoint, method, status, seconds, size):
+        index = 0
+        while index < len(LATENCY_BUCKETS) and seconds > LATENCY_BUCKETS[index]:
+            index += 1
+        with self._lock:
+            self.requests[(endpoint, method, status)] += 1
+            self.buckets[endpoint][index] += 1
+            self.seconds[endpoint] += seconds
+            self.bytes[endpoint] += size
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "requests": [[*key, value] for key, value in self.requests.items()],
+                "buckets": {endpoint: list(counts) for endpoint, counts in self.buckets.items()},
+                "seconds": dict(self.seconds),
+                "bytes": dict(self.bytes),
+            }
+
+
+request_metrics = RequestMetrics()
+
+
+def process_snapshot():
+    """Everything this process reports: request metrics, pool and cache stats."""
+    cache = catalog_cache.stats()
+    snapshot = request_metrics.snapshot()
+    snapshot["counters"] = {
+        "catalog_cache_hits_total": cache["hits"],
+        "catalog_cache_misses_total": cache["misses"],
+        "catalog_cache_shared_hits_total": cache["shared_hits"],
+    }
+    snapshot["gauges"] = {
+        "catalog_cache_local_entries": cache["local_entries"],
+    }
+    for engine in instrumented_engines():
+        status = pool_status(engine)
+        bind = _labels(bind=status["bind"])
+        snapshot["counters"].update({
+            f"db_pool_connects_total{bind}": status["connects"],
+            f"db_pool_checkouts_total{bind}": status["checkouts"],
+            f"db_pool_timeouts_total{bind}": status["timeouts"],
+            f"db_pool_invalidations_total{bind}": status["invalidations"],
+            f"db_pool_wait_seconds_total{bind}": pool_stats(engine).wait_seconds,
+        })
+        snapshot["gauges"].update({
+            f"db_pool_size{bind}": status.get("size", 0),
+            f"db_pool_checked_out{bind}": status.get("checked_out", 0),
+            f"db_pool_overflow{bind}": status.get("overflow", 0),
+        })
+    return snapshot
+
+
+def merge_snapshots(snapshots):
+    merged = {"requests": defaultdict(int), "buckets": {}, "seconds": defaultdict(float),
+              "bytes": defaultdict(int), "counters": defaultdict(float), "gauges": defaultdict(float)}
+    for snapshot in snapshots:
+        for *key, value in snapshot["requests"]:
+            merged["requests"][tuple(key)] += value
+        for endpoint, counts in snapshot["buckets"].items():
+            total = merged["buckets"].setdefault(endpoint, [0] * len(counts))
+            merged["buckets"][endpoint] = [a + b for a, b in zip(total, counts)]
+        for name in ("seconds", "bytes", "counters", "gauges"):
+            for key, value in snapshot.get(name, {}).items():
+                merged[name][key] += value
+    return merged
+
+
+# ========== multi-process files ========== #
+
+EXITED_FILE = 'exited.json'
+# (pid, start time) of this process, for the name of its file
+_process = (None, None)
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _file_pid(name):
+    # "<pid>-<start>.json" -> pid; None for exited.json and other files
+    pid = name[:-len('.json')].split('-', 1)[0]
+    return int(pid) if name.endswith('.json') and pid.isdigit() else None
+
+
+def _file_name():
+    global _process
+    if _process[0] != os.getpid():
+        _process = (os.getpid(), time.time_ns())
+    return '{}-{}.json'.format(*_process)
+
+
+def _write(path, snapshot):
+    # Write then rename, so readers never see a half written file
+    temporary = f'{path}.tmp'
+    with open(temporary, 'w') as file:
+        json.dump(snapshot, file)
+    os.replace(temporary, path)
+
+
+def write_snapshot(directory, snapshot):
+    _write(os.path.join(directory, _file_name()), snapshot)
+
+
+def _load(path):
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def read_snapshots(directory):
+    snapshots = []
+    for name in os.listdir(directory):
+        pid = _file_pid(name)
+        if pid is None and name != EXITED_FILE:
+            continue
+        snapshot = _load(os.path.join(directory, name))
+        if snapshot is None:
+            continue
+        if pid is not None and pid != os.getpid() and not _alive(pid):
+            # Not moved into exited.json yet: its counters still count, its gauges don't
+            snapshot["gauges"] = {}
+        snapshots.append(snapshot)
+    return snapshots
+
+
+def _as_snapshot(merged):
+    return {
+        "requests": [[*key, value] for key, value in merged["requests"].items()],
+        "buckets": merged["buckets"],
+        "seconds": dict(merged["seconds"]),
+        "bytes": dict(merged["bytes"]),
+        "counters": dict(merged["counters"]),
+        "gauges": {},
+    }
+
+
+def collect_exited(directory, pids=None):
+    """Move the counters of exited workers into exited.json and delete their files.
+
+    Only one process may call it at a time: the gunicorn master, from its hooks.
+    `pids` are the workers that exited; by default every process that is not
+    running. Returns the number of files collected.
+    """
+    names = [name for name in os.listdir(directory) if _file_pid(name) is not None
+             and (_file_pid(name) in pids if pids is not None else not _alive(_file_pid(name)))]
+    if not names:
+        return 0
+    exited = os.path.join(directory, EXITED_FILE)
+    snapshots = [snapshot for snapshot in [_load(exited)] + [_load(os.path.join(directory, name)) for name in names]
+                 if snapshot is not None]
+    _write(exited, _as_snapshot(merge_snapshots(snapshots)))
+    for name in names:
+        for path in (os.path.join(directory, name), os.path.join(directory, f'{name}.tmp')):
+            if os.path.exists(path):
+                os.remove(path)
+    return len(names)
+
+
+class SnapshotWriter:
+    """Background thread that writes this process's snapshot every few seconds."""
+
+    def __init__(self, directory, interval):
+        self.directory = directory
+        self.interval = interval
+        self.pid = None
+        self._lock = threading.Lock()
+
+    def flush(self):
+        write_snapshot(self.directory, process_snapshot())
+
+    def ensure_started(self):
+        # Started on the first request of each process, after gunicorn forks
+        if self.pid == os.getpid():
+            return
+        with self._lock:
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            threading.Thread(target=self._run, name='metrics-writer', daemon=True).start()
+            atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception:
+                pass
+
+
+# ========== exposition ========== #
+
+def _labels(**labels):
+    pairs = ','.join(f'{name}="{str(value)}"' for name, value in labels.items())
+    return '{' + pairs + '}' if pairs else ''
+
+
+def _samples(lines, values, kind):
+    # Keys are metric names with their labels, e.g. db_pool_size{bind="default"}
+    declared = set()
+    for key, value in sorted(values.items()):
+        name = key.split('{', 1)[0]
+        if name not in declared:
+            declared.add(name)
+            lines.append(f'# TYPE {name} {kind}')
+        lines.append(f'{key} {value:g}')
+
+
+def render(merged):
+    """Prometheus text format for merged snapshots."""
+    lines = ['# TYPE http_requests_total counter']
+    for (endpoint, method, status), value in sorted(merged["requests"].items()):
+        lines.append(f'http_requests_total{_labels(endpoint=endpoint, method=method, status=status)} {value}')
+
+    lines.append('# TYPE http_request_duration_seconds histogram')
+    for endpoint, counts in sorted(merged["buckets"].items()):
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), counts):
+            cumulative += count
+            lines.append(f'http_request_duration_seconds_bucket{_labels(endpoint=endpoint, le=bound)} {cumulative}')
+        lines.append(f'http_request_duration_seconds_sum{_labels(endpoint=endpoint)} {merged["seconds"][endpoint]}')
+        lines.append(f'http_request_duration_seconds_count{_labels(endpoint=endpoint)} {cumulative}')
+
+    lines.append('# TYPE http_response_bytes_total counter')
+    for endpoint, value in sorted(merged["bytes"].items()):
+        lines.append(f'http_response_bytes_total{_labels(endpoint=endpoint)} {value}')
+
+    _samples(lines, merged["counters"], 'counter')
+    _samples(lines, merged["gauges"], 'gauge')
+
+    lookups = merged["counters"]["catalog_cache_hits_total"] + merged["counters"]["catalog_cache_misses_total"]
+    ratio = merged["counters"]["catalog_cache_hits_total"] / lookups if lookups else 0.0
+    lines += ['# TYPE catalog_cache_hit_ratio gauge', f'catalog_cache_hit_ratio {ratio:g}']
+    return '\n'.join(lines) + '\n'
+
+
+# ========== flask hooks ========== #
+
+_writer = None
+
+
+def _start_timer():
+    if _writer is not None:
+        _writer.ensure_started()
+    g._metrics_started = time.perf_counter()
+
+
+def _record(response):
+    started = g.pop('_metrics_started', None)
+    if started is not None:
+        request_metrics.observe(request.endpoint or 'unmatched', request.method, response.status_code,
+                                time.perf_counter() - started, response.content_length or 0)
+    return response
+
+
+def metrics_text():
+    """Body of GET /metrics, added up over every process when METRICS_DIR is set."""
+    if _writer is None:
+        return render(merge_snapshots([process_snapshot()]))
+    _writer.ensure_started()
+    _writer.flush()
+    return render(merge_snapshots(read_snapshots(_writer.directory)))
+
+
+def setup_metrics(app):
+    global _writer
+    app.config.setdefault('METRICS_ENABLED', os.getenv('METRICS_ENABLED', '1').lower() in ('1', 'true', 'yes'))
+    app.config.setdefault('METRICS_DIR', os.getenv('METRICS_DIR'))
+    app.config.setdefault('METRICS_FLUSH_SECONDS', float(os.getenv('METRICS_FLUSH_SECONDS', 5)))
+    if not app.config['METRICS_ENABLED']:
+        return
+
+    if app.config['METRICS_DIR']:
+        os.makedirs(app.config['METRICS_DIR'], exist_ok=True)
+        _writer = SnapshotWriter(app.config['METRICS_DIR'], app.config['METRICS_FLUSH_SECONDS'])
+
+    app.before_request(_start_timer)
+    app.after_request(_record)
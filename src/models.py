@@ -1,6 +1,34 @@
+import sqlite3
+from datetime import datetime
+from flask import current_app
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, select
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import joinedload, raiseload
+from replica import RoutingSession
+
+# The session class sends the reads of GET requests to the read replica, when one is configured
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+
+
+@event.listens_for(Engine, 'connect')
+def enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+    # SQLite ignores foreign keys unless asked; the favorites writes rely on them
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA foreign_keys=ON')
+        cursor.close()
+
+
+def eager_query(model):
+    # Query with the relationships that serialize() needs already loaded.
+    # When RAISE_ON_LAZY_LOAD is on, any other lazy load raises instead of
+    # silently sending one extra SELECT per row.
+    options = list(getattr(model, 'loader_options', tuple)())
+    if current_app.config.get('RAISE_ON_LAZY_LOAD'):
+        options.append(raiseload('*'))
+    return model.query.options(*options)
 
-db = SQLAlchemy()
 
 class User(db.Model):
     __tablename__ = 'Users'
@@ -9,6 +37,11 @@ class User(db.Model):
     password = db.Column(db.String(80), unique=False, nullable=False)
     is_active = db.Column(db.Boolean(), unique=False, nullable=False)
 
+    @classmethod
+    def projection(cls):
+        # Columns that can be requested with ?fields=, keyed like serialize()
+        return {"id": cls.id, "email": cls.email, "is_active": cls.is_active}
+
     def __repr__(self):
         return 'id: ' + str(self.id) + ', email: ' + self.email
 
@@ -26,11 +59,30 @@ class Planet(db.Model):
     name = db.Column(db.String(50), nullable=False, unique=True)
     climate = db.Column(db.String(20))
     terrain = db.Column(db.String(20))
-    diameter = db.Column(db.String(20))
+    diameter = db.Column(db.Integer, index=True)
     rotation_period = db.Column(db.String(10))
     orbital_period = db.Column(db.String(10))
-    gravity = db.Column(db.String(10))
-    population = db.Column(db.String(20))
+    gravity = db.Column(db.Float, index=True)
+    population = db.Column(db.BigInteger, index=True)
+    # Characters with this home world, kept up to date by residents.py
+    resident_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    @classmethod
+    def projection(cls):
+        # Columns that can be requested with ?fields=, keyed like serialize()
+        return {
+            "id": cls.id,
+            "name": cls.name,
+            "climate": cls.climate,
+            "terrain": cls.terrain,
+            "diameter": cls.diameter,
+            "rotation_period": cls.rotation_period,
+            "orbital_period": cls.orbital_period,
+            "gravity": cls.gravity,
+            "population": cls.population,
+            "resident_count": cls.resident_count,
+        }
 
     def __repr__(self):
         return 'id: ' + str(self.id) + ', name: ' + self.name
@@ -45,23 +97,55 @@ class Planet(db.Model):
             "rotation_period": self.rotation_period,
             "orbital_period": self.orbital_period,
             "gravity": self.gravity,
-            
+            "population": self.population,
+            "resident_count": self.resident_count,
         }
 
 class Character(db.Model):
     __tablename__ = 'Characters'
+    # Residents of a planet in id order (GET /planets/<id>/residents)
+    __table_args__ = (db.Index('ix_Characters_home_world_id_id', 'home_world_id', 'id'),)
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(50), nullable=False, unique=True)
-    height = db.Column(db.String(10))
-    mass = db.Column(db.String(10))
+    height = db.Column(db.Integer, index=True)
+    mass = db.Column(db.Float, index=True)
     hair_color = db.Column(db.String(20))
     skin_color = db.Column(db.String(20))
     eye_color = db.Column(db.String(20))
     birth_year = db.Column(db.String(20))
     gender = db.Column(db.String(10))
-    home_world_id = db.Column(db.Integer, db.ForeignKey('Planets.id'))
+    # active_history: the resident counters (residents.py) need the previous home world
+    # even when the attribute was expired before the change
+    home_world_id = db.column_property(db.Column(db.Integer, db.ForeignKey('Planets.id')), active_history=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     home_world = db.relationship(Planet)
 
+    @classmethod
+    def loader_options(cls):
+        return (joinedload(cls.home_world),)
+
+    @classmethod
+    def projection(cls):
+        # Columns that can be requested with ?fields=, keyed like serialize()
+        return {
+            "id": cls.id,
+            "name": cls.name,
+            "height": cls.height,
+            "mass": cls.mass,
+            "hair_color": cls.hair_color,
+            "skin_color": cls.skin_color,
+            "eye_color": cls.eye_color,
+            "birth_year": cls.birth_year,
+            "gender": cls.gender,
+            "home_world_id": cls.home_world_id,
+            "home_world_name": select(Planet.name).where(Planet.id == cls.home_world_id).scalar_subquery(),
+        }
+
+    @classmethod
+    def includes(cls):
+        # Relations that can be embedded with ?include=: name -> (foreign key field, related model)
+        return {"home_world": ("home_world_id", Planet)}
+
     def __repr__(self):
         return 'id: ' + str(self.id) + ', name: ' + self.name
 
@@ -77,15 +161,19 @@ class Character(db.Model):
             "birth_year": self.birth_year,
             "gender": self.gender,
             "home_world_id": self.home_world_id,
-            "home_world_name": self.home_world.serialize()['name']
+            "home_world_name": self.home_world.name if self.home_world is not None else None
         }
 
 class FavoriteCharacter(db.Model):
     __tablename__ = 'FavoriteCharacters'
+    # Also serves the per-user lookups (leftmost column)
+    __table_args__ = (db.Index('ix_FavoriteCharacters_user_id_character_id', 'user_id', 'character_id', unique=True),)
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('Users.id'), nullable=False)
     user = db.relationship(User)
-    character_id = db.Column(db.Integer, db.ForeignKey('Characters.id'), nullable=False)
+    # active_history: the favorite counts (popularity.py) need the previous character
+    character_id = db.column_property(db.Column(db.Integer, db.ForeignKey('Characters.id'), nullable=False),
+                                      active_history=True)
     character = db.relationship(Character)
 
     def __repr__(self):
@@ -101,10 +189,14 @@ class FavoriteCharacter(db.Model):
 
 class FavoritePlanet(db.Model):
     __tablename__ = 'FavoritePlanets'
+    # Also serves the per-user lookups (leftmost column)
+    __table_args__ = (db.Index('ix_FavoritePlanets_user_id_planet_id', 'user_id', 'planet_id', unique=True),)
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('Users.id'), nullable=False)
     user = db.relationship(User)
-    planet_id = db.Column(db.Integer, db.ForeignKey('Planets.id'), nullable=False)
+    # active_history: the favorite counts (popularity.py) need the previous planet
+    planet_id = db.column_property(db.Column(db.Integer, db.ForeignKey('Planets.id'), nullable=False),
+                                   active_history=True)
     planet = db.relationship(Planet)
 
     def __repr__(self):
@@ -116,4 +208,57 @@ class FavoritePlanet(db.Model):
             "user_id": self.user_id,
             "planet_id": self.planet_id,
             "planet": self.planet.serialize()
-        }
\ No newline at end of file
+        }
+
+class TableVersion(db.Model):
+    # One row per versioned table, bumped in the same transaction as every write to it
+    __tablename__ = 'TableVersions'
+    name = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    def __repr__(self):
+        return 'name: ' + self.name + ', version: ' + str(self.version)
+
+class FavoriteSnapshot(db.Model):
+    # Pre-serialized GET /favorites/<user_id> body of each user, patched on every
+    # favorites write and rebuilt by the first write after the catalog versions it was built from change
+    __tablename__ = 'FavoriteSnapshots'
+    user_id = db.Column(db.Integer, db.ForeignKey('Users.id', ondelete='CASCADE'), primary_key=True)
+    body = db.Column(db.Text)
+    revision = db.Column(db.Integer, nullable=False, default=0)
+    planets_version = db.Column(db.Integer, nullable=False, default=0)
+    characters_version = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return 'user_id: ' + str(self.user_id) + ', revision: ' + str(self.revision)
+
+class ChangeLog(db.Model):
+    # One row per changed row and committed transaction, read by GET /changes?since=<version>
+    __tablename__ = 'ChangeLog'
+    # Compaction looks up later changes of the same row
+    __table_args__ = (db.Index('ix_ChangeLog_kind_row_id_version', 'kind', 'row_id', 'version'),)
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, index=True)
+    kind = db.Column(db.String(30), nullable=False)
+    row_id = db.Column(db.Integer, nullable=False)
+    # Owner of user-scoped changes (favorites, the user row), NULL for the catalog; no
+    # foreign key so the entries outlive the user
+    user_id = db.Column(db.Integer)
+    operation = db.Column(db.String(10), nullable=False)
+    changed_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    def __repr__(self):
+        return 'version: ' + str(self.version) + ', ' + self.operation + ' ' + self.kind + ' ' + str(self.row_id)
+
+class FavoriteCount(db.Model):
+    # How many users favorited each planet / character, kept up to date by popularity.py
+    __tablename__ = 'FavoriteCounts'
+    # The leaderboards read the top of each kind backwards along this index
+    __table_args__ = (db.Index('ix_FavoriteCounts_kind_favorites_item_id', 'kind', 'favorites', 'item_id'),)
+    kind = db.Column(db.String(20), primary_key=True)
+    item_id = db.Column(db.Integer, primary_key=True)
+    favorites = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return self.kind + ' ' + str(self.item_id) + ': ' + str(self.favorites)
@@ -0,0 +1,382 @@
+"""
+Keyset pagination, filtering, sorting, field projection, cached totals, lookups
+by ?ids= and embedded relations (?include=) for the list endpoints
+"""
+import base64
+import binascii
+import json
+import math
+import operator
+import os
+import re
+import time
+from flask import g, request, url_for
+from sqlalchemy import and_, func, nullslast, or_, select
+from sqlalchemy.orm.attributes import InstrumentedAttribute
+from models import db
+from serializers import row_encoder, row_values_encoder, selected_columns
+from utils import APIException
+
+DEFAULT_LIMIT = int(os.getenv("PAGE_DEFAULT_LIMIT", 100))
+MAX_LIMIT = int(os.getenv("PAGE_MAX_LIMIT", 1000))
+COUNT_CACHE_SECONDS = float(os.getenv("COUNT_CACHE_SECONDS", 60))
+
+# table name -> (table version, total, monotonic time when it was counted)
+_cached_counts = {}
+
+# ?filter=population>1e9,climate=arid
+FILTER_PATTERN = re.compile(r'^(\w+)(>=|<=|!=|>|<|=)(.*)$')
+OPERATORS = {
+    '=': operator.eq,
+    '!=': operator.ne,
+    '>': operator.gt,
+    '>=': operator.ge,
+    '<': operator.lt,
+    '<=': operator.le,
+}
+
+
+def encode_cursor(values):
+    raw = json.dumps(values, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        return json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (binascii.Error, ValueError):
+        raise APIException(f"El cursor '{cursor}' no es válido", status_code=400)
+
+
+def page_args():
+    limit = request.args.get('limit', DEFAULT_LIMIT, type=int)
+    limit = max(1, min(limit, MAX_LIMIT))
+
+    cursor = None
+    if request.args.get('after'):
+        cursor = decode_cursor(request.args['after'])
+        if not isinstance(cursor, dict) or not isinstance(cursor.get('id'), int) \
+                or not isinstance(cursor.get('keys', []), list):
+            raise APIException(f"El cursor '{request.args['after']}' no es válido", status_code=400)
+
+    return limit, cursor
+
+
+def columns_of(model):
+    # Projected fields that are real columns, so they can be filtered and sorted in SQL
+    return {name: column for name, column in model.projection().items() if isinstance(column, InstrumentedAttribute)}
+
+
+def _filter_value(column, raw):
+    if raw.lower() == 'null':
+        return None
+    python_type = column.type.python_type
+    if python_type is bool:
+        return raw.lower() in ('1', 'true', 'yes')
+    if python_type in (int, float):
+        # inf / nan and integers past 64 bits can't be compared in SQL
+        number = float(raw)
+        if not math.isfinite(number) or (python_type is int and abs(number) >= 2 ** 63):
+            raise ValueError(raw)
+        return int(number) if python_type is int else number
+    return python_type(raw)
+
+
+def filter_args(model):
+    """Compile ?filter=name>value,... into SQL conditions on `model` columns."""
+    columns = columns_of(model)
+    conditions = []
+    for raw_filter in request.args.getlist('filter'):
+        for expression in [part.strip() for part in raw_filter.split(',') if part.strip()]:
+            match = FILTER_PATTERN.match(expression)
+            if match is None or match.group(1) not in columns:
+                raise APIException(f"El filtro '{expression}' no es válido", status_code=400)
+            name, symbol, raw = match.groups()
+            column = columns[name]
+            try:
+                value = _filter_value(column, raw)
+            except (ValueError, OverflowError):
+                raise APIException(f"El valor '{raw}' no es válido para {name}", status_code=400)
+
+            if value is None:
+                if symbol not in ('=', '!='):
+                    raise APIException(f"El filtro '{expression}' no es válido", status_code=400)
+                conditions.append(column.is_(None) if symbol == '=' else column.is_not(None))
+            else:
+                conditions.append(OPERATORS[symbol](column, value))
+    return conditions
+
+
+def sort_args(model):
+    """Parse ?sort=-population,name into [(name, column, descending)]."""
+    columns = columns_of(model)
+    keys = []
+    for name in [part.strip() for part in request.args.get('sort', '').split(',') if part.strip()]:
+        descending = name.startswith('-')
+        name = name.lstrip('-+')
+        if name not in columns or name == 'id':
+            raise APIException(f"No se puede ordenar por '{name}'", status_code=400)
+        keys.append((name, columns[name], descending))
+    return keys
+
+
+def order_by_keys(model, keys):
+    # NULLs last in both directions, id as the final tie-break
+    return [nullslast(column.desc() if descending else column.asc()) for name, column, descending in keys] + [model.id.asc()]
+
+
+def _after_cursor(model, keys, cursor):
+    # Rows strictly after the cursor for ORDER BY k1 NULLS LAST, ..., id
+    values = cursor.get('keys', [])
+    if len(values) != len(keys):
+        raise APIException("El cursor no corresponde al orden pedido", status_code=400)
+
+    clauses = []
+    equal = []
+    for (name, column, descending), value in zip(keys, values):
+        if value is not None:
+            beyond = column < value if descending else column > value
+            clauses.append(and_(*equal, or_(beyond, column.is_(None))))
+        equal.append(column.is_(None) if value is None else column == value)
+    clauses.append(and_(*equal, model.id > cursor['id']))
+    return or_(*clauses)
+
+
+def field_args(model):
+    # ?fields=id,name -> ('id', 'name'); every serialized field when it is missing
+    available = model.projection()
+    if not request.args.get('fields'):
+        return tuple(available)
+
+    fields = [field.strip() for field in request.args['fields'].split(',') if field.strip()]
+    unknown = [field for field in fields if field not in available]
+    if unknown:
+        raise APIException(f"Campos desconocidos: {', '.join(unknown)}", status_code=400)
+    return tuple(fields)
+
+
+def projected_query(model, fields, keys=(), extra=()):
+    # Plain rows with only the requested columns; `id` and the sort keys
+    # always come along for the cursor, `extra` for the ?include= relations
+    available = model.projection()
+    return db.session.query(*[available[name].label(name) for name in selected_columns(model, fields, keys, extra)])
+
+
+def filtered_query(model, fields, keys=(), extra=()):
+    # Base query for a list endpoint with the ?filter= conditions applied
+    return projected_query(model, fields, keys, extra).filter(*filter_args(model))
+
+
+def page_query(query, model, keys, limit, cursor):
+    # One row past the limit tells whether there is a next page
+    if cursor is not None:
+        query = query.filter(_after_cursor(model, keys, cursor))
+    return query.order_by(*order_by_keys(model, keys)).limit(limit + 1)
+
+
+def keyset_page(query, model, keys, limit, cursor):
+    rows = page_query(query, model, keys, limit, cursor).all()
+    return rows[:limit], len(rows) > limit
+
+
+def count_query(model, filtered=None):
+    """Return (total, None) when no query is needed or (None, statement) to count the rows."""
+    # ?count=exact always counts, ?count=none skips it, the default reuses a recent count
+    mode = request.args.get('count', 'estimate')
+    if mode == 'none':
+        return None, None
+    if filtered is not None:
+        # Totals of a filtered query depend on the filter, so they are only counted on demand
+        if mode != 'exact':
+            return None, None
+        return None, select(func.count()).select_from(filtered.order_by(None).statement.subquery())
+
+    # A count of another table version would give two bodies under one ETag
+    cached = _cached_counts.get(model.__tablename__)
+    if mode != 'exact' and cached is not None and cached[0] == _table_version(model) \
+            and time.monotonic() - cached[2] < COUNT_CACHE_SECONDS:
+        return cached[1], None
+    return None, select(func.count(model.id))
+
+
+def remember_count(model, total, filtered=None):
+    if filtered is None:
+        _cached_counts[model.__tablename__] = (_table_version(model), total, time.monotonic())
+
+
+def _table_version(model):
+    # The TableVersions the ETag of this request was computed from, if any
+    versions = g.get('_table_versions') or {}
+    version = versions.get(model.__tablename__)
+    return version[0] if version is not None else None
+
+
+def row_count(model, filtered=None):
+    total, statement = count_query(model, filtered)
+    if statement is not None:
+        total = db.session.execute(statement).scalar()
+        remember_count(model, total, filtered)
+    return total
+
+
+def shape_arg():
+    # ?shape=columns sends the field names once and one array per row
+    shape = request.args.get('shape', 'objects')
+    if shape not in ('objects', 'columns'):
+        raise APIException(f"El formato '{shape}' no es válido, debe ser 'objects' o 'columns'", status_code=400)
+    return shape
+
+
+def ids_arg():
+    """?ids=3,1,2 -> [3, 1, 2] without repeats, or None when the request has no ?ids=."""
+    raw = request.args.get('ids')
+    if raw is None:
+        return None
+    if any(request.args.get(name) for name in ('after', 'sort', 'filter')):
+        raise APIException("El parámetro ids no se puede combinar con after, sort ni filter", status_code=400)
+    try:
+        ids = list(dict.fromkeys(int(part) for part in raw.split(',') if part.strip()))
+    except ValueError:
+        raise APIException(f"El parámetro ids '{raw}' no es válido", status_code=400)
+    if not ids or len(ids) > MAX_LIMIT:
+        raise APIException(f"El parámetro ids debe tener entre 1 y {MAX_LIMIT} ids", status_code=400)
+    return ids
+
+
+def include_args(model):
+    """Parse ?include=home_world into {name: (foreign key field, related model)}."""
+    available = getattr(model, 'includes', dict)()
+    includes = {}
+    for name in [part.strip() for part in request.args.get('include', '').split(',') if part.strip()]:
+        if name not in available:
+            raise APIException(f"No se puede incluir '{name}'", status_code=400)
+        includes[name] = available[name]
+    return includes
+
+
+def include_keys(includes):
+    # Foreign key columns the rows need for their ?include= relations
+    return tuple(key for key, related in includes.values())
+
+
+def related_statement(related, ids):
+    # Every serialized field of the related rows, for one set of ids
+    fields = tuple(related.projection())
+    return projected_query(related, fields).filter(related.id.in_(ids)).statement
+
+
+def encode_related(related, rows):
+    fields = tuple(related.projection())
+    encode = row_encoder(selected_columns(related, fields), fields)
+    return {row.id: encode(row) for row in rows}
+
+
+def related_ids(rows, key):
+    return {getattr(row, key) for row in rows} - {None}
+
+
+def load_related(related, ids):
+    return encode_related(related, db.session.execute(related_statement(related, ids))) if ids else {}
+
+
+def load_includes(rows, includes):
+    """{name: (foreign key field, {id: serialized related row})} with one query per relation."""
+    return {name: (key, load_related(related, related_ids(rows, key))) for name, (key, related) in includes.items()}
+
+
+def include_item(item, includes):
+    """Copy of a serialized item with its ?include= relations embedded."""
+    item = dict(item)
+    for name, (key, related) in includes.items():
+        item[name] = load_related(related, {item[key]} - {None}).get(item[key])
+    return item
+
+
+def list_args(model):
+    """Parse the arguments of a list endpoint: (limit, cursor, fields, sort keys)."""
+    limit, cursor = page_args()
+    return limit, cursor, field_args(model), sort_args(model)
+
+
+def rows_body(model, rows, fields, keys=(), included=None):
+    """{"msg", "result"} or, for ?shape=columns, {"msg", "columns", "rows"} with the relations of `included`."""
+    included = included or {}
+    selected = selected_columns(model, fields, keys, tuple(key for key, items in included.values()))
+    if shape_arg() == 'columns':
+        encode = row_values_encoder(selected, fields)
+        values = [encode(row) for row in rows]
+        for name, (key, items) in included.items():
+            for row, row_values in zip(rows, values):
+                row_values.append(items.get(getattr(row, key)))
+        return {"msg": "ok", "columns": list(fields) + list(included), "rows": values}
+
+    encode = row_encoder(selected, fields)
+    result = [encode(row) for row in rows]
+    for name, (key, items) in included.items():
+        for row, item in zip(rows, result):
+            item[name] = items.get(getattr(row, key))
+    return {"msg": "ok", "result": result}
+
+
+def page_body(model, name, rows, has_more, fields, keys, total, included=None):
+    response_body = rows_body(model, rows, fields, keys, included)
+    response_body["next_cursor"] = None
+    response_body["next"] = None
+
+    if total is not None:
+        response_body[f"total_{name}"] = total
+
+    if has_more:
+        last = rows[-1]
+        next_cursor = encode_cursor({"id": last.id, "keys": [getattr(last, key[0]) for key in keys]})
+        args = request.args.to_dict()
+        args['after'] = next_cursor
+        response_body["next_cursor"] = next_cursor
+        response_body["next"] = url_for(request.endpoint, **(request.view_args or {}), **args)
+
+    return response_body
+
+
+def lookup_query(model, ids, fields, includes):
+    return projected_query(model, fields, extra=include_keys(includes)).filter(model.id.in_(ids))
+
+
+def lookup_body(model, ids, rows, fields, included):
+    """Rows in the order of ?ids=, plus the ids that do not exist under "missing"."""
+    by_id = {row.id: row for row in rows}
+    response_body = rows_body(model, [by_id[item_id] for item_id in ids if item_id in by_id], fields,
+                              included=included)
+    response_body["missing"] = [item_id for item_id in ids if item_id not in by_id]
+    return response_body
+
+
+def lookup(model, ids, *conditions):
+    # Every requested row with a single IN query, and one more per ?include= relation
+    fields = field_args(model)
+    includes = include_args(model)
+    rows = lookup_query(model, ids, fields, includes).filter(*conditions).all()
+    return lookup_body(model, ids, rows, fields, load_includes(rows, includes))
+
+
+def paginate(model, name, *conditions, total=None):
+    """Build the body of a paginated list endpoint for `model`.
+
+    `name` is the plural used in the `total_<name>` key. With ?ids= it returns
+    those rows instead of a page. `conditions` restrict the rows (e.g. to the
+    residents of a planet) and `total`, when known, is their number.
+    """
+    ids = ids_arg()
+    if ids is not None:
+        return lookup(model, ids, *conditions)
+
+    limit, cursor, fields, keys = list_args(model)
+    includes = include_args(model)
+    base_query = filtered_query(model, fields, keys, include_keys(includes)).filter(*conditions)
+
+    rows, has_more = keyset_page(base_query, model, keys, limit, cursor)
+    if total is None or request.args.get('filter'):
+        total = row_count(model, base_query if request.args.get('filter') or conditions else None)
+    elif request.args.get('count') == 'none':
+        total = None
+    return page_body(model, name, rows, has_more, fields, keys, total, load_includes(rows, includes))
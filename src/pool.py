@@ -0,0 +1,242 @@
+"""
+Database engine / connection pool configuration and pool statistics
+
+Every gunicorn worker is a separate process with its own pool, so a deploy can
+open up to
+
+    WEB_CONCURRENCY x (DB_POOL_SIZE + DB_MAX_OVERFLOW)
+
+connections, which has to stay below the max_connections of the database plan.
+When DB_MAX_CONNECTIONS is set, the pool size and overflow of each worker are
+capped to an even share of that budget (minus DB_RESERVED_CONNECTIONS kept free
+for migrations, psql and the admin); `flask pool-sizing` prints the numbers.
+SQLite keeps SQLAlchemy's default pool and only gets the statistics.
+
+Statistics are kept per engine and labelled by bind: "default" for the
+primary, "replica" for the read replica. Engines that are not instrumented
+(the async engine of asgi.py, the LISTEN connection of catalog_snapshot.py)
+are not counted.
+"""
+import os
+import threading
+import time
+import weakref
+import click
+from sqlalchemy import event, exc
+from sqlalchemy.pool import QueuePool
+
+
+def _env_int(name, default):
+    value = os.getenv(name)
+    return int(value) if value not in (None, '') else default
+
+
+def _env_flag(name, default):
+    value = os.getenv(name)
+    return value.lower() in ('1', 'true', 'yes') if value not in (None, '') else default
+
+
+def pool_settings(workers=None):
+    """Pool settings of one worker, from the environment and the worker count."""
+    workers = workers or _env_int('WEB_CONCURRENCY', 1)
+    pool_size = _env_int('DB_POOL_SIZE', 5)
+    max_overflow = _env_int('DB_MAX_OVERFLOW', 10)
+
+    max_connections = _env_int('DB_MAX_CONNECTIONS', None)
+    if max_connections is not None:
+        # Even share of the connection budget per worker, at least one
+        share = max(1, (max_connections - _env_int('DB_RESERVED_CONNECTIONS', 3)) // workers)
+        pool_size = min(pool_size, share)
+        max_overflow = max(0, min(max_overflow, share - pool_size))
+
+    return {
+        'workers': workers,
+        'pool_size': pool_size,
+        'max_overflow': max_overflow,
+        'pool_timeout': _env_int('DB_POOL_TIMEOUT', 10),
+        'pool_recycle': _env_int('DB_POOL_RECYCLE', 1800),
+        'pool_pre_ping': _env_flag('DB_POOL_PRE_PING', True),
+        'statement_timeout_ms': _env_int('DB_STATEMENT_TIMEOUT_MS', 0),
+    }
+
+
+def _statement_timeout_args(driver, milliseconds):
+    if not milliseconds:
+        return {}
+    if driver in ('postgresql', 'postgresql+psycopg2'):
+        return {'options': f'-c statement_timeout={milliseconds}'}
+    if driver == 'postgresql+asyncpg':
+        return {'server_settings': {'statement_timeout': str(milliseconds)}}
+    if driver in ('mysql', 'mysql+mysqldb'):
+        return {'init_command': f'SET SESSION max_execution_time={milliseconds}'}
+    return {}
+
+
+def engine_options(url, instrumented=True):
+    """create_engine() keyword arguments for `url` (SQLALCHEMY_ENGINE_OPTIONS)."""
+    driver = url.split('://', 1)[0]
+    if driver.startswith('sqlite'):
+        return {}
+
+    settings = pool_settings()
+    options = {
+        'pool_size': settings['pool_size'],
+        'max_overflow': settings['max_overflow'],
+        'pool_timeout': settings['pool_timeout'],
+        'pool_recycle': settings['pool_recycle'],
+        'pool_pre_ping': settings['pool_pre_ping'],
+    }
+    connect_args = _statement_timeout_args(driver, settings['statement_timeout_ms'])
+    if connect_args:
+        options['connect_args'] = connect_args
+    if instrumented:
+        # Async engines need their own adapted pool class
+        options['poolclass'] = InstrumentedQueuePool
+    return options
+
+
+# ========== statistics ========== #
+
+class PoolStats:
+    def __init__(self, bind=None):
+        self.bind = bind
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.connects = 0
+            self.checkouts = 0
+            self.checkins = 0
+            self.invalidations = 0
+            self.timeouts = 0
+            self.wait_seconds = 0.0
+            self.max_wait_seconds = 0.0
+
+    def add(self, counter, amount=1):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + amount)
+
+    def waited(self, seconds):
+        with self._lock:
+            self.wait_seconds += seconds
+            self.max_wait_seconds = max(self.max_wait_seconds, seconds)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "connects": self.connects,
+                "checkouts": self.checkouts,
+                "checkins": self.checkins,
+                "invalidations": self.invalidations,
+                "timeouts": self.timeouts,
+                "wait_ms_total": round(self.wait_seconds * 1000, 3),
+                "wait_ms_max": round(self.max_wait_seconds * 1000, 3),
+                "wait_ms_avg": round(self.wait_seconds * 1000 / self.checkouts, 3) if self.checkouts else 0.0,
+            }
+
+
+# engine -> PoolStats, for the engines instrumented in this process
+_engine_stats = weakref.WeakKeyDictionary()
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool that records how long each checkout waited for a connection."""
+
+    # PoolStats of the engine, set by instrument_engine()
+    stats = None
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            if self.stats is not None:
+                self.stats.add('timeouts')
+            raise
+        finally:
+            if self.stats is not None:
+                self.stats.waited(time.perf_counter() - started)
+
+    def recreate(self):
+        # engine.dispose() swaps in a new pool; the listeners are carried over by SQLAlchemy
+        pool = super().recreate()
+        pool.stats = self.stats
+        return pool
+
+
+def instrument_engine(engine, bind='default'):
+    """Count the connections of the pool of `engine` in a PoolStats labelled `bind`; returns it."""
+    if engine in _engine_stats:
+        return _engine_stats[engine]
+    stats = _engine_stats[engine] = PoolStats(bind)
+    if isinstance(engine.pool, InstrumentedQueuePool):
+        engine.pool.stats = stats
+
+    def connected(dbapi_connection, connection_record):
+        stats.add('connects')
+
+    def checked_out(dbapi_connection, connection_record, connection_proxy):
+        stats.add('checkouts')
+
+    def checked_in(dbapi_connection, connection_record):
+        stats.add('checkins')
+
+    def invalidated(dbapi_connection, connection_record, exception):
+        stats.add('invalidations')
+
+    event.listen(engine.pool, 'connect', connected)
+    event.listen(engine.pool, 'checkout', checked_out)
+    event.listen(engine.pool, 'checkin', checked_in)
+    event.listen(engine.pool, 'invalidate', invalidated)
+    return stats
+
+
+def instrument_pools(db):
+    """Instrument every engine of `db`, labelled by its bind; call after db.init_app() in an app context."""
+    for bind, engine in db.engines.items():
+        instrument_engine(engine, bind or 'default')
+
+
+def pool_stats(engine):
+    """PoolStats of `engine`, or None when it is not instrumented."""
+    return _engine_stats.get(engine)
+
+
+def instrumented_engines():
+    """The engines with pool statistics in this process, by bind."""
+    return sorted(list(_engine_stats.keys()), key=lambda engine: _engine_stats[engine].bind)
+
+
+def pool_status(engine):
+    """Current state of the pool of `engine` in this process plus its counters."""
+    pool = engine.pool
+    stats = _engine_stats.get(engine) or PoolStats()
+    status = {"pool": type(pool).__name__, "bind": stats.bind, **stats.snapshot()}
+    if isinstance(pool, QueuePool):
+        status.update({
+            "size": pool.size(),
+            "checked_in": pool.checkedin(),
+            "checked_out": pool.checkedout(),
+            # overflow() counts up from -size until the pool is full
+            "overflow": max(0, pool.overflow()),
+            "timeout": pool.timeout(),
+        })
+    return status
+
+
+def setup_pool(app):
+    """Set SQLALCHEMY_ENGINE_OPTIONS from the environment; call before db.init_app()."""
+    options = engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', options)
+
+    @app.cli.command('pool-sizing')
+    @click.option('--workers', type=int, default=None, help='gunicorn workers (default WEB_CONCURRENCY)')
+    def pool_sizing(workers):
+        """Print the per-worker pool settings and the connections a deploy can open."""
+        settings = pool_settings(workers)
+        per_worker = settings['pool_size'] + settings['max_overflow']
+        for name, value in settings.items():
+            click.echo(f'{name}: {value}')
+        click.echo(f"connections per worker: {per_worker}")
+        click.echo(f"connections for {settings['workers']} workers: {per_worker * settings['workers']}")
@@ -0,0 +1,197 @@
+"""
+Favorite counts behind GET /planets/popular and /characters/popular
+
+A GROUP BY over FavoritePlanets / FavoriteCharacters on every request reads
+both tables whole. FavoriteCounts keeps one counter per favorited planet or
+character instead:
+- the favorites service (add, remove, batch) adjusts the counters in the same
+  transaction as the write, with one upsert per item. Items are sorted by id,
+  so concurrent batches lock the counters in the same order;
+- ORM writes (admin views) adjust them through mapper events;
+- `flask reconcile-popularity` recomputes the exact counts in bulk and
+  rewrites only the counters that drifted. Bulk loads run it too.
+
+A leaderboard is the top POPULAR_TOP_K counters of a kind, read backwards along
+the (kind, favorites, item_id) index, and their items with one IN query. Each
+process keeps it for POPULAR_CACHE_SECONDS, so the leaderboards cost a couple
+of queries every few seconds whatever the request rate. When an entry expires
+one request reloads it and the others wait for it. Ties go to the newest item.
+"""
+import os
+import threading
+import click
+from flask import current_app, request
+from sqlalchemy import bindparam, delete, event, func, insert, select, text, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm.attributes import get_history
+from cache import LRUCache
+from models import db, Planet, Character, FavoritePlanet, FavoriteCharacter, FavoriteCount
+from pagination import encode_related, related_statement
+
+POPULAR_DEFAULT_LIMIT = int(os.getenv("POPULAR_DEFAULT_LIMIT", 10))
+
+COUNTS = FavoriteCount.__table__
+
+# kind -> (favorite model, catalog model, attribute of the favorite with the item id)
+KINDS = {
+    'planet': (FavoritePlanet, Planet, 'planet_id'),
+    'character': (FavoriteCharacter, Character, 'character_id'),
+}
+FAVORITE_MODELS = {favorite_model: kind for kind, (favorite_model, item_model, id_key) in KINDS.items()}
+
+# kind -> [(favorites, serialized item)], best first
+leaderboards = LRUCache(maxsize=len(KINDS), ttl=5)
+_loading = threading.Lock()
+
+
+def _upsert():
+    dialect = db.engine.dialect.name
+    if dialect not in ('postgresql', 'sqlite'):
+        return None
+    statement = (postgresql if dialect == 'postgresql' else sqlite).insert(COUNTS)
+    return statement.on_conflict_do_update(index_elements=[COUNTS.c.kind, COUNTS.c.item_id],
+                                           set_={'favorites': COUNTS.c.favorites + statement.excluded.favorites})
+
+
+def count_favorites(connection, kind, added=(), removed=()):
+    """Add one favorite to each id in `added` and take one from each id in `removed`, in the caller's transaction."""
+    deltas = {}
+    for item_id in added:
+        deltas[item_id] = deltas.get(item_id, 0) + 1
+    for item_id in removed:
+        deltas[item_id] = deltas.get(item_id, 0) - 1
+    rows = [{'kind': kind, 'item_id': item_id, 'favorites': delta}
+            for item_id, delta in sorted(deltas.items()) if delta]
+    if not rows:
+        return
+
+    upsert = _upsert()
+    if upsert is not None:
+        connection.execute(upsert, rows)
+        return
+    for row in rows:
+        result = connection.execute(update(COUNTS).where(COUNTS.c.kind == kind, COUNTS.c.item_id == row['item_id'])
+                                    .values(favorites=COUNTS.c.favorites + row['favorites']))
+        if result.rowcount == 0:
+            connection.execute(insert(COUNTS).values(**row))
+
+
+def _item_id(target, before_flush=False):
+    id_key = KINDS[FAVORITE_MODELS[type(target)]][2]
+    if not before_flush:
+        return getattr(target, id_key)
+    history = get_history(target, id_key)
+    return (history.deleted or history.unchanged or history.added or [None])[0]
+
+
+def _favorite_inserted(mapper, connection, target):
+    count_favorites(connection, FAVORITE_MODELS[type(target)], added=[_item_id(target)])
+
+
+def _favorite_updated(mapper, connection, target):
+    old, new = _item_id(target, before_flush=True), _item_id(target)
+    if old != new:
+        count_favorites(connection, FAVORITE_MODELS[type(target)], added=[new], removed=[old])
+
+
+def _favorite_deleting(mapper, connection, target):
+    # Before the DELETE, while an expired item id can still be loaded
+    count_favorites(connection, FAVORITE_MODELS[type(target)], removed=[_item_id(target, before_flush=True)])
+
+
+# ========== leaderboards ========== #
+
+def top_statement(kind, size):
+    return select(COUNTS.c.item_id, COUNTS.c.favorites) \
+        .where(COUNTS.c.kind == kind, COUNTS.c.favorites > 0) \
+        .order_by(COUNTS.c.favorites.desc(), COUNTS.c.item_id.desc()).limit(size)
+
+
+def load_leaderboard(kind, size):
+    """[(favorites, serialized item)] of the `size` most favorited items of `kind`."""
+    favorite_model, item_model, id_key = KINDS[kind]
+    top = db.session.execute(top_statement(kind, size)).all()
+    if not top:
+        return []
+    items = encode_related(item_model, db.session.execute(related_statement(item_model, [row.item_id for row in top])))
+    # Counters of deleted items are left for the next reconcile
+    return [(row.favorites, items[row.item_id]) for row in top if row.item_id in items]
+
+
+def leaderboard(kind):
+    entries = leaderboards.get(kind)
+    if entries is None:
+        with _loading:
+            entries = leaderboards.get(kind)
+            if entries is None:
+                entries = load_leaderboard(kind, current_app.config['POPULAR_TOP_K'])
+                leaderboards.set(kind, entries)
+    return entries
+
+
+def popular_body(kind):
+    """Body of GET /planets/popular and /characters/popular (?limit= up to POPULAR_TOP_K)."""
+    top_k = current_app.config['POPULAR_TOP_K']
+    limit = max(1, min(request.args.get('limit', POPULAR_DEFAULT_LIMIT, type=int), top_k))
+    entries = leaderboard(kind)[:limit]
+    return {
+        "msg": "ok",
+        "total": len(entries),
+        "result": [{"rank": rank, "favorites": favorites, kind: item}
+                   for rank, (favorites, item) in enumerate(entries, start=1)]
+    }
+
+
+# ========== reconcile ========== #
+
+def reconcile_counts(connection):
+    """Recompute every counter from the favorites tables; returns {kind: counters corrected}."""
+    if connection.dialect.name == 'postgresql':
+        # Favorites writes wait until the new counts commit; reads go on
+        connection.execute(text('LOCK TABLE "FavoritePlanets", "FavoriteCharacters" IN SHARE MODE'))
+
+    corrected = {}
+    for kind, (favorite_model, item_model, id_key) in KINDS.items():
+        # One GROUP BY and one read of the counters, then only the differences are written
+        item_column = favorite_model.__table__.c[id_key]
+        exact = dict(connection.execute(select(item_column, func.count()).group_by(item_column)).all())
+        stored = dict(connection.execute(select(COUNTS.c.item_id, COUNTS.c.favorites)
+                                         .where(COUNTS.c.kind == kind)).all())
+
+        changed = [{'key': item_id, 'value': count} for item_id, count in sorted(exact.items())
+                   if item_id in stored and stored[item_id] != count]
+        missing = [{'kind': kind, 'item_id': item_id, 'favorites': count}
+                   for item_id, count in sorted(exact.items()) if item_id not in stored]
+        # Items nobody favorites any more (or deleted ones) leave the table
+        stale = [item_id for item_id in stored if item_id not in exact]
+
+        if changed:
+            connection.execute(update(COUNTS).where(COUNTS.c.kind == kind, COUNTS.c.item_id == bindparam('key'))
+                               .values(favorites=bindparam('value')), changed)
+        if missing:
+            connection.execute(insert(COUNTS), missing)
+        if stale:
+            connection.execute(delete(COUNTS).where(COUNTS.c.kind == kind, COUNTS.c.item_id.in_(stale)))
+        corrected[kind] = len(changed) + len(missing) + sum(1 for item_id in stale if stored[item_id] != 0)
+
+    leaderboards.clear()
+    return corrected
+
+
+def setup_popularity(app):
+    app.config.setdefault('POPULAR_TOP_K', int(os.getenv('POPULAR_TOP_K', 100)))
+    app.config.setdefault('POPULAR_CACHE_SECONDS', float(os.getenv('POPULAR_CACHE_SECONDS', 5)))
+    leaderboards.ttl = app.config['POPULAR_CACHE_SECONDS']
+
+    if not event.contains(FavoritePlanet, 'after_insert', _favorite_inserted):
+        for favorite_model in FAVORITE_MODELS:
+            event.listen(favorite_model, 'after_insert', _favorite_inserted)
+            event.listen(favorite_model, 'after_update', _favorite_updated)
+            event.listen(favorite_model, 'before_delete', _favorite_deleting)
+
+    @app.cli.command('reconcile-popularity')
+    def reconcile_popularity():
+        """Recompute the favorite counts behind /planets/popular and /characters/popular."""
+        with db.engine.begin() as connection:
+            corrected = reconcile_counts(connection)
+        click.echo(', '.join(f'{kind}: {count} counters corrected' for kind, count in corrected.items()))
@@ -0,0 +1,165 @@
+"""
+Opt-in per-request profiler (PROFILE_REQUESTS=1)
+
+Engine cursor events count the SQL statements of each request and time them,
+the JSON provider is timed for serialization (and compression.py reports its
+time), and after the request:
+
+- requests slower than PROFILE_SLOW_MS, with a statement slower than
+  PROFILE_SLOW_QUERY_MS or with an N+1 pattern (the same statement run at least
+  PROFILE_N_PLUS_ONE times with different parameters) are written to the
+  `profiler` logger as one JSON object per line;
+- with PROFILE_SERVER_TIMING=1 the numbers are also sent in a Server-Timing
+  header, which browsers show in the network panel.
+
+Streamed responses are profiled up to the point where the body starts; the
+async handlers of asgi.py are not profiled.
+"""
+import json
+import logging
+import os
+import time
+from collections import defaultdict
+from functools import wraps
+from flask import current_app, g, has_app_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger('profiler')
+
+
+def _env_flag(name):
+    return os.getenv(name, '0').lower() in ('1', 'true', 'yes')
+
+
+class RequestProfile:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.statements = 0
+        self.db_seconds = 0.0
+        self.serialize_seconds = 0.0
+        self.serializing = False
+        self.compress_seconds = 0.0
+        # statement -> [number of executions, set of parameter reprs]
+        self.executions = defaultdict(lambda: [0, set()])
+        self.slow_queries = []
+
+    def record(self, statement, parameters, seconds, slow_seconds):
+        self.statements += 1
+        self.db_seconds += seconds
+        executions = self.executions[statement]
+        executions[0] += 1
+        executions[1].add(repr(parameters))
+        if seconds >= slow_seconds:
+            self.slow_queries.append({"statement": statement[:500], "ms": round(seconds * 1000, 2)})
+
+    def n_plus_one(self, threshold):
+        return [
+            {"statement": statement[:500], "count": count, "distinct_parameters": len(parameters)}
+            for statement, (count, parameters) in self.executions.items()
+            if count >= threshold and len(parameters) > 1
+        ]
+
+
+def current_profile():
+    return g.get('_request_profile') if has_app_context() else None
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # Kept on the execution context, which a statement that raises simply drops
+    if context is not None and current_profile() is not None:
+        context.profiler_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = current_profile()
+    started = getattr(context, 'profiler_started', None)
+    if profile is None or started is None:
+        return
+    slow_seconds = current_app.config['PROFILE_SLOW_QUERY_MS'] / 1000
+    profile.record(statement, parameters, time.perf_counter() - started, slow_seconds)
+
+
+def _timed_serializer(function):
+    # Time spent turning the response into JSON; nested calls (response() calling
+    # dumps()) are counted once
+    @wraps(function)
+    def timed(*args, **kwargs):
+        profile = current_profile()
+        if profile is None or profile.serializing:
+            return function(*args, **kwargs)
+        profile.serializing = True
+        started = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            profile.serializing = False
+            profile.serialize_seconds += time.perf_counter() - started
+    return timed
+
+
+def _start_profile():
+    g._request_profile = RequestProfile()
+
+
+def _finish_profile(response):
+    profile = g.pop('_request_profile', None)
+    if profile is None:
+        return response
+
+    config = current_app.config
+    total_ms = (time.perf_counter() - profile.started) * 1000
+    db_ms = profile.db_seconds * 1000
+    serialize_ms = profile.serialize_seconds * 1000
+    compress_ms = profile.compress_seconds * 1000
+    n_plus_one = profile.n_plus_one(config['PROFILE_N_PLUS_ONE'])
+
+    if config['PROFILE_SERVER_TIMING']:
+        response.headers.add('Server-Timing', f'db;dur={db_ms:.2f};desc="{profile.statements} queries"')
+        response.headers.add('Server-Timing', f'serialize;dur={serialize_ms:.2f}')
+        response.headers.add('Server-Timing', f'compress;dur={compress_ms:.2f}')
+        response.headers.add('Server-Timing', f'total;dur={total_ms:.2f}')
+
+    if total_ms >= config['PROFILE_SLOW_MS'] or profile.slow_queries or n_plus_one:
+        entry = {
+            "event": "slow_request" if total_ms >= config['PROFILE_SLOW_MS'] else "request_warning",
+            "method": request.method,
+            "path": request.full_path.rstrip('?'),
+            "endpoint": request.endpoint,
+            "status": response.status_code,
+            "total_ms": round(total_ms, 2),
+            "db_ms": round(db_ms, 2),
+            "db_statements": profile.statements,
+            "serialize_ms": round(serialize_ms, 2),
+            "compress_ms": round(compress_ms, 2),
+            "response_bytes": response.calculate_content_length(),
+            "slow_queries": profile.slow_queries,
+            "n_plus_one": n_plus_one,
+        }
+        logger.warning(json.dumps(entry, default=str))
+    return response
+
+
+def setup_profiler(app):
+    """Install the profiler when PROFILE_REQUESTS is on; call after setup_serializers()."""
+    app.config.setdefault('PROFILE_REQUESTS', _env_flag('PROFILE_REQUESTS'))
+    app.config.setdefault('PROFILE_SLOW_MS', float(os.getenv('PROFILE_SLOW_MS', 500)))
+    app.config.setdefault('PROFILE_SLOW_QUERY_MS', float(os.getenv('PROFILE_SLOW_QUERY_MS', 100)))
+    app.config.setdefault('PROFILE_N_PLUS_ONE', int(os.getenv('PROFILE_N_PLUS_ONE', 5)))
+    app.config.setdefault('PROFILE_SERVER_TIMING', _env_flag('PROFILE_SERVER_TIMING'))
+    if not app.config['PROFILE_REQUESTS']:
+        return
+
+    if not logger.handlers:
+        logger.addHandler(logging.StreamHandler())
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+
+    app.json.dumps = _timed_serializer(app.json.dumps)
+    app.json.response = _timed_serializer(app.json.response)
+    app.before_request(_start_profile)
+    app.after_request(_finish_profile)
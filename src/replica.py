@@ -0,0 +1,198 @@
+"""
+Read-replica routing for the db session
+
+With DATABASE_REPLICA_URL set, the statements of GET/HEAD requests run on the
+replica engine (the "replica" entry of SQLALCHEMY_BINDS). Everything else stays
+on the primary:
+- flushes and INSERT/UPDATE/DELETE statements;
+- the rest of a request once it has written;
+- other methods and CLI commands;
+- views decorated with @use_primary (read-your-own-write responses).
+
+Replica reads are skipped while the replica is more than
+REPLICA_MAX_LAG_SECONDS behind, while it cannot be reached, and for
+REPLICA_MAX_LAG_SECONDS after this process commits a write. The lag is checked
+at most every REPLICA_LAG_CHECK_SECONDS:
+- a Postgres standby reports its replay delay;
+- any other replica (e.g. a copy of a SQLite file) is compared with the
+  primary's TableVersions.
+
+To try it locally with SQLite, copy the database file to a second path
+(`sqlite3 /tmp/test.db ".backup /tmp/replica.db"`) and set
+DATABASE_REPLICA_URL=sqlite:////tmp/replica.db.
+"""
+import os
+import threading
+import time
+from datetime import datetime
+from functools import wraps
+import click
+from flask import current_app, g, has_request_context, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event, exc, text
+from sqlalchemy.sql.dml import UpdateBase
+from pool import engine_options, pool_status
+
+READ_METHODS = ('GET', 'HEAD')
+
+# NULL on a server that is not a standby; 0 when everything received has been replayed
+POSTGRES_LAG = text("""
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN NULL
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+    END
+""")
+
+
+def _version_lag(primary, replica):
+    # versioning imports models, which imports this module
+    from versioning import VERSIONED_MODELS, versions_from_rows, versions_statement
+
+    tables = tuple(model.__tablename__ for model in VERSIONED_MODELS)
+    with primary.connect() as connection:
+        expected = versions_from_rows(tables, connection.execute(versions_statement(*tables)))
+    with replica.connect() as connection:
+        applied = versions_from_rows(tables, connection.execute(versions_statement(*tables)))
+
+    # A table behind the primary is counted as stale since the replica's own last
+    # change to it: an upper bound, so the fallback errs towards the primary
+    behind = [applied[name][1] for name in tables if applied[name][0] < expected[name][0]]
+    if not behind:
+        return 0.0
+    if None in behind:
+        return float('inf')
+    return max(0.0, (datetime.utcnow() - min(behind)).total_seconds())
+
+
+def replica_lag(primary, replica):
+    """Seconds the replica is behind the primary."""
+    if replica.dialect.name == 'postgresql':
+        with replica.connect() as connection:
+            lag = connection.execute(POSTGRES_LAG).scalar()
+        if lag is not None:
+            return float(lag)
+    return _version_lag(primary, replica)
+
+
+class ReplicaRouter:
+    """Per-process replica health: last measured lag and the last write of this process."""
+
+    def __init__(self):
+        self.lag = None
+        self.error = None
+        self.checked_at = None
+        self.last_write = None
+        self.replica_reads = 0
+        self.primary_reads = 0
+        self._lock = threading.Lock()
+
+    def check(self, primary, replica):
+        self.checked_at = time.monotonic()
+        try:
+            self.lag = replica_lag(primary, replica)
+            self.error = None
+        except exc.SQLAlchemyError as error:
+            # Unreachable replica: primary only until the next check
+            self.lag = None
+            self.error = type(error).__name__
+
+    def usable(self, primary, replica, max_lag, interval):
+        now = time.monotonic()
+        if self.last_write is not None and now - self.last_write < max_lag:
+            return False
+        # One thread refreshes the lag, the others keep the last value meanwhile
+        if (self.checked_at is None or now - self.checked_at >= interval) and self._lock.acquire(blocking=False):
+            try:
+                self.check(primary, replica)
+            finally:
+                self._lock.release()
+        return self.lag is not None and self.lag <= max_lag
+
+    def wrote(self):
+        self.last_write = time.monotonic()
+
+    def status(self):
+        return {
+            "lag_seconds": self.lag,
+            "error": self.error,
+            "seconds_since_check": round(time.monotonic() - self.checked_at, 3) if self.checked_at else None,
+            "replica_reads": self.replica_reads,
+            "primary_reads": self.primary_reads,
+        }
+
+
+replica_router = ReplicaRouter()
+
+
+def use_primary(view):
+    """Run every statement of the view on the primary, e.g. to read the client's own writes."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        g._use_primary = True
+        return view(*args, **kwargs)
+    return wrapper
+
+
+class RoutingSession(Session):
+    """db.session class that sends the reads of GET requests to the "replica" bind."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and self._reads_from_replica(clause):
+            return self._db.engines['replica']
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+    def _reads_from_replica(self, clause):
+        if 'replica' not in self._db.engines:
+            return False
+        if self._flushing or isinstance(clause, UpdateBase):
+            # Later reads of this session must see the write
+            self.info['wrote'] = True
+            return False
+        if self.info.get('wrote') or not has_request_context() or request.method not in READ_METHODS \
+                or g.get('_use_primary'):
+            return False
+
+        config = current_app.config
+        if replica_router.usable(self._db.engines[None], self._db.engines['replica'],
+                                 config['REPLICA_MAX_LAG_SECONDS'], config['REPLICA_LAG_CHECK_SECONDS']):
+            replica_router.replica_reads += 1
+            return True
+        replica_router.primary_reads += 1
+        return False
+
+
+def _after_commit(session):
+    if session.info.pop('wrote', False):
+        replica_router.wrote()
+
+
+def replica_status(db):
+    """Lag, routing counters and pool of the replica, or None without one."""
+    if 'replica' not in db.engines:
+        return None
+    return {**replica_router.status(), "pool": pool_status(db.engines['replica'])}
+
+
+def setup_replica(app):
+    """Add the "replica" bind from DATABASE_REPLICA_URL; call before db.init_app()."""
+    url = os.getenv("DATABASE_REPLICA_URL")
+    app.config.setdefault('REPLICA_MAX_LAG_SECONDS', float(os.getenv("REPLICA_MAX_LAG_SECONDS", 5)))
+    app.config.setdefault('REPLICA_LAG_CHECK_SECONDS', float(os.getenv("REPLICA_LAG_CHECK_SECONDS", 1)))
+    if url:
+        url = url.replace("postgres://", "postgresql://")
+        app.config.setdefault('SQLALCHEMY_BINDS', {})['replica'] = {'url': url, **engine_options(url)}
+
+    if not event.contains(Session, 'after_commit', _after_commit):
+        event.listen(Session, 'after_commit', _after_commit)
+
+    @app.cli.command('replica-lag')
+    def print_replica_lag():
+        """Print how far the read replica is behind the primary."""
+        from models import db
+
+        if 'replica' not in db.engines:
+            raise click.ClickException('DATABASE_REPLICA_URL is not set')
+        lag = replica_lag(db.engines[None], db.engines['replica'])
+        limit = app.config['REPLICA_MAX_LAG_SECONDS']
+        click.echo(f"lag: {lag:.3f}s ({'replica reads' if lag <= limit else 'primary only'}, limit {limit}s)")
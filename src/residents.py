@@ -0,0 +1,85 @@
+"""
+Denormalized Planet.resident_count
+
+Inserting or deleting a Character, or changing its home world, adjusts the
+counters of the planets involved. This is an UPDATE ... SET resident_count =
+resident_count ± 1 in the same transaction, so /planets never has to count the
+characters of each planet. The count is part of every planet's JSON, so the
+same flush bumps the Planets table version, which moves the catalog cache and
+the ETags to new entries. Bulk loads skip the mapper events and call
+refresh_resident_counts() instead.
+"""
+from sqlalchemy import event, func, select, update
+from sqlalchemy.orm import Session, object_session
+from sqlalchemy.orm.attributes import get_history
+from sqlalchemy.orm.util import identity_key
+from changes import record_change
+from models import Planet, Character
+from versioning import bump_versions, changed_tables
+
+PLANETS = Planet.__table__
+CHARACTERS = Character.__table__
+
+
+def _adjust(connection, target, planet_id, delta):
+    if planet_id is None:
+        return
+    connection.execute(update(PLANETS).where(PLANETS.c.id == planet_id)
+                       .values(resident_count=PLANETS.c.resident_count + delta))
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault('resident_count_planets', set()).add(planet_id)
+        record_change(session, 'planets', planet_id, 'update')
+
+
+def _character_inserted(mapper, connection, target):
+    _adjust(connection, target, target.home_world_id, 1)
+
+
+def _character_updated(mapper, connection, target):
+    history = get_history(target, 'home_world_id')
+    if history.has_changes():
+        old = history.deleted[0] if history.deleted else None
+        new = history.added[0] if history.added else None
+        if old != new:
+            _adjust(connection, target, old, -1)
+            _adjust(connection, target, new, 1)
+
+
+def _character_deleting(mapper, connection, target):
+    # Before the DELETE, while an expired home_world_id can still be loaded
+    history = get_history(target, 'home_world_id')
+    old = (history.deleted or history.unchanged or history.added or [None])[0]
+    _adjust(connection, target, old, -1)
+
+
+def _after_flush(session, flush_context):
+    planet_ids = session.info.get('resident_count_planets')
+    if not planet_ids:
+        return
+    if Planet.__tablename__ not in changed_tables(session):
+        bump_versions(session.connection(), {Planet.__tablename__})
+
+
+def _after_flush_postexec(session, flush_context):
+    # Loaded planets still hold the old count
+    for planet_id in session.info.pop('resident_count_planets', ()):
+        planet = session.identity_map.get(identity_key(Planet, planet_id))
+        if planet is not None:
+            session.expire(planet, ['resident_count', 'updated_at'])
+
+
+def refresh_resident_counts(connection):
+    """Recount the residents of every planet with one UPDATE, after writes that skip the mapper events."""
+    residents = select(func.count()).where(CHARACTERS.c.home_world_id == PLANETS.c.id).scalar_subquery()
+    connection.execute(update(PLANETS).values(resident_count=residents))
+
+
+def setup_residents(app):
+    if event.contains(Character, 'after_insert', _character_inserted):
+        return
+    event.listen(Character, 'after_insert', _character_inserted)
+    event.listen(Character, 'after_update', _character_updated)
+    event.listen(Character, 'before_delete', _character_deleting)
+    event.listen(Session, 'after_flush', _after_flush)
+    event.listen(Session, 'after_flush_postexec', _after_flush_postexec)
@@ -0,0 +1,175 @@
+"""
+Type-ahead search over planets and characters
+
+The SearchIndex table is an FTS5 virtual table on SQLite and a tsvector +
+trigram indexed table on Postgres. Planet and Character mapper events keep it
+in sync inside the same transaction as the write; `flask search-reindex`
+rebuilds it from scratch.
+"""
+import os
+import re
+import time
+import click
+from sqlalchemy import event, text
+from models import db, Planet, Character
+
+SEARCH_DEFAULT_LIMIT = int(os.getenv("SEARCH_DEFAULT_LIMIT", 20))
+SEARCH_MAX_LIMIT = int(os.getenv("SEARCH_MAX_LIMIT", 100))
+# Postgres statement_timeout for a search query, in milliseconds
+SEARCH_TIMEOUT_MS = int(os.getenv("SEARCH_TIMEOUT_MS", 200))
+MAX_TERMS = 8
+
+# kind -> (model, offset used to derive the FTS5 rowid, attributes indexed as body)
+KINDS = {
+    'planet': (Planet, 0, ('climate', 'terrain')),
+    'character': (Character, 1, ('gender', 'hair_color', 'eye_color', 'skin_color', 'birth_year')),
+}
+
+SQLITE_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS "SearchIndex" USING fts5(
+        kind UNINDEXED, ref_id UNINDEXED, name, body, tokenize='unicode61', prefix='2 3')""",
+]
+
+POSTGRES_DDL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    """CREATE TABLE IF NOT EXISTS "SearchIndex" (
+        kind VARCHAR(10) NOT NULL,
+        ref_id INTEGER NOT NULL,
+        name TEXT NOT NULL,
+        body TEXT,
+        document TSVECTOR GENERATED ALWAYS AS (
+            setweight(to_tsvector('simple', coalesce(name, '')), 'A') ||
+            setweight(to_tsvector('simple', coalesce(body, '')), 'B')) STORED,
+        PRIMARY KEY (kind, ref_id))""",
+    'CREATE INDEX IF NOT EXISTS "ix_SearchIndex_document" ON "SearchIndex" USING gin (document)',
+    'CREATE INDEX IF NOT EXISTS "ix_SearchIndex_name_trgm" ON "SearchIndex" USING gin (name gin_trgm_ops)',
+]
+
+
+def _ddl(dialect):
+    return {'sqlite': SQLITE_DDL, 'postgresql': POSTGRES_DDL}.get(dialect, [])
+
+
+def create_search_index(target, connection, **kwargs):
+    # Also runs after db.create_all() through the metadata after_create event
+    for statement in _ddl(connection.dialect.name):
+        connection.execute(text(statement))
+
+
+def _body(kind, target):
+    model, offset, body_attributes = KINDS[kind]
+    return ' '.join(str(getattr(target, name)) for name in body_attributes if getattr(target, name))
+
+
+def _remove(connection, kind, ref_id):
+    model, offset, body_attributes = KINDS[kind]
+    if connection.dialect.name == 'sqlite':
+        connection.execute(text('DELETE FROM "SearchIndex" WHERE rowid = :rowid'), {'rowid': ref_id * 2 + offset})
+    elif connection.dialect.name == 'postgresql':
+        connection.execute(text('DELETE FROM "SearchIndex" WHERE kind = :kind AND ref_id = :ref_id'),
+                           {'kind': kind, 'ref_id': ref_id})
+
+
+def _store(connection, kind, target):
+    model, offset, body_attributes = KINDS[kind]
+    values = {'rowid': target.id * 2 + offset, 'kind': kind, 'ref_id': target.id,
+              'name': target.name, 'body': _body(kind, target)}
+    if connection.dialect.name == 'sqlite':
+        # FTS5 rows are addressed by rowid, derived from the kind and the id
+        _remove(connection, kind, target.id)
+        connection.execute(text('INSERT INTO "SearchIndex" (rowid, kind, ref_id, name, body) '
+                                'VALUES (:rowid, :kind, :ref_id, :name, :body)'), values)
+    elif connection.dialect.name == 'postgresql':
+        connection.execute(text('INSERT INTO "SearchIndex" (kind, ref_id, name, body) '
+                                'VALUES (:kind, :ref_id, :name, :body) '
+                                'ON CONFLICT (kind, ref_id) DO UPDATE SET name = excluded.name, body = excluded.body'),
+                           values)
+
+
+def _listeners(kind):
+    def stored(mapper, connection, target):
+        _store(connection, kind, target)
+
+    def removed(mapper, connection, target):
+        _remove(connection, kind, target.id)
+
+    return stored, removed
+
+
+def rebuild_search_index(connection):
+    """Rebuild the whole index with one INSERT ... SELECT per table."""
+    dialect = connection.dialect.name
+    if dialect not in ('sqlite', 'postgresql'):
+        return
+    create_search_index(None, connection)
+    connection.execute(text('DELETE FROM "SearchIndex"'))
+    for kind, (model, offset, body_attributes) in KINDS.items():
+        body = 'trim(' + " || ' ' || ".join(f"coalesce(CAST({name} AS TEXT), '')" for name in body_attributes) + ')'
+        if dialect == 'sqlite':
+            columns, values = 'rowid, kind, ref_id, name, body', f"id * 2 + {offset}, '{kind}', id, name, {body}"
+        else:
+            columns, values = 'kind, ref_id, name, body', f"'{kind}', id, name, {body}"
+        connection.execute(text(f'INSERT INTO "SearchIndex" ({columns}) SELECT {values} FROM "{model.__tablename__}"'))
+
+
+def search_terms(query):
+    return re.findall(r'\w+', query.lower())[:MAX_TERMS]
+
+
+def search(query, limit=SEARCH_DEFAULT_LIMIT, kind=None):
+    """Return [{type, id, name, rank}] best match first; every term is a prefix."""
+    terms = search_terms(query)
+    if not terms:
+        return []
+    dialect = db.engine.dialect.name
+    params = {'limit': limit, 'kind': kind}
+    kind_filter = 'AND kind = :kind' if kind else ''
+
+    if dialect == 'sqlite':
+        params['match'] = ' '.join(f'"{term}"*' for term in terms)
+        statement = f'''SELECT kind, ref_id, name, bm25("SearchIndex", 0, 0, 10.0, 1.0) AS rank
+            FROM "SearchIndex" WHERE "SearchIndex" MATCH :match {kind_filter}
+            ORDER BY rank LIMIT :limit'''
+    elif dialect == 'postgresql':
+        db.session.execute(text(f'SET LOCAL statement_timeout = {SEARCH_TIMEOUT_MS}'))
+        params['tsquery'] = ' & '.join(f'{term}:*' for term in terms)
+        params['q'] = ' '.join(terms)
+        statement = f'''SELECT kind, ref_id, name,
+                -(ts_rank(document, to_tsquery('simple', :tsquery)) + similarity(name, :q)) AS rank
+            FROM "SearchIndex"
+            WHERE (document @@ to_tsquery('simple', :tsquery) OR name % :q) {kind_filter}
+            ORDER BY rank LIMIT :limit'''
+    else:
+        # No search index on this database: prefix match on the names only
+        results = []
+        for model_kind, (model, offset, body_attributes) in KINDS.items():
+            if kind in (None, model_kind):
+                rows = db.session.query(model.id, model.name).filter(model.name.ilike(f'{terms[0]}%')).limit(limit)
+                results += [{"type": model_kind, "id": row.id, "name": row.name, "rank": 0.0} for row in rows]
+        return results[:limit]
+
+    rows = db.session.execute(text(statement), params)
+    return [{"type": row.kind, "id": row.ref_id, "name": row.name, "rank": round(-row.rank, 4)} for row in rows]
+
+
+def timed_search(query, limit, kind=None):
+    started = time.perf_counter()
+    results = search(query, limit, kind)
+    return results, round((time.perf_counter() - started) * 1000, 2)
+
+
+def setup_search(app):
+    if not event.contains(db.Model.metadata, 'after_create', create_search_index):
+        event.listen(db.Model.metadata, 'after_create', create_search_index)
+        for kind, (model, offset, body_attributes) in KINDS.items():
+            stored, removed = _listeners(kind)
+            event.listen(model, 'after_insert', stored)
+            event.listen(model, 'after_update', stored)
+            event.listen(model, 'after_delete', removed)
+
+    @app.cli.command('search-reindex')
+    def search_reindex():
+        """Rebuild the planets/characters search index."""
+        with db.engine.begin() as connection:
+            rebuild_search_index(connection)
+        click.echo('Search index rebuilt')
@@ -0,0 +1,77 @@
+"""
+Precompiled row serializers and the JSON backend
+
+The list endpoints select plain Core rows with the columns of each model's
+projection() and turn them into dicts with an encoder function generated once
+per field list, e.g. `lambda row: {"id": row[0], "name": row[1]}`, instead of
+building ORM objects and calling serialize() on each of them.
+"""
+import os
+from functools import lru_cache
+from flask.json.provider import DefaultJSONProvider
+from models import User, Planet, Character
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# "orjson" (when installed) or "json" for the standard library encoder
+JSON_BACKEND = os.getenv("JSON_BACKEND", "orjson")
+
+
+def compile_encoder(pairs):
+    """Build `encode(row)` returning {key: row[index]} for each (key, index)."""
+    items = ', '.join(f'{key!r}: row[{index}]' for key, index in pairs)
+    namespace = {}
+    exec(f'def encode(row):\n    return {{{items}}}\n', namespace)
+    return namespace['encode']
+
+
+@lru_cache(maxsize=256)
+def row_encoder(selected, fields):
+    # `selected` are the column labels of the row in order, `fields` the keys to output
+    return compile_encoder([(field, selected.index(field)) for field in fields])
+
+
+@lru_cache(maxsize=256)
+def row_values_encoder(selected, fields):
+    """Build `encode(row)` returning [row[index], ...] for ?shape=columns."""
+    items = ', '.join(f'row[{selected.index(field)}]' for field in fields)
+    namespace = {}
+    exec(f'def encode(row):\n    return [{items}]\n', namespace)
+    return namespace['encode']
+
+
+def selected_columns(model, fields, keys=(), extra=()):
+    """Column labels selected for `fields`: id first, then the fields, sort keys and `extra` columns."""
+    names = ['id'] + [field for field in fields if field != 'id']
+    names += [name for name, column, descending in keys if name not in names]
+    names += [name for name in extra if name not in names]
+    return tuple(names)
+
+
+class ORJSONProvider(DefaultJSONProvider):
+    def _option(self):
+        return orjson.OPT_SORT_KEYS if self.sort_keys else 0
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default, option=self._option()).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        body = orjson.dumps(obj, default=self.default, option=self._option() | orjson.OPT_APPEND_NEWLINE)
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+
+def setup_serializers(app):
+    if JSON_BACKEND == 'orjson' and orjson is not None:
+        app.json = ORJSONProvider(app)
+
+    # Compile the full-object encoders up front
+    for model in (User, Planet, Character):
+        fields = tuple(model.projection())
+        row_encoder(selected_columns(model, fields), fields)
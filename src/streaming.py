@@ -0,0 +1,52 @@
+"""
+Streaming export mode for the list endpoints (NDJSON or a streamed JSON document)
+"""
+import os
+from flask import Response, current_app, request, stream_with_context
+from pagination import field_args, filtered_query, order_by_keys, sort_args
+from serializers import row_encoder, selected_columns
+
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", 500))
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+
+def _prefers_ndjson():
+    return request.accept_mimetypes.best_match(['application/json', NDJSON_MIMETYPE]) == NDJSON_MIMETYPE
+
+
+def wants_stream():
+    # ?stream=1 or an Accept header that prefers NDJSON over JSON
+    return request.args.get('stream', '').lower() in ('1', 'true', 'yes') or _prefers_ndjson()
+
+
+def _rows(model, fields):
+    # yield_per streams the result with a server-side cursor where the driver
+    # supports it, so only one batch of rows is in memory at a time
+    keys = sort_args(model)
+    encode = row_encoder(selected_columns(model, fields, keys), fields)
+    for row in filtered_query(model, fields, keys).order_by(*order_by_keys(model, keys)).yield_per(STREAM_BATCH_SIZE):
+        yield encode(row)
+
+
+def stream_response(model):
+    """Stream every row of `model` without building the full list in memory."""
+    fields = field_args(model)
+    dumps = current_app.json.dumps
+    rows = _rows(model, fields)
+
+    if _prefers_ndjson():
+        def generate():
+            for item in rows:
+                yield dumps(item) + '\n'
+
+        return Response(stream_with_context(generate()), mimetype=NDJSON_MIMETYPE)
+
+    def generate():
+        yield '{"msg": "ok", "result": ['
+        separator = ''
+        for item in rows:
+            yield separator + dumps(item)
+            separator = ','
+        yield ']}\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/json')
@@ -1,3 +1,4 @@
+import re
 from flask import jsonify, url_for
 
 class APIException(Exception):
@@ -15,6 +16,20 @@ class APIException(Exception):
         rv['message'] = self.message
         return rv
 
+def parse_swapi_number(value, number_type=float):
+    # SWAPI sends numbers as text: "1,000" -> 1000, "0.9 standard" -> 0.9,
+    # "unknown" / "n/a" / "" -> None
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return number_type(value)
+
+    match = re.search(r'-?\d[\d,]*(\.\d+)?', str(value))
+    if match is None:
+        return None
+    number = float(match.group(0).replace(',', ''))
+    return number_type(round(number)) if number_type is int else number_type(number)
+
 def has_no_empty_params(rule):
     defaults = rule.defaults if rule.defaults is not None else ()
     arguments = rule.arguments if rule.arguments is not None else ()
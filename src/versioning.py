@@ -0,0 +1,66 @@
+"""
+Per-table version counters for the catalog tables
+
+Every flush that inserts, updates or deletes a versioned model bumps the
+matching TableVersions row inside the same transaction, so readers can tell
+whether a table changed with a single primary-key lookup. On Postgres the bump
+also sends NOTIFY catalog_versions (delivered on commit) to the processes that
+keep an in-memory copy of the catalog (catalog_snapshot.py).
+"""
+from datetime import datetime
+from itertools import chain
+from sqlalchemy import event, insert, select, text, update
+from sqlalchemy.orm import Session
+from models import db, Planet, Character, TableVersion
+
+VERSIONED_MODELS = (Planet, Character)
+NOTIFY_CHANNEL = 'catalog_versions'
+
+
+def changed_tables(session):
+    # Called from after_flush, when new/dirty/deleted still show the pre-flush state
+    tables = set()
+    for obj in chain(session.new, session.dirty, session.deleted):
+        if isinstance(obj, VERSIONED_MODELS) and (obj not in session.dirty or session.is_modified(obj)):
+            tables.add(obj.__tablename__)
+    return tables
+
+
+def bump_versions(connection, tables):
+    table = TableVersion.__table__
+    now = datetime.utcnow()
+    for name in sorted(tables):
+        result = connection.execute(
+            update(table).where(table.c.name == name).values(version=table.c.version + 1, updated_at=now)
+        )
+        if result.rowcount == 0:
+            connection.execute(insert(table).values(name=name, version=1, updated_at=now))
+    if connection.dialect.name == 'postgresql':
+        connection.execute(text(f"SELECT pg_notify('{NOTIFY_CHANNEL}', :tables)"), {'tables': ','.join(sorted(tables))})
+
+
+def versions_statement(*tables):
+    return select(TableVersion.name, TableVersion.version, TableVersion.updated_at).where(TableVersion.name.in_(tables))
+
+
+def versions_from_rows(tables, rows):
+    versions = {name: (0, None) for name in tables}
+    for name, version, updated_at in rows:
+        versions[name] = (version, updated_at)
+    return versions
+
+
+def table_versions(*tables):
+    """Return {table name: (version, updated_at)}; unknown tables are (0, None)."""
+    return versions_from_rows(tables, db.session.execute(versions_statement(*tables)))
+
+
+def _after_flush(session, flush_context):
+    tables = changed_tables(session)
+    if tables:
+        bump_versions(session.connection(), tables)
+
+
+def setup_versioning(app):
+    if not event.contains(Session, 'after_flush', _after_flush):
+        event.listen(Session, 'after_flush', _after_flush)
@@ -0,0 +1,104 @@
+"""
+Fixtures shared by the test suite
+
+The app reads DATABASE_URL at import time, so it is pointed at a throwaway
+SQLite file before `app` is imported. Every test starts from the same small
+catalog: 5 planets, 10 characters (character i lives on planet i % 5 + 1) and
+2 users without favorites.
+"""
+import contextvars
+import os
+import sys
+import tempfile
+import pytest
+from flask.testing import FlaskClient
+from sqlalchemy import event, text
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+if SRC_DIR not in sys.path:
+    sys.path.insert(0, SRC_DIR)
+
+DATABASE_PATH = os.path.join(tempfile.mkdtemp(prefix='swapi-tests-'), 'test.db')
+os.environ['DATABASE_URL'] = 'sqlite:///' + DATABASE_PATH
+os.environ['RAISE_ON_LAZY_LOAD'] = '1'
+for name in ('DATABASE_REPLICA_URL', 'CATALOG_CACHE_URL', 'CATALOG_SNAPSHOT', 'PROFILE_REQUESTS', 'METRICS_DIR'):
+    os.environ.pop(name, None)
+
+from app import app as flask_app  # noqa: E402
+import catalog_snapshot  # noqa: E402
+from cache import catalog_cache  # noqa: E402
+from compression import compressed_bodies  # noqa: E402
+from models import db, User, Planet, Character  # noqa: E402
+from pagination import _cached_counts  # noqa: E402
+from popularity import leaderboards  # noqa: E402
+from replica import replica_router  # noqa: E402
+
+
+class IsolatedClient(FlaskClient):
+    """Test client whose requests get their own app context (and `g`), as under a server."""
+
+    def open(self, *args, **kwargs):
+        # Streamed bodies are read inside that context too
+        kwargs.setdefault('buffered', True)
+        return contextvars.Context().run(super().open, *args, **kwargs)
+
+
+def seed():
+    for index in range(1, 6):
+        db.session.add(Planet(name=f'P{index}', climate='arid', terrain='desert',
+                              population=index * 1000 if index != 3 else None, diameter=1000 * index, gravity=1.0))
+    db.session.add(User(email='a@a', password='x', is_active=True))
+    db.session.add(User(email='b@b', password='x', is_active=True))
+    db.session.flush()
+    for index in range(1, 11):
+        db.session.add(Character(name=f'C{index}', home_world_id=index % 5 + 1, height=150 + index % 4 * 10,
+                                 mass=70.5))
+    db.session.commit()
+
+
+def reset_process_state():
+    # Entries keyed by table versions would match again once the tables are recreated
+    catalog_cache.local.clear()
+    catalog_cache.shared = None
+    compressed_bodies.clear()
+    leaderboards.clear()
+    _cached_counts.clear()
+    catalog_snapshot._engine = None
+    replica_router.__init__()
+
+
+@pytest.fixture(scope='session')
+def app():
+    flask_app.test_client_class = IsolatedClient
+    return flask_app
+
+
+@pytest.fixture(autouse=True)
+def database(app):
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        db.session.execute(text('DELETE FROM "SearchIndex"'))
+        db.session.commit()
+        reset_process_state()
+        seed()
+        yield db
+        db.session.remove()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def statements(database):
+    """The SQL statements run on the engine since the last `statements.clear()`."""
+    executed = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        executed.append(statement)
+
+    event.listen(database.engine, 'before_cursor_execute', record)
+    yield executed
+    event.remove(database.engine, 'before_cursor_execute', record)
@@ -0,0 +1,94 @@
+import asyncio
+import contextvars
+from urllib.parse import urlsplit
+import pytest
+import asgi
+from models import db, Planet, FavoriteSnapshot
+
+URLS = [
+    '/users', '/users/1', '/users/9', '/users?limit=1',
+    '/planets', '/planets/2', '/planets/99', '/planets/', '/planets?limit=2&sort=-population&count=exact',
+    '/planets?filter=population>1500&count=exact&fields=name', '/planets?filter=bad', '/planets?ids=3,1,99',
+    '/characters', '/characters/3', '/characters/4?include=home_world', '/characters/4?include=x',
+    '/characters?fields=name,home_world_name&limit=3', '/characters?limit=3&include=home_world',
+    '/characters?ids=2,5&include=home_world&shape=columns&fields=name', '/characters?ids=x',
+    '/favorites/1', '/favorites/9',
+    # Served by the Flask app through the WSGI adapter
+    '/planets?stream=1', '/planets/2/residents', '/planets/popular',
+]
+
+
+def call(url, headers=()):
+    parts = urlsplit(url)
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+        'path': parts.path, 'raw_path': parts.path.encode(), 'query_string': parts.query.encode(), 'root_path': '',
+        'headers': [(name.lower().encode(), value.encode()) for name, value in headers],
+        'server': ('localhost', 80), 'client': ('127.0.0.1', 1),
+    }
+    response = {'body': b''}
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            response['status'] = message['status']
+            response['headers'] = {name.decode(): value.decode() for name, value in message['headers']}
+        elif message['type'] == 'http.response.body':
+            response['body'] += message.get('body', b'')
+
+    # As under a server: outside the app context the tests run in
+    contextvars.Context().run(asyncio.run, asgi.application(scope, receive, send))
+    return response
+
+
+@pytest.fixture
+def favorites(client):
+    client.post('/favorites/planets', json={'user_id': 1, 'planet_id': 2})
+    client.post('/favorites/characters', json={'user_id': 1, 'character_id': 5})
+
+
+@pytest.mark.parametrize('url', URLS)
+def test_same_response_as_flask(client, favorites, url):
+    response = call(url)
+    expected = client.get(url)
+
+    assert response['status'] == expected.status_code
+    assert response['body'] == expected.get_data()
+    assert response['headers'].get('etag') == expected.headers.get('ETag')
+    assert response['headers']['access-control-allow-origin'] == '*'
+
+
+def test_not_modified(client):
+    etag = call('/characters/3')['headers']['etag']
+
+    response = call('/characters/3', [('If-None-Match', etag)])
+
+    assert response['status'] == 304
+    assert response['body'] == b''
+
+
+def test_writes_go_to_flask():
+    # POST is not routed to the async handlers
+    assert asgi.match_route({'type': 'http', 'method': 'POST', 'path': '/favorites/planets'}) == (None, None)
+    assert asgi.match_route({'type': 'http', 'method': 'GET', 'path': '/planets/7'}) == (asgi.get_planet, {'planet_id': 7})
+
+
+def test_stale_favorites_snapshot_is_not_written(client, favorites):
+    db.session.get(Planet, 2).name = 'Renamed'
+    db.session.commit()
+    revision = db.session.get(FavoriteSnapshot, 1).revision
+
+    response = call('/favorites/1')
+
+    assert b'Renamed' in response['body']
+    db.session.expire_all()
+    assert db.session.get(FavoriteSnapshot, 1).revision == revision
+
+
+def test_async_url():
+    assert asgi.async_database_url('sqlite:////tmp/x.db') == 'sqlite+aiosqlite:////tmp/x.db'
+    assert asgi.async_database_url('postgresql://u@h/d') == 'postgresql+asyncpg://u@h/d'
+    with pytest.raises(RuntimeError):
+        asgi.async_database_url('mysql://u@h/d')
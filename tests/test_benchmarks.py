@@ -0,0 +1,75 @@
+import random
+from sqlalchemy import func, select
+from benchmarks.compare import compare
+from benchmarks.datagen import generate, is_empty, planet_rows
+from benchmarks.routes import route_plan, run_client, taken_favorites
+from favorites import refresh_snapshots
+from models import db, Planet, Character, User, FavoritePlanet, FavoriteCharacter, FavoriteCount, FavoriteSnapshot
+
+
+def empty_database():
+    db.session.remove()
+    db.drop_all()
+    db.create_all()
+
+
+def test_same_seed_same_data():
+    assert list(planet_rows(random.Random(7), 50)) == list(planet_rows(random.Random(7), 50))
+    assert list(planet_rows(random.Random(7), 50)) != list(planet_rows(random.Random(8), 50))
+
+
+def test_generate_fills_the_tables_and_the_derived_data(client):
+    empty_database()
+    assert is_empty(db)
+
+    generate(db, planets=20, characters=60, users=8, favorites=50, seed=3)
+
+    assert [model.query.count() for model in (Planet, Character, User)] == [20, 60, 8]
+    assert FavoritePlanet.query.count() + FavoriteCharacter.query.count() == 50
+    # Bulk inserts skip the mapper events: the counters are refreshed at the end
+    residents = dict(db.session.execute(
+        select(Character.home_world_id, func.count()).group_by(Character.home_world_id)).all())
+    assert all(planet.resident_count == residents.get(planet.id, 0) for planet in Planet.query)
+    counted = db.session.execute(select(func.sum(FavoriteCount.favorites))).scalar()
+    assert counted == 50
+    assert refresh_snapshots() == 0 and FavoriteSnapshot.query.count() == 8
+    name = db.session.get(Planet, 1).name
+    assert ('planet', name) in [(item['type'], item['name']) for item in
+                                client.get('/search', query_string={'q': name}).get_json()['result']]
+
+
+def test_every_route_of_the_plan_answers(app):
+    empty_database()
+    generate(db, planets=10, characters=30, users=5, favorites=20, seed=1)
+    db.session.remove()
+
+    results = run_client(app, db, route_plan(random.Random(1), 10, 30, 5, 3))
+
+    assert {route: summary['errors'] for route, summary in results['routes'].items() if summary['errors']} == {}
+    assert results['routes']['GET /planets/<id>']['queries_per_request'] <= 2
+
+
+def test_write_routes_leave_the_favorites_as_they_were(app):
+    empty_database()
+    # Every user already has half of the planets and a third of the characters
+    generate(db, planets=4, characters=6, users=3, favorites=12, seed=2)
+    favorites = {'planet': set(db.session.query(FavoritePlanet.user_id, FavoritePlanet.planet_id)),
+                 'character': set(db.session.query(FavoriteCharacter.user_id, FavoriteCharacter.character_id))}
+    db.session.remove()
+
+    plan = route_plan(random.Random(2), 4, 6, 3, 10, taken=lambda kind, user_ids: taken_favorites(db, kind, user_ids))
+    results = run_client(app, db, plan)
+
+    assert {route: summary['errors'] for route, summary in results['routes'].items() if summary['errors']} == {}
+    assert set(db.session.query(FavoritePlanet.user_id, FavoritePlanet.planet_id)) == favorites['planet']
+    assert set(db.session.query(FavoriteCharacter.user_id, FavoriteCharacter.character_id)) == favorites['character']
+
+
+def test_compare_flags_regressions():
+    before = {'client': {'routes': {'GET /planets': {'p95_ms': 10.0, 'queries_per_request': 2}}}}
+    after = {'client': {'routes': {'GET /planets': {'p95_ms': 12.0, 'queries_per_request': 2}}}}
+
+    rows = {row['metric']: row for row in compare(before, after, threshold=10)}
+
+    assert rows['p95_ms']['change_percent'] == 20.0 and rows['p95_ms']['regression']
+    assert not rows['queries_per_request']['regression']
@@ -0,0 +1,82 @@
+import sqlite3
+import threading
+from cache import MemoryClient, catalog_cache
+from conftest import DATABASE_PATH
+from models import db, Planet
+
+
+def write_from_another_process(*statements):
+    # A write of another worker: no mapper events or cache calls in this process
+    connection = sqlite3.connect(DATABASE_PATH)
+    with connection:
+        for statement in statements:
+            connection.execute(statement)
+    connection.close()
+
+
+def test_cached_read_only_checks_the_versions(client, statements):
+    client.get('/planets/2')
+    statements.clear()
+
+    assert client.get('/planets/2').get_json()['name'] == 'P2'
+    assert len(statements) == 1 and 'TableVersions' in statements[0]
+
+
+def test_write_of_another_worker_is_seen_after_its_version_bump(client):
+    first = client.get('/planets/2')
+    assert first.get_json()['name'] == 'P2'
+
+    write_from_another_process(
+        """UPDATE "Planets" SET name = 'Elsewhere' WHERE id = 2""",
+        """UPDATE "TableVersions" SET version = version + 1 WHERE name = 'Planets'""",
+    )
+
+    response = client.get('/planets/2', headers={'If-None-Match': first.headers['ETag']})
+    assert response.status_code == 200
+    assert response.get_json()['name'] == 'Elsewhere'
+    assert response.headers['ETag'] != first.headers['ETag']
+
+
+def test_shared_backend_is_keyed_by_versions(client):
+    catalog_cache.shared = MemoryClient()
+    client.get('/planets/2')
+    # A worker with an empty LRU reads the entry of the shared backend
+    catalog_cache.local.clear()
+    shared_hits = catalog_cache.stats()['shared_hits']
+    assert client.get('/planets/2').get_json()['name'] == 'P2'
+    assert catalog_cache.stats()['shared_hits'] == shared_hits + 1
+
+    write_from_another_process(
+        """UPDATE "Planets" SET name = 'Elsewhere' WHERE id = 2""",
+        """UPDATE "TableVersions" SET version = version + 1 WHERE name = 'Planets'""",
+    )
+    assert client.get('/planets/2').get_json()['name'] == 'Elsewhere'
+
+
+def test_missing_items_are_not_cached(client):
+    assert client.get('/planets/6').status_code == 404
+
+    db.session.add(Planet(name='P6'))
+    db.session.commit()
+
+    assert client.get('/planets/6').get_json()['name'] == 'P6'
+
+
+def test_counters_add_up_across_threads():
+    versions = {'Planets': (1, None)}
+    catalog_cache.set('planets', 1, versions, {'id': 1})
+    before = catalog_cache.stats()
+
+    def lookups():
+        for index in range(2000):
+            catalog_cache.get('planets', index % 2, versions)
+
+    threads = [threading.Thread(target=lookups) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    after = catalog_cache.stats()
+    assert after['hits'] - before['hits'] == 8000
+    assert after['misses'] - before['misses'] == 8000
@@ -0,0 +1,96 @@
+import sqlite3
+import pytest
+import catalog_snapshot
+from conftest import DATABASE_PATH
+from models import db, Planet
+
+URLS = ['/planets', '/planets?limit=2', '/planets?limit=2&after=eyJpZCI6Miwia2V5cyI6W119', '/planets?count=none',
+        '/planets/3', '/planets/99', '/characters', '/characters?limit=4', '/characters/7', '/characters/99']
+
+
+def enable_snapshot(app, monkeypatch):
+    monkeypatch.setitem(app.config, 'CATALOG_SNAPSHOT', True)
+    monkeypatch.setitem(app.config, 'CATALOG_SNAPSHOT_POLL_SECONDS', 3600)
+    monkeypatch.setitem(app.config, 'CATALOG_SNAPSHOT_NOTIFY', False)
+    catalog_snapshot.setup_catalog_snapshot(app)
+    return catalog_snapshot._engine
+
+
+@pytest.fixture
+def snapshot(app, monkeypatch):
+    yield enable_snapshot(app, monkeypatch)
+    catalog_snapshot._engine = None
+
+
+def test_same_responses_as_the_database(app, client, monkeypatch):
+    expected = {url: client.get(url) for url in URLS}
+    engine = enable_snapshot(app, monkeypatch)
+
+    for url in URLS:
+        response = client.get(url)
+        assert response.status_code == expected[url].status_code, url
+        assert response.get_data() == expected[url].get_data(), url
+        assert response.headers.get('ETag') == expected[url].headers.get('ETag'), url
+    assert engine.loads == 1
+
+
+def test_reads_run_no_queries(client, snapshot, statements):
+    client.get('/planets/1')
+    statements.clear()
+
+    assert client.get('/planets/2').get_json()['name'] == 'P2'
+    assert client.get('/characters?limit=3').status_code == 200
+    assert statements == []
+
+
+def test_requests_the_snapshot_cannot_answer_use_the_database(client, snapshot):
+    body = client.get('/planets?filter=population>2500&fields=name').get_json()
+
+    assert body['result'] == [{'name': 'P4'}, {'name': 'P5'}]
+    assert client.get('/characters/4?include=home_world').get_json()['home_world']['name'] == 'P5'
+
+
+def test_own_writes_are_visible_at_once(client, snapshot):
+    client.get('/planets/2')
+
+    db.session.get(Planet, 2).name = 'Renamed'
+    db.session.commit()
+
+    assert client.get('/planets/2').get_json()['name'] == 'Renamed'
+
+
+def test_writes_of_other_workers_show_up_on_refresh(client, snapshot):
+    client.get('/planets/2')
+    connection = sqlite3.connect(DATABASE_PATH)
+    with connection:
+        connection.execute("""UPDATE "Planets" SET name = 'Elsewhere' WHERE id = 2""")
+        connection.execute("""UPDATE "TableVersions" SET version = version + 1 WHERE name = 'Planets'""")
+    connection.close()
+
+    assert snapshot.refresh() is True
+    assert snapshot.refresh() is False
+    assert client.get('/planets/2').get_json()['name'] == 'Elsewhere'
+    status = client.get('/stats/pool').get_json()['result']['catalog_snapshot']
+    assert status['loaded'] and status['planets'] == 5 and status['characters'] == 10
+
+
+def test_database_reads_use_the_database_versions(client, snapshot):
+    urls = ['/planets?fields=name', '/planets?filter=population>0', '/planets/2/residents',
+            '/characters/1?include=home_world']
+    before = {url: client.get(url).headers['ETag'] for url in urls}
+    snapshot_etag = client.get('/planets/2').headers['ETag']
+    # Another worker's write this process has not reloaded yet
+    connection = sqlite3.connect(DATABASE_PATH)
+    with connection:
+        connection.execute("""UPDATE "Planets" SET name = 'Elsewhere', population = 1 WHERE id = 2""")
+        connection.execute("""UPDATE "TableVersions" SET version = version + 1 WHERE name = 'Planets'""")
+    connection.close()
+
+    for url in urls:
+        response = client.get(url, headers={'If-None-Match': before[url]})
+        assert response.status_code == 200, url
+        assert response.headers['ETag'] != before[url], url
+    assert client.get('/planets?fields=name').get_json()['result'][1] == {'name': 'Elsewhere'}
+    # Until the reload, the snapshot answers with its own body and versions
+    response = client.get('/planets/2', headers={'If-None-Match': snapshot_etag})
+    assert response.status_code == 304
@@ -0,0 +1,119 @@
+from models import db, Planet, Character, FavoritePlanet
+
+
+def changes(client, since, **args):
+    response = client.get('/changes', query_string={'since': since, **args})
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()
+
+
+def summary(body):
+    return [(change['type'], change['id'], change['op']) for change in body['changes']]
+
+
+def test_initial_sync(client):
+    body = changes(client, 0)
+
+    assert body['reset'] is False and body['has_more'] is False
+    assert sorted(summary(body)) == sorted([('planets', index, 'insert') for index in range(1, 6)] +
+                                           [('characters', index, 'insert') for index in range(1, 11)])
+    planet = next(change for change in body['changes'] if change['type'] == 'planets' and change['id'] == 2)
+    assert planet['data'] == client.get('/planets/2').get_json()
+    # Users are only sent to themselves
+    assert ('users', 1, 'insert') in summary(changes(client, 0, user_id=1))
+    assert ('users', 2, 'insert') not in summary(changes(client, 0, user_id=1))
+
+
+def test_changes_since_a_version(client):
+    version = changes(client, 0)['version']
+
+    db.session.get(Planet, 2).name = 'Renamed'
+    db.session.commit()
+    db.session.delete(db.session.get(Character, 3))
+    db.session.commit()
+
+    body = changes(client, version)
+    # The delete also updates the resident count of its home world, in the same version
+    assert summary(body) == [('planets', 2, 'update'), ('planets', 4, 'update'), ('characters', 3, 'delete')]
+    assert body['changes'][0]['data']['name'] == 'Renamed'
+    assert body['changes'][1]['data']['resident_count'] == 1
+    assert body['changes'][1]['version'] == body['changes'][2]['version'] == body['version']
+    assert body['changes'][2]['data'] is None
+    assert changes(client, body['version'])['changes'] == []
+
+
+def test_favorites_are_scoped_to_their_user(client):
+    version = changes(client, 0)['version']
+    client.post('/favorites/planets', json={'user_id': 1, 'planet_id': 2})
+    client.post('/favorites/characters', json={'user_id': 1, 'character_id': 4})
+    client.delete('/favorites/characters', json={'user_id': 1, 'character_id': 4})
+    client.post('/favorites/batch', json={'user_id': 2, 'operations': [{'op': 'add', 'type': 'planet', 'id': 5}]})
+
+    body = changes(client, version, user_id=1)
+    assert summary(body) == [('favorite_planets', 2, 'insert'), ('favorite_characters', 4, 'delete')]
+    assert body['changes'][0]['data']['name'] == 'P2'
+    assert summary(changes(client, version, user_id=2)) == [('favorite_planets', 5, 'insert')]
+    assert changes(client, version)['changes'] == []
+
+
+def test_writes_that_change_nothing_are_not_logged(client):
+    client.post('/favorites/planets', json={'user_id': 1, 'planet_id': 2})
+    # A stale snapshot is rebuilt by the next write, which still changes no favorite
+    db.session.get(Planet, 2).name = 'Renamed'
+    db.session.commit()
+    version = changes(client, 0)['version']
+
+    client.post('/favorites/planets', json={'user_id': 1, 'planet_id': 2})
+    client.delete('/favorites/planets', json={'user_id': 1, 'planet_id': 3})
+    client.post('/favorites/batch', json={'user_id': 1, 'operations': [{'op': 'add', 'type': 'planet', 'id': 2}]})
+
+    body = changes(client, version, user_id=1)
+    assert body['changes'] == [] and body['version'] == version
+
+
+def test_orm_move_of_a_favorite(client):
+    favorite = FavoritePlanet(user_id=1, planet_id=1)
+    db.session.add(favorite)
+    db.session.commit()
+    version = changes(client, 0)['version']
+
+    favorite.planet_id = 4
+    db.session.commit()
+
+    assert summary(changes(client, version, user_id=1)) == [('favorite_planets', 1, 'delete'),
+                                                             ('favorite_planets', 4, 'insert')]
+
+
+def test_pages_end_between_versions(client):
+    for planet_id in (1, 2, 3):
+        db.session.get(Planet, planet_id).climate = 'temperate'
+        db.session.commit()
+
+    first = changes(client, 0, limit=2)
+    # The first transaction is bigger than a page and is sent whole
+    assert len(first['changes']) == 15 and first['has_more']
+    second = changes(client, first['version'], limit=2)
+    assert summary(second) == [('planets', 1, 'update'), ('planets', 2, 'update')] and second['has_more']
+    third = client.get(second['next']).get_json()
+    assert summary(third) == [('planets', 3, 'update')] and not third['has_more'] and third['next'] is None
+
+
+def test_reset_after_compaction(app, client):
+    version = changes(client, 0)['version']
+    db.session.get(Planet, 2).name = 'Renamed'
+    db.session.commit()
+
+    result = app.test_cli_runner().invoke(args=['compact-changes', '--days', '0'])
+    assert result.exit_code == 0, result.output
+
+    body = changes(client, version)
+    assert body['reset'] is True and body['changes'] == []
+    assert changes(client, body['version'])['reset'] is False
+    # A version the database never reached (restored from an older backup)
+    assert changes(client, body['version'] + 100)['reset'] is True
+
+
+def test_invalid_arguments(client):
+    assert client.get('/changes').status_code == 400
+    assert client.get('/changes?since=-1').status_code == 400
+    assert client.get('/changes?since=0&user_id=x').status_code == 400
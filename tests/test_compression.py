@@ -0,0 +1,81 @@
+import gzip
+import json
+import pytest
+from compression import compressed_bodies
+
+DECODERS = {'gzip': gzip.decompress}
+try:
+    import brotli
+    DECODERS['br'] = brotli.decompress
+except ImportError:
+    pass
+try:
+    import zstandard
+    DECODERS['zstd'] = lambda data: zstandard.ZstdDecompressor().decompressobj().decompress(data)
+except ImportError:
+    pass
+
+
+@pytest.mark.parametrize('encoding', ['gzip', 'br', 'zstd'])
+def test_round_trip(client, encoding):
+    if encoding not in DECODERS:
+        pytest.skip(f'{encoding} support is not installed')
+    identity = client.get('/characters')
+
+    response = client.get('/characters', headers={'Accept-Encoding': encoding})
+
+    assert response.headers['Content-Encoding'] == encoding
+    assert 'Accept-Encoding' in response.headers['Vary']
+    assert len(response.get_data()) < len(identity.get_data())
+    assert DECODERS[encoding](response.get_data()) == identity.get_data()
+    assert response.headers['ETag'] == identity.headers['ETag'][:-1] + f'-{encoding}"'
+
+
+def test_server_preference_breaks_ties(client, app, monkeypatch):
+    monkeypatch.setitem(app.extensions, 'compression', {'gzip': app.extensions['compression']['gzip']})
+    assert client.get('/characters', headers={'Accept-Encoding': 'br, gzip'}).headers['Content-Encoding'] == 'gzip'
+
+    monkeypatch.undo()
+    preferred = app.config['COMPRESSION_ENCODINGS'][0]
+    response = client.get('/characters', headers={'Accept-Encoding': 'gzip, br, zstd'})
+    assert response.headers['Content-Encoding'] == (preferred if preferred in DECODERS else 'gzip')
+
+
+def test_small_bodies_and_identity_are_sent_as_is(client):
+    assert 'Content-Encoding' not in client.get('/planets/1', headers={'Accept-Encoding': 'gzip'}).headers
+    assert 'Content-Encoding' not in client.get('/characters').headers
+    assert 'Content-Encoding' not in client.get('/characters', headers={'Accept-Encoding': 'identity'}).headers
+
+
+def test_compressed_etag_answers_304(client):
+    etag = client.get('/characters', headers={'Accept-Encoding': 'gzip'}).headers['ETag']
+
+    response = client.get('/characters', headers={'Accept-Encoding': 'gzip', 'If-None-Match': etag})
+
+    assert response.status_code == 304
+    assert response.headers['ETag'] == etag
+
+
+def test_compressed_bodies_are_reused(client):
+    client.get('/characters', headers={'Accept-Encoding': 'gzip'})
+    entries = len(compressed_bodies)
+
+    client.get('/characters', headers={'Accept-Encoding': 'gzip'})
+
+    assert entries == 1 and len(compressed_bodies) == 1
+
+
+def test_streams_are_compressed(client):
+    response = client.get('/characters?stream=1', headers={'Accept-Encoding': 'gzip'})
+
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert len(json.loads(gzip.decompress(response.get_data()))['result']) == 10
+
+
+def test_columns_shape(client):
+    body = client.get('/planets?shape=columns&limit=2&fields=name').get_json()
+
+    assert body['columns'] == ['name']
+    assert body['rows'] == [['P1'], ['P2']]
+    assert body['next_cursor'] is not None
+    assert client.get('/planets?shape=table').status_code == 400
@@ -0,0 +1,71 @@
+from models import db, Planet
+
+
+def test_unchanged_catalog_answers_304(client):
+    response = client.get('/planets/2')
+    etag = response.headers['ETag']
+
+    assert response.status_code == 200
+    assert response.headers['Cache-Control'] == 'no-cache'
+    assert response.last_modified is not None
+
+    not_modified = client.get('/planets/2', headers={'If-None-Match': etag})
+    assert not_modified.status_code == 304
+    assert not_modified.get_data() == b''
+    assert not_modified.headers['ETag'] == etag
+
+    since = client.get('/planets/2', headers={'If-Modified-Since': response.headers['Last-Modified']})
+    assert since.status_code == 304
+
+
+def test_etag_differs_per_url(client):
+    assert client.get('/planets/1').headers['ETag'] != client.get('/planets/2').headers['ETag']
+    assert client.get('/planets?limit=1').headers['ETag'] != client.get('/planets?limit=2').headers['ETag']
+
+
+def test_write_changes_the_etag_and_the_body(client):
+    etag = client.get('/planets/2').headers['ETag']
+    character_etag = client.get('/characters/1').headers['ETag']
+
+    db.session.get(Planet, 2).name = 'Renamed'
+    db.session.commit()
+
+    response = client.get('/planets/2', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+    assert response.get_json()['name'] == 'Renamed'
+    # Characters embed the name of their home world
+    character = client.get('/characters/1', headers={'If-None-Match': character_etag})
+    assert character.status_code == 200
+    assert character.get_json()['home_world_name'] == 'Renamed'
+
+
+def test_not_found_has_no_validators(client):
+    response = client.get('/planets/99')
+
+    assert response.status_code == 404
+    assert 'ETag' not in response.headers
+
+
+def test_cache_control_per_route(client, app):
+    app.config['CACHE_CONTROL'] = {'get_planets': 'public, max-age=60'}
+    try:
+        assert client.get('/planets').headers['Cache-Control'] == 'public, max-age=60'
+        assert client.get('/planets/1').headers['Cache-Control'] == 'no-cache'
+    finally:
+        del app.config['CACHE_CONTROL']
+
+
+def test_cached_total_follows_the_etag(client):
+    first = client.get('/planets')
+    assert first.get_json()['total_planets'] == 5
+
+    db.session.add(Planet(name='P6'))
+    db.session.commit()
+
+    response = client.get('/planets', headers={'If-None-Match': first.headers['ETag']})
+    assert response.status_code == 200
+    assert response.get_json()['total_planets'] == len(response.get_json()['result']) == 6
+    # The count of the new version is reused
+    assert client.get('/planets', headers={'If-None-Match': response.headers['ETag']}).status_code == 304
+    assert client.get('/planets?limit=1').get_json()['total_planets'] == 6
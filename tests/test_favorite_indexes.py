@@ -0,0 +1,17 @@
+import pytest
+from sqlalchemy.exc import IntegrityError
+from models import db, FavoriteCharacter
+
+
+def test_unique_index_rejects_duplicates():
+    db.session.add(FavoriteCharacter(user_id=1, character_id=2))
+    db.session.commit()
+
+    db.session.add(FavoriteCharacter(user_id=1, character_id=2))
+    with pytest.raises(IntegrityError):
+        db.session.commit()
+    db.session.rollback()
+
+    # The same item for another user is fine
+    db.session.add(FavoriteCharacter(user_id=2, character_id=2))
+    db.session.commit()
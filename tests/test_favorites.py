@@ -0,0 +1,66 @@
+import pytest
+import favorites
+from models import FavoritePlanet
+
+
+def favorite_ids(client, user_id=1):
+    result = client.get(f'/favorites/{user_id}').get_json()['result']
+    return [item['id'] for item in result['favorite_planets']], [item['id'] for item in result['favorite_characters']]
+
+
+def writes(statements):
+    return [statement for statement in statements
+            if statement.lstrip().split(None, 1)[0].upper() in ('INSERT', 'UPDATE', 'DELETE')]
+
+
+def test_add_and_remove(client):
+    response = client.post('/favorites/planets', json={'user_id': 1, 'planet_id': 2})
+    assert response.status_code == 200
+    assert [planet['name'] for planet in response.get_json()['result']['favorite_planets']] == ['P2']
+
+    client.post('/favorites/characters', json={'user_id': 1, 'character_id': 3})
+    assert favorite_ids(client) == ([2], [3])
+
+    response = client.delete('/favorites/planets', json={'user_id': 1, 'planet_id': 2})
+    assert response.status_code == 200
+    assert favorite_ids(client) == ([], [3])
+
+
+def test_duplicate_add_keeps_one_favorite(client):
+    for _ in range(2):
+        assert client.post('/favorites/planets', json={'user_id': 1, 'planet_id': 2}).status_code == 200
+
+    assert favorite_ids(client) == ([2], [])
+    assert FavoritePlanet.query.count() == 1
+
+
+def test_missing_ids_are_rejected(client):
+    response = client.post('/favorites/characters', json={'user_id': 1, 'character_id': 99})
+    assert response.status_code == 400
+    assert response.get_json()['msg'] == 'El personaje con id 99 no existe.'
+
+    response = client.post('/favorites/planets', json={'user_id': 9, 'planet_id': 1})
+    assert response.status_code == 400
+    assert response.get_json()['msg'] == 'El usuario con id 9 no existe.'
+
+    assert client.post('/favorites/planets', json={'user_id': 1}).status_code == 400
+    assert client.post('/favorites/planets').status_code == 400
+
+
+def test_removing_what_is_not_a_favorite(client):
+    response = client.delete('/favorites/planets', json={'user_id': 1, 'planet_id': 2})
+    assert response.status_code == 200
+    assert 'no está incluido' in response.get_json()['msg']
+
+    assert client.delete('/favorites/planets', json={'user_id': 9, 'planet_id': 2}).status_code == 400
+
+
+def test_add_is_one_insert(client, statements, monkeypatch):
+    # The existence checks only run when the write fails
+    monkeypatch.setattr(favorites, '_exists', lambda model, item_id: pytest.fail('existence check on success'))
+    client.post('/favorites/planets', json={'user_id': 1, 'planet_id': 1})
+    statements.clear()
+    client.post('/favorites/planets', json={'user_id': 1, 'planet_id': 2})
+
+    inserts = [statement for statement in writes(statements) if 'INSERT INTO "FavoritePlanets"' in statement]
+    assert len(inserts) == 1
@@ -0,0 +1,42 @@
+from test_favorites import favorite_ids
+
+
+def test_batch_applies_the_net_difference(client):
+    client.post('/favorites/planets', json={'user_id': 1, 'planet_id': 1})
+    response = client.post('/favorites/batch', json={'user_id': 1, 'operations': [
+        {'op': 'add', 'type': 'planet', 'id': 2},
+        {'op': 'add', 'type': 'planet', 'id': 2},
+        {'op': 'remove', 'type': 'planet', 'id': 1},
+        {'op': 'add', 'type': 'character', 'id': 5},
+        {'op': 'add', 'type': 'character', 'id': 99},
+        {'op': 'remove', 'type': 'character', 'id': 6},
+        {'op': 'drop', 'type': 'planet', 'id': 3},
+    ]})
+
+    assert response.status_code == 200
+    body = response.get_json()
+    assert [operation['status'] for operation in body['operations']] == \
+        ['added', 'unchanged', 'removed', 'added', 'not_found', 'not_favorite', 'invalid']
+    assert body['total_favorites'] == 2
+    assert favorite_ids(client) == ([2], [5])
+
+
+def test_batch_validation(client):
+    assert client.post('/favorites/batch', json={'user_id': 9, 'operations': []}).status_code == 400
+    assert client.post('/favorites/batch', json={'user_id': 1}).status_code == 400
+    assert client.post('/favorites/batch', json={'operations': []}).status_code == 400
+
+    too_many = [{'op': 'add', 'type': 'planet', 'id': 1}] * 501
+    assert client.post('/favorites/batch', json={'user_id': 1, 'operations': too_many}).status_code == 400
+
+
+def test_body_must_be_an_object_with_a_list_of_operations(client):
+    for body in ([{'user_id': 1, 'operations': []}], 'x', 1, None):
+        response = client.post('/favorites/batch', json=body)
+        assert response.status_code == 400, body
+        assert response.get_json()['msg'].startswith('Error:')
+
+    for operations in ({'op': 'add', 'type': 'planet', 'id': 1}, 'add', 1, None):
+        response = client.post('/favorites/batch', json={'user_id': 1, 'operations': operations})
+        assert response.status_code == 400, operations
+        assert response.get_json()['msg'] == 'Error: el body de la petición no incluye la lista operations'
@@ -0,0 +1,111 @@
+from favorites import dump_favorites, favorites_of, refresh_snapshots
+from models import db, Planet, Character, FavoritePlanet, FavoriteSnapshot
+from test_favorites import favorite_ids, writes
+
+
+def test_snapshot_is_served_with_one_query(client, statements):
+    client.post('/favorites/planets', json={'user_id': 1, 'planet_id': 2})
+    client.post('/favorites/characters', json={'user_id': 1, 'character_id': 4})
+    statements.clear()
+
+    response = client.get('/favorites/1')
+
+    assert len(statements) == 1
+    assert response.get_data(as_text=True).rstrip('\n') == dump_favorites(favorites_of(1))
+
+
+def test_snapshot_follows_every_write(client):
+    operations = [('post', 'planets', 'planet_id', 3), ('post', 'characters', 'character_id', 7),
+                  ('post', 'planets', 'planet_id', 1), ('delete', 'planets', 'planet_id', 3),
+                  ('post', 'characters', 'character_id', 2), ('delete', 'characters', 'character_id', 7)]
+    for method, path, key, item_id in operations:
+        getattr(client, method)(f'/favorites/{path}', json={'user_id': 1, key: item_id})
+        snapshot = db.session.get(FavoriteSnapshot, 1)
+        db.session.expire_all()
+        assert snapshot.body == dump_favorites(favorites_of(1))
+
+    assert favorite_ids(client) == ([1], [2])
+
+
+def test_stale_snapshot_read_is_read_only(client, statements):
+    client.post('/favorites/planets', json={'user_id': 1, 'planet_id': 2})
+    revision = db.session.get(FavoriteSnapshot, 1).revision
+
+    db.session.get(Planet, 2).name = 'Renamed'
+    db.session.commit()
+    statements.clear()
+
+    body = client.get('/favorites/1').get_json()
+
+    assert body['result']['favorite_planets'][0]['name'] == 'Renamed'
+    assert writes(statements) == []
+    db.session.expire_all()
+    assert db.session.get(FavoriteSnapshot, 1).revision == revision
+
+    # The next write stores a fresh snapshot
+    client.post('/favorites/planets', json={'user_id': 1, 'planet_id': 3})
+    statements.clear()
+    body = client.get('/favorites/1').get_json()
+    assert len(statements) == 1
+    assert [planet['name'] for planet in body['result']['favorite_planets']] == ['Renamed', 'P3']
+
+
+def test_orm_writes_invalidate_the_snapshot(client):
+    client.post('/favorites/planets', json={'user_id': 1, 'planet_id': 2})
+
+    db.session.add(FavoritePlanet(user_id=1, planet_id=4))
+    db.session.commit()
+
+    assert favorite_ids(client) == ([2, 4], [])
+
+
+def test_unknown_user(client):
+    assert client.get('/favorites/9').status_code == 404
+
+
+def test_numeric_string_ids_patch_the_snapshot(client):
+    client.post('/favorites/planets', json={'user_id': 1, 'planet_id': 1})
+
+    assert client.post('/favorites/planets', json={'user_id': '1', 'planet_id': '2'}).status_code == 200
+    assert favorite_ids(client) == ([1, 2], [])
+    assert client.delete('/favorites/planets', json={'user_id': 1, 'planet_id': '1'}).status_code == 200
+    assert favorite_ids(client) == ([2], [])
+
+    response = client.post('/favorites/batch', json={'user_id': '1', 'operations': [
+        {'op': 'add', 'type': 'character', 'id': '3'}, {'op': 'remove', 'type': 'planet', 'id': '2'}]})
+    assert [operation['id'] for operation in response.get_json()['operations']] == [3, 2]
+    assert favorite_ids(client) == ([], [3])
+    db.session.expire_all()
+    assert db.session.get(FavoriteSnapshot, 1).body == dump_favorites(favorites_of(1))
+
+
+def test_ids_that_are_not_integers_are_rejected(client):
+    for value in ('x', '2.5', 2.5, True, [2], {'id': 2}, -1, 2 ** 40):
+        response = client.post('/favorites/planets', json={'user_id': 1, 'planet_id': value})
+        assert response.status_code == 400, value
+        assert response.get_json()['msg'] == 'Error: la propiedad planet_id debe ser un número entero'
+        assert client.delete('/favorites/characters', json={'user_id': value, 'character_id': 1}).status_code == 400
+        assert client.post('/favorites/batch', json={'user_id': value, 'operations': []}).status_code == 400
+
+    assert favorite_ids(client) == ([], [])
+
+
+def test_refresh_rebuilds_the_snapshots_of_readers(app, client, statements):
+    client.post('/favorites/planets', json={'user_id': 1, 'planet_id': 2})
+    # Stales every snapshot: the resident count of planet 2 is in the body
+    db.session.add(Character(name='New', home_world_id=2))
+    db.session.commit()
+
+    result = app.test_cli_runner().invoke(args=['refresh-favorites', '--batch-size', '1'])
+    assert result.exit_code == 0, result.output
+    assert result.output == '2 favorites snapshots rebuilt\n'
+    assert refresh_snapshots() == 0
+
+    for user_id in (1, 2):
+        statements.clear()
+        body = client.get(f'/favorites/{user_id}').get_json()
+        assert len(statements) == 1
+    assert body['total_favorites'] == 0
+    db.session.expire_all()
+    assert db.session.get(FavoriteSnapshot, 1).body == dump_favorites(favorites_of(1))
+    assert '"resident_count":3' in db.session.get(FavoriteSnapshot, 1).body.replace(' ', '')
@@ -0,0 +1,46 @@
+from test_pagination import all_pages
+
+
+def test_filter_on_numeric_columns(client):
+    body = client.get('/planets?filter=population>=2000').get_json()
+
+    assert [planet['name'] for planet in body['result']] == ['P2', 'P4', 'P5']
+    # Totals of a filtered list are only counted on demand
+    assert 'total_planets' not in body
+    assert client.get('/planets?filter=population>=2000&count=exact').get_json()['total_planets'] == 3
+
+
+def test_filter_null(client):
+    body = client.get('/planets?filter=population=null').get_json()
+
+    assert [planet['name'] for planet in body['result']] == ['P3']
+
+
+def test_sort_descending_puts_nulls_last_across_pages(client):
+    ids = all_pages(client, '/planets?sort=-population&limit=2')
+
+    assert ids == [5, 4, 2, 1, 3]
+
+
+def test_sort_and_filter_pages_match_one_page(client):
+    url = '/characters?filter=height>160&sort=-height,name'
+    single = [item['id'] for item in client.get(url).get_json()['result']]
+
+    assert all_pages(client, url + '&limit=2') == single
+    assert single == [3, 7, 10, 2, 6]
+
+
+def test_cursor_of_another_sort_is_rejected(client):
+    cursor = client.get('/planets?limit=2').get_json()['next_cursor']
+
+    assert client.get(f'/planets?sort=-population&after={cursor}').status_code == 400
+
+
+def test_invalid_filters_are_rejected(client):
+    for expression in ('population>abc', 'population>inf', 'population<-inf', 'population=nan', 'diameter>1e30',
+                       'secret=1', 'population>null', 'name'):
+        assert client.get(f'/planets?filter={expression}').status_code == 400, expression
+
+
+def test_unknown_sort_column_is_rejected(client):
+    assert client.get('/planets?sort=secret').status_code == 400
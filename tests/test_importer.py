@@ -0,0 +1,82 @@
+import json
+import pytest
+from models import Planet, Character
+
+
+@pytest.fixture
+def dumps(tmp_path):
+    planets = tmp_path / 'planets.json'
+    planets.write_text(json.dumps([
+        {'name': 'Tatooine', 'climate': 'arid', 'terrain': 'desert', 'diameter': '10465', 'gravity': '1 standard',
+         'population': '200000', 'rotation_period': '23', 'url': 'https://swapi.dev/api/planets/1/'},
+        {'name': 'Hoth', 'climate': 'frozen', 'terrain': 'tundra', 'diameter': '7200', 'gravity': '1.1 standard',
+         'population': 'unknown', 'url': 'https://swapi.dev/api/planets/4/'},
+        {'name': 'P1', 'climate': 'already there'},
+    ]))
+    # API pages and NDJSON are read as well
+    characters = tmp_path / 'people.ndjson'
+    characters.write_text('\n'.join(json.dumps(record) for record in [
+        {'name': 'Luke Skywalker', 'height': '172', 'mass': '77', 'homeworld': 'https://swapi.dev/api/planets/1/'},
+        {'name': 'Jabba', 'height': '175', 'mass': '1,358', 'homeworld': 'Tatooine'},
+        {'name': 'Wampa', 'height': 'unknown', 'mass': 'unknown', 'homeworld': 'https://swapi.dev/api/planets/4/'},
+        {'name': 'Nobody', 'homeworld': 'https://swapi.dev/api/planets/99/'},
+    ]) + '\n')
+    pages = tmp_path / 'pages.json'
+    pages.write_text(json.dumps({'count': 1, 'next': None, 'results': [{'name': 'Beru', 'homeworld': 'P1'}]}))
+    return str(planets), str(characters), str(pages)
+
+
+def run_import(app, *args):
+    result = app.test_cli_runner().invoke(args=['import-swapi', *args])
+    assert result.exit_code == 0, result.output
+    return result.output
+
+
+def test_import_converts_and_links_rows(app, dumps):
+    planets, characters, pages = dumps
+
+    output = run_import(app, '--planets', planets, '--characters', characters, '--chunk-size', '2')
+
+    assert 'planets: 3 read, 2 inserted, 1 skipped' in output
+    assert '1 without home world' in output
+    assert '2 favorites snapshots rebuilt' in output
+    tatooine = Planet.query.filter_by(name='Tatooine').one()
+    assert (tatooine.diameter, tatooine.gravity, tatooine.population) == (10465, 1.0, 200000)
+    assert Planet.query.filter_by(name='Hoth').one().population is None
+    jabba = Character.query.filter_by(name='Jabba').one()
+    assert jabba.mass == 1358 and jabba.home_world_id == tatooine.id
+    assert Character.query.filter_by(name='Nobody').one().home_world_id is None
+    assert tatooine.resident_count == 2
+
+    run_import(app, '--characters', pages)
+    assert Character.query.filter_by(name='Beru').one().home_world_id == 1
+
+
+def test_second_run_skips_imported_rows(app, dumps):
+    planets, characters, pages = dumps
+    run_import(app, '--planets', planets, '--characters', characters)
+
+    output = run_import(app, '--planets', planets, '--characters', characters)
+
+    assert 'planets: 3 read, 0 inserted, 3 skipped' in output
+    assert 'characters: 4 read, 0 inserted, 4 skipped' in output
+    assert Character.query.count() == 14
+
+
+def test_cached_reads_see_the_import(app, client, dumps):
+    planets, characters, pages = dumps
+    before = client.get('/planets/1')
+    assert before.get_json()['resident_count'] == 2
+
+    run_import(app, '--characters', pages)
+
+    response = client.get('/planets/1', headers={'If-None-Match': before.headers['ETag']})
+    assert response.status_code == 200
+    assert response.get_json()['resident_count'] == 3
+    assert [item['name'] for item in client.get('/search?q=beru').get_json()['result']] == ['Beru']
+
+
+def test_a_file_is_required(app):
+    result = app.test_cli_runner().invoke(args=['import-swapi'])
+
+    assert result.exit_code != 0
@@ -0,0 +1,27 @@
+def test_ids_lookup_keeps_the_order_and_reports_missing(client):
+    body = client.get('/planets?ids=3,1,99').get_json()
+
+    assert [planet['id'] for planet in body['result']] == [3, 1]
+    assert body['missing'] == [99]
+
+
+def test_ids_cannot_be_combined_with_a_cursor(client):
+    assert client.get('/planets?ids=1,2&sort=name').status_code == 400
+    assert client.get('/planets?ids=1,x').status_code == 400
+
+
+def test_include_home_world(client):
+    body = client.get('/characters?include=home_world&fields=name&limit=3').get_json()
+
+    assert [(item['name'], item['home_world']['name']) for item in body['result']] == \
+        [('C1', 'P2'), ('C2', 'P3'), ('C3', 'P4')]
+
+
+def test_include_on_a_single_character(client):
+    body = client.get('/characters/4?include=home_world').get_json()
+
+    assert body['home_world']['id'] == 5 and body['home_world']['name'] == 'P5'
+
+
+def test_unknown_include_is_rejected(client):
+    assert client.get('/characters?include=films').status_code == 400
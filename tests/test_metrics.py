@@ -0,0 +1,97 @@
+import json
+import os
+import re
+from metrics import (LATENCY_BUCKETS, collect_exited, merge_snapshots, read_snapshots, render, request_metrics,
+                     write_snapshot)
+
+
+def sample(text, name, **labels):
+    if labels:
+        name += '{' + ','.join(f'{key}="{value}"' for key, value in labels.items()) + '}'
+    match = re.search('^' + re.escape(name) + r' (\S+)$', text, re.MULTILINE)
+    return float(match.group(1)) if match else 0.0
+
+
+def test_requests_are_counted_per_endpoint_and_status(client):
+    before = client.get('/metrics').get_data(as_text=True)
+    client.get('/planets/1')
+    client.get('/planets/1')
+    client.get('/planets/99')
+    response = client.get('/metrics')
+
+    assert response.status_code == 200
+    assert response.content_type.startswith('text/plain')
+    text = response.get_data(as_text=True)
+    for status, added in (('200', 2), ('404', 1)):
+        labels = {'endpoint': 'get_planet', 'method': 'GET', 'status': status}
+        assert sample(text, 'http_requests_total', **labels) - sample(before, 'http_requests_total', **labels) == added
+
+
+def test_histogram_is_cumulative(client):
+    client.get('/planets')
+    text = client.get('/metrics').get_data(as_text=True)
+
+    buckets = [sample(text, 'http_request_duration_seconds_bucket', endpoint='get_planets', le=bound)
+               for bound in LATENCY_BUCKETS + ('+Inf',)]
+    assert buckets == sorted(buckets)
+    assert buckets[-1] == sample(text, 'http_request_duration_seconds_count', endpoint='get_planets') >= 1
+    assert sample(text, 'http_response_bytes_total', endpoint='get_planets') > 0
+
+
+def test_observe_picks_the_bucket():
+    request_metrics.observe('test_endpoint', 'GET', 200, 0.03, 10)
+    buckets = request_metrics.snapshot()['buckets']['test_endpoint']
+
+    assert buckets[LATENCY_BUCKETS.index(0.05)] >= 1
+
+
+def snapshot(requests, gauge):
+    return {'requests': [['get_planets', 'GET', 200, requests]], 'buckets': {'get_planets': [requests] + [0] * 11},
+            'seconds': {'get_planets': 0.1}, 'bytes': {'get_planets': 100},
+            'counters': {'catalog_cache_hits_total': 1, 'catalog_cache_misses_total': 1},
+            'gauges': {'db_pool_checked_out{bind="default"}': gauge}}
+
+
+def test_workers_are_added_up(tmp_path):
+    write_snapshot(str(tmp_path), snapshot(3, 2))
+    # A worker that exited: its counters still count, its gauges don't
+    with open(os.path.join(tmp_path, '999999999.json'), 'w') as file:
+        json.dump(snapshot(4, 5), file)
+
+    text = render(merge_snapshots(read_snapshots(str(tmp_path))))
+
+    assert sample(text, 'http_requests_total', endpoint='get_planets', method='GET', status=200) == 7
+    assert sample(text, 'http_request_duration_seconds_count', endpoint='get_planets') == 7
+    assert sample(text, 'db_pool_checked_out', bind='default') == 2
+    assert sample(text, 'catalog_cache_hit_ratio') == 0.5
+
+
+def test_files_of_exited_workers_are_collected(tmp_path):
+    directory = str(tmp_path)
+    write_snapshot(directory, snapshot(3, 2))
+    # Two workers that exited, the second one with a pid reused by the first
+    for name, requests in (('999999999-1.json', 4), ('999999999-2.json', 5)):
+        with open(os.path.join(directory, name), 'w') as file:
+            json.dump(snapshot(requests, 7), file)
+    before = render(merge_snapshots(read_snapshots(directory)))
+
+    assert collect_exited(directory) == 2
+    assert collect_exited(directory, [999999999]) == 0
+    assert sorted(name for name in os.listdir(directory) if not name.startswith(str(os.getpid()))) == ['exited.json']
+    text = render(merge_snapshots(read_snapshots(directory)))
+    assert text == before
+    assert sample(text, 'http_requests_total', endpoint='get_planets', method='GET', status=200) == 12
+    assert sample(text, 'db_pool_checked_out', bind='default') == 2
+
+    # The next worker that exits is added to the same file
+    with open(os.path.join(directory, '999999998-3.json'), 'w') as file:
+        json.dump(snapshot(1, 7), file)
+    assert collect_exited(directory, [999999998]) == 1
+    text = render(merge_snapshots(read_snapshots(directory)))
+    assert sample(text, 'http_requests_total', endpoint='get_planets', method='GET', status=200) == 13
+
+
+def test_disabled_metrics(client, app, monkeypatch):
+    monkeypatch.setitem(app.config, 'METRICS_ENABLED', False)
+
+    assert client.get('/metrics').status_code == 404
@@ -0,0 +1,49 @@
+from urllib.parse import parse_qs, urlsplit
+
+
+def all_pages(client, url):
+    ids = []
+    while url is not None:
+        response = client.get(url)
+        assert response.status_code == 200, response.get_json()
+        body = response.get_json()
+        ids += [item['id'] for item in body['result']]
+        url = body['next']
+    return ids
+
+
+def test_next_links_walk_every_row_once(client):
+    assert all_pages(client, '/characters?limit=3') == list(range(1, 11))
+    assert all_pages(client, '/planets?limit=2') == [1, 2, 3, 4, 5]
+
+
+def test_next_link_keeps_the_query_arguments(client):
+    body = client.get('/planets?limit=2&fields=name').get_json()
+
+    assert body['total_planets'] == 5
+    args = parse_qs(urlsplit(body['next']).query)
+    assert args['limit'] == ['2'] and args['fields'] == ['name'] and args['after'] == [body['next_cursor']]
+
+
+def test_fields_project_the_columns(client):
+    body = client.get('/characters?fields=name,height&limit=2').get_json()
+
+    assert body['result'] == [{'name': 'C1', 'height': 160}, {'name': 'C2', 'height': 170}]
+
+
+def test_unknown_field_is_rejected(client):
+    assert client.get('/planets?fields=name,secret').status_code == 400
+
+
+def test_invalid_cursor_is_rejected(client):
+    assert client.get('/planets?after=not-a-cursor').status_code == 400
+
+
+def test_count_none_leaves_the_total_out(client):
+    body = client.get('/planets?count=none').get_json()
+
+    assert 'total_planets' not in body
+
+
+def test_users_are_paginated(client):
+    assert all_pages(client, '/users?limit=1') == [1, 2]
@@ -0,0 +1,71 @@
+import pytest
+from sqlalchemy import create_engine, exc
+from pool import InstrumentedQueuePool, engine_options, instrument_engine, pool_settings, pool_status
+
+
+def test_pool_is_capped_to_a_share_of_the_connection_budget(monkeypatch):
+    monkeypatch.setenv('DB_MAX_CONNECTIONS', '20')
+    monkeypatch.setenv('DB_RESERVED_CONNECTIONS', '4')
+
+    assert pool_settings(workers=1)['pool_size'] == 5 and pool_settings(workers=1)['max_overflow'] == 10
+    # (20 - 4) // 4 = 4 connections per worker
+    settings = pool_settings(workers=4)
+    assert settings['pool_size'] == 4 and settings['max_overflow'] == 0
+    assert pool_settings(workers=100)['pool_size'] == 1
+
+
+def test_engine_options(monkeypatch):
+    monkeypatch.setenv('DB_STATEMENT_TIMEOUT_MS', '250')
+
+    assert engine_options('sqlite:////tmp/x.db') == {}
+    options = engine_options('postgresql://u@h/d')
+    assert options['poolclass'] is InstrumentedQueuePool
+    assert options['connect_args'] == {'options': '-c statement_timeout=250'}
+    async_options = engine_options('postgresql+asyncpg://u@h/d', instrumented=False)
+    assert 'poolclass' not in async_options
+    assert async_options['connect_args'] == {'server_settings': {'statement_timeout': '250'}}
+
+
+def test_checkouts_and_timeouts_are_counted(tmp_path):
+    engine = create_engine(f'sqlite:///{tmp_path}/pool.db', poolclass=InstrumentedQueuePool,
+                           pool_size=1, max_overflow=0, pool_timeout=0.05)
+    stats = instrument_engine(engine, 'test')
+    other = create_engine(f'sqlite:///{tmp_path}/other.db', poolclass=InstrumentedQueuePool)
+    other_stats = instrument_engine(other, 'other')
+
+    with engine.connect():
+        with pytest.raises(exc.TimeoutError):
+            engine.connect()
+        status = pool_status(engine)
+        assert status['pool'] == 'InstrumentedQueuePool' and status['bind'] == 'test'
+        assert status['checked_out'] == 1 and status['size'] == 1
+    other.connect().close()
+
+    after = stats.snapshot()
+    assert after['timeouts'] == 1 and after['checkouts'] == 1 and after['checkins'] == 1
+    assert after['wait_ms_max'] >= 50
+    # Each engine has its own counters
+    assert other_stats.snapshot()['checkouts'] == 1 and other_stats.snapshot()['timeouts'] == 0
+
+    # dispose() replaces the pool, the counting goes on
+    engine.dispose()
+    engine.connect().close()
+    assert stats.snapshot()['checkouts'] == 2
+    engine.dispose()
+    other.dispose()
+
+
+def test_stats_endpoint(client):
+    result = client.get('/stats/pool').get_json()['result']
+
+    assert {'pool', 'connects', 'checkouts', 'checkins', 'timeouts', 'wait_ms_avg'} <= set(result)
+    assert result['bind'] == 'default'
+    assert result['replica'] is None and result['catalog_snapshot'] is None
+
+
+def test_pool_metrics_are_labelled_by_bind(client):
+    client.get('/planets/1')
+    text = client.get('/metrics').get_data(as_text=True)
+
+    assert 'db_pool_checkouts_total{bind="default"}' in text
+    assert text.count('# TYPE db_pool_checkouts_total counter') == 1
@@ -0,0 +1,85 @@
+from sqlalchemy import text
+from models import db, FavoritePlanet, FavoriteCharacter
+from popularity import leaderboards, reconcile_counts
+
+
+def add(client, user_id, planet_id):
+    response = client.post('/favorites/planets', json={'user_id': user_id, 'planet_id': planet_id})
+    assert response.status_code == 200, response.get_json()
+
+
+def popular(client, url):
+    # Leaderboards are kept for POPULAR_CACHE_SECONDS
+    leaderboards.clear()
+    return [(entry['rank'], entry['favorites'], entry.get('planet', entry.get('character'))['name'])
+            for entry in client.get(url).get_json()['result']]
+
+
+def stored_counts(kind):
+    rows = db.session.execute(text('SELECT item_id, favorites FROM "FavoriteCounts" WHERE kind = :kind'),
+                              {'kind': kind})
+    return {item_id: favorites for item_id, favorites in rows if favorites}
+
+
+def test_counts_follow_the_favorites_service(client):
+    add(client, 1, 2)
+    add(client, 2, 2)
+    add(client, 1, 4)
+    client.post('/favorites/batch', json={'user_id': 2, 'operations': [
+        {'op': 'add', 'type': 'planet', 'id': 4}, {'op': 'add', 'type': 'planet', 'id': 1},
+        {'op': 'add', 'type': 'character', 'id': 3}]})
+    client.delete('/favorites/planets', json={'user_id': 2, 'planet_id': 1})
+    # Neither changes a favorite
+    add(client, 1, 2)
+    client.delete('/favorites/planets', json={'user_id': 1, 'planet_id': 5})
+
+    assert stored_counts('planet') == {2: 2, 4: 2}
+    # Ties go to the newest item
+    assert popular(client, '/planets/popular') == [(1, 2, 'P4'), (2, 2, 'P2')]
+    body = client.get('/characters/popular').get_json()
+    assert body['total'] == 1 and body['result'][0]['character'] == client.get('/characters/3').get_json()
+
+
+def test_limit_is_capped(app, client, monkeypatch):
+    for planet_id in (1, 2, 3):
+        add(client, 1, planet_id)
+    monkeypatch.setitem(app.config, 'POPULAR_TOP_K', 2)
+
+    assert len(popular(client, '/planets/popular?limit=1')) == 1
+    assert len(popular(client, '/planets/popular?limit=50')) == 2
+    assert len(popular(client, '/planets/popular?limit=0')) == 1
+
+
+def test_orm_writes_adjust_the_counts(client):
+    favorite = FavoritePlanet(user_id=1, planet_id=1)
+    db.session.add_all([favorite, FavoritePlanet(user_id=2, planet_id=1), FavoriteCharacter(user_id=1, character_id=5)])
+    db.session.commit()
+    assert stored_counts('planet') == {1: 2}
+
+    favorite.planet_id = 3
+    db.session.commit()
+    assert stored_counts('planet') == {1: 1, 3: 1}
+
+    db.session.delete(favorite)
+    db.session.commit()
+    assert stored_counts('planet') == {1: 1}
+    assert popular(client, '/characters/popular') == [(1, 1, 'C5')]
+
+
+def test_reconcile_fixes_drift(app, client):
+    add(client, 1, 2)
+    add(client, 2, 2)
+    add(client, 1, 3)
+    db.session.execute(text("""UPDATE "FavoriteCounts" SET favorites = 7 WHERE item_id = 2"""))
+    db.session.execute(text("""DELETE FROM "FavoriteCounts" WHERE item_id = 3"""))
+    db.session.execute(text("""INSERT INTO "FavoriteCounts" (kind, item_id, favorites) VALUES ('character', 9, 4)"""))
+    db.session.commit()
+
+    result = app.test_cli_runner().invoke(args=['reconcile-popularity'])
+    assert result.exit_code == 0, result.output
+    assert 'planet: 2 counters corrected, character: 1 counters corrected' in result.output
+
+    assert stored_counts('planet') == {2: 2, 3: 1} and stored_counts('character') == {}
+    assert popular(client, '/planets/popular') == [(1, 2, 'P2'), (2, 1, 'P3')]
+    with db.engine.begin() as connection:
+        assert reconcile_counts(connection) == {'planet': 0, 'character': 0}
@@ -0,0 +1,73 @@
+import json
+import logging
+import pytest
+from flask import g
+from sqlalchemy import event, exc, select, text
+from sqlalchemy.engine import Engine
+import profiler
+from models import db, Planet
+
+
+@pytest.fixture
+def profile(app):
+    # The listeners are only installed with PROFILE_REQUESTS=1
+    event.listen(Engine, 'before_cursor_execute', profiler._before_cursor_execute)
+    event.listen(Engine, 'after_cursor_execute', profiler._after_cursor_execute)
+    try:
+        with app.test_request_context('/planets'):
+            g._request_profile = profiler.RequestProfile()
+            yield g._request_profile
+    finally:
+        event.remove(Engine, 'before_cursor_execute', profiler._before_cursor_execute)
+        event.remove(Engine, 'after_cursor_execute', profiler._after_cursor_execute)
+
+
+def test_statements_are_counted_and_timed(profile):
+    db.session.execute(select(Planet.name)).all()
+    db.session.execute(select(Planet.id)).all()
+
+    assert profile.statements == 2
+    assert profile.db_seconds > 0
+
+
+def test_failed_statement_is_not_recorded(profile):
+    with pytest.raises(exc.OperationalError):
+        db.session.execute(text('SELECT * FROM "Missing"'))
+    db.session.rollback()
+    db.session.execute(select(Planet.name)).all()
+
+    assert profile.statements == 1
+    assert list(profile.executions) == [str(select(Planet.name).compile(db.engine))]
+
+
+def test_n_plus_one_needs_distinct_parameters(profile):
+    for planet_id in range(1, 6):
+        db.session.execute(select(Planet.name).where(Planet.id == planet_id)).all()
+    for _ in range(5):
+        db.session.execute(select(Planet.name).where(Planet.id == 1)).all()
+
+    n_plus_one = profile.n_plus_one(5)
+    assert len(n_plus_one) == 1
+    assert n_plus_one[0]['count'] == 10 and n_plus_one[0]['distinct_parameters'] == 5
+
+
+def test_slow_statements(profile, app, monkeypatch):
+    monkeypatch.setitem(app.config, 'PROFILE_SLOW_QUERY_MS', 0)
+    db.session.execute(select(Planet.name)).all()
+
+    assert len(profile.slow_queries) == 1
+
+
+def test_report_and_server_timing(profile, app, monkeypatch, caplog):
+    monkeypatch.setitem(app.config, 'PROFILE_SLOW_MS', 0)
+    monkeypatch.setitem(app.config, 'PROFILE_SERVER_TIMING', True)
+    db.session.execute(select(Planet.name)).all()
+    monkeypatch.setattr(profiler.logger, 'propagate', True)
+
+    with caplog.at_level(logging.WARNING, logger='profiler'):
+        response = profiler._finish_profile(app.response_class('{}'))
+
+    timings = response.headers.getlist('Server-Timing')
+    assert timings[0].startswith('db;dur=') and timings[0].endswith('desc="1 queries"')
+    entry = json.loads(caplog.records[-1].getMessage())
+    assert entry['event'] == 'slow_request' and entry['db_statements'] == 1 and entry['path'] == '/planets'
@@ -0,0 +1,86 @@
+import sqlite3
+import pytest
+from sqlalchemy import create_engine
+from conftest import DATABASE_PATH
+from models import db
+from pool import instrument_engine
+from replica import replica_router
+
+
+def execute(path, *statements):
+    connection = sqlite3.connect(path)
+    with connection:
+        for statement in statements:
+            connection.execute(statement)
+    connection.close()
+
+
+def planet_name(client, planet_id=1):
+    # Lists are not cached, so the name tells which database answered
+    return client.get(f'/planets?ids={planet_id}').get_json()['result'][0]['name']
+
+
+@pytest.fixture
+def replica(app, tmp_path):
+    # A copy of the primary whose rows can be told apart
+    path = str(tmp_path / 'replica.db')
+    source, copy = sqlite3.connect(DATABASE_PATH), sqlite3.connect(path)
+    source.backup(copy)
+    source.close()
+    copy.close()
+    execute(path, """UPDATE "Planets" SET name = name || ' (replica)'""")
+
+    engine = create_engine(f'sqlite:///{path}')
+    instrument_engine(engine, 'replica')
+    db.engines['replica'] = engine
+    yield path
+    del db.engines['replica']
+    engine.dispose()
+
+
+def test_get_reads_from_the_replica(client, replica):
+    assert planet_name(client) == 'P1 (replica)'
+    assert replica_router.replica_reads > 0
+    result = client.get('/stats/pool').get_json()['result']
+    assert result['replica']['lag_seconds'] == 0.0
+    # The replica's connections are counted in its own pool stats only
+    assert result['bind'] == 'default' and result['replica']['pool']['bind'] == 'replica'
+    assert result['replica']['pool']['checkouts'] > 0
+
+
+def test_reads_after_a_write_stay_on_the_primary(client, replica):
+    assert client.post('/favorites/planets', json={'user_id': 1, 'planet_id': 2}).status_code == 200
+
+    assert planet_name(client) == 'P1'
+
+
+def test_lagging_replica_is_skipped(client, app, replica, monkeypatch):
+    monkeypatch.setitem(app.config, 'REPLICA_MAX_LAG_SECONDS', 60)
+    monkeypatch.setitem(app.config, 'REPLICA_LAG_CHECK_SECONDS', 0)
+    assert planet_name(client) == 'P1 (replica)'
+
+    # The primary moves on while the replica stopped applying changes an hour ago
+    execute(DATABASE_PATH, """UPDATE "TableVersions" SET version = version + 1 WHERE name = 'Planets'""")
+    execute(replica, """UPDATE "TableVersions" SET updated_at = datetime('now', '-1 hour')""")
+
+    assert planet_name(client) == 'P1'
+    assert replica_router.lag > 60
+
+
+def test_use_primary_views(client, replica):
+    execute(DATABASE_PATH, 'INSERT INTO "FavoritePlanets" (user_id, planet_id) VALUES (1, 3)')
+
+    body = client.get('/favorites/1').get_json()
+
+    assert [planet['name'] for planet in body['result']['favorite_planets']] == ['P3']
+
+
+def test_unreachable_replica_falls_back(client, tmp_path):
+    engine = create_engine(f'sqlite:///{tmp_path}/missing/replica.db')
+    db.engines['replica'] = engine
+    try:
+        assert planet_name(client) == 'P1'
+        assert client.get('/stats/pool').get_json()['result']['replica']['error'] == 'OperationalError'
+    finally:
+        del db.engines['replica']
+        engine.dispose()
@@ -0,0 +1,72 @@
+from sqlalchemy import text
+from models import db, Planet, Character
+from residents import refresh_resident_counts
+
+
+def resident_counts():
+    db.session.expire_all()
+    return {planet.id: planet.resident_count for planet in Planet.query.order_by(Planet.id)}
+
+
+def test_residents_are_paginated_by_id(client):
+    body = client.get('/planets/2/residents?limit=1&fields=name').get_json()
+
+    assert body['result'] == [{'name': 'C1'}]
+    assert body['total_residents'] == 2
+    assert client.get(body['next']).get_json()['result'] == [{'name': 'C6'}]
+
+
+def test_unknown_planet(client):
+    assert client.get('/planets/99/residents').status_code == 404
+    assert client.get('/planets/1/residents').get_json()['total_residents'] == 2
+
+
+def test_counts_follow_inserts_moves_and_deletes(client):
+    assert resident_counts() == {1: 2, 2: 2, 3: 2, 4: 2, 5: 2}
+
+    db.session.add(Character(name='New', home_world_id=1))
+    db.session.commit()
+    character = db.session.get(Character, 1)
+    character.home_world_id = 3
+    db.session.commit()
+    db.session.delete(db.session.get(Character, 2))
+    db.session.commit()
+    homeless = db.session.get(Character, 4)
+    homeless.home_world_id = None
+    db.session.commit()
+
+    assert resident_counts() == {1: 3, 2: 1, 3: 2, 4: 2, 5: 1}
+    body = client.get('/planets/3/residents').get_json()
+    assert [item['name'] for item in body['result']] == ['C1', 'C7']
+
+
+def test_move_of_an_expired_character(client):
+    character = db.session.get(Character, 1)
+    db.session.commit()
+    # Expired by the commit: the old home world has to be loaded before the change
+    character.home_world_id = 5
+    db.session.commit()
+
+    assert resident_counts() == {1: 2, 2: 1, 3: 2, 4: 2, 5: 3}
+
+
+def test_refresh_fixes_drift(client):
+    db.session.execute(text('UPDATE "Planets" SET resident_count = 42'))
+    db.session.commit()
+
+    with db.engine.begin() as connection:
+        refresh_resident_counts(connection)
+
+    assert resident_counts() == {1: 2, 2: 2, 3: 2, 4: 2, 5: 2}
+
+
+def test_count_is_served_with_the_etag_of_both_tables(client):
+    etag = client.get('/planets/2/residents').headers['ETag']
+
+    db.session.add(Character(name='New', home_world_id=2))
+    db.session.commit()
+
+    response = client.get('/planets/2/residents', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.get_json()['total_residents'] == 3
+    assert client.get('/planets/2').get_json()['resident_count'] == 3
@@ -0,0 +1,70 @@
+import ast
+import os
+from alembic.autogenerate import compare_metadata
+from alembic.migration import MigrationContext
+from models import db, Planet, Character
+
+ENV_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'migrations', 'env.py')
+
+
+def search(client, query, **args):
+    response = client.get('/search', query_string={'q': query, **args})
+    assert response.status_code == 200
+    return [(item['type'], item['name']) for item in response.get_json()['result']]
+
+
+def test_prefix_search_on_names(client):
+    assert search(client, 'p3') == [('planet', 'P3')]
+    assert search(client, 'c1') == [('character', 'C1'), ('character', 'C10')]
+
+
+def test_search_on_attributes_and_type(client):
+    db.session.get(Planet, 4).climate = 'frozen'
+    db.session.get(Character, 2).eye_color = 'frozen blue'
+    db.session.commit()
+
+    assert sorted(search(client, 'froz')) == [('character', 'C2'), ('planet', 'P4')]
+    assert search(client, 'froz', type='planet') == [('planet', 'P4')]
+    # Every term has to match
+    assert search(client, 'frozen blue') == [('character', 'C2')]
+
+
+def test_index_follows_renames_and_deletes(client):
+    character = db.session.get(Character, 5)
+    character.name = 'Wicket'
+    db.session.commit()
+    assert search(client, 'wick') == [('character', 'Wicket')]
+    assert search(client, 'c5') == []
+
+    db.session.delete(character)
+    db.session.commit()
+    assert search(client, 'wick') == []
+
+
+def test_limit_and_validation(client):
+    assert len(search(client, 'c', limit=3)) == 3
+    assert client.get('/search').status_code == 400
+    assert client.get('/search?q=p&type=film').status_code == 400
+
+
+def include_object():
+    # env.py runs its migrations on import, so only the function is loaded
+    module = ast.parse(open(ENV_PATH).read())
+    function = next(node for node in module.body if isinstance(node, ast.FunctionDef) and node.name == 'include_object')
+    namespace = {}
+    exec(compile(ast.Module(body=[function], type_ignores=[]), ENV_PATH, 'exec'), namespace)
+    return namespace['include_object']
+
+
+def dropped_tables(diffs):
+    return [diff[1].name for diff in diffs if diff[0] == 'remove_table']
+
+
+def test_autogenerate_leaves_the_search_index_alone():
+    with db.engine.connect() as connection:
+        plain = compare_metadata(MigrationContext.configure(connection), db.metadata)
+        filtered = compare_metadata(MigrationContext.configure(connection, opts={'include_object': include_object()}),
+                                    db.metadata)
+
+    assert 'SearchIndex' in dropped_tables(plain)
+    assert dropped_tables(filtered) == []
@@ -0,0 +1,30 @@
+def add_favorites(client):
+    for planet_id in (1, 2, 3):
+        assert client.post('/favorites/planets', json={'user_id': 1, 'planet_id': planet_id}).status_code == 200
+    for character_id in (4, 5, 6, 7):
+        assert client.post('/favorites/characters', json={'user_id': 1, 'character_id': character_id}).status_code == 200
+
+
+def test_characters_list_query_count_does_not_grow_with_rows(client, statements):
+    client.get('/characters?limit=2&count=none')
+    few = len(statements)
+    statements.clear()
+    client.get('/characters?limit=10&count=none')
+
+    assert len(statements) == few
+
+
+def test_favorites_query_count_does_not_grow_with_favorites(client, statements):
+    client.post('/favorites/planets', json={'user_id': 2, 'planet_id': 1})
+    statements.clear()
+    client.get('/favorites/2')
+    one = len(statements)
+
+    add_favorites(client)
+    statements.clear()
+    body = client.get('/favorites/1').get_json()
+
+    assert len(statements) == one
+    assert body['total_favorites'] == 7
+    assert [planet['name'] for planet in body['result']['favorite_planets']] == ['P1', 'P2', 'P3']
+    assert body['result']['favorite_characters'][0]['home_world_name'] == 'P5'
@@ -0,0 +1,14 @@
+from models import Planet, Character, eager_query
+
+
+def test_characters_list_matches_serialize(client):
+    body = client.get('/characters').get_json()
+
+    expected = [character.serialize() for character in eager_query(Character).order_by(Character.id)]
+    assert body['result'] == expected
+    assert body['result'][0]['home_world_name'] == 'P2'
+
+
+def test_planet_and_character_bodies_match_serialize(client):
+    assert client.get('/planets/3').get_json() == Planet.query.get(3).serialize()
+    assert client.get('/characters/3').get_json() == eager_query(Character).get(3).serialize()
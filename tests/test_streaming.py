@@ -0,0 +1,32 @@
+import json
+import streaming
+
+
+def test_stream_returns_every_row_as_one_document(client, monkeypatch):
+    # Fetched a few rows at a time
+    monkeypatch.setattr(streaming, 'STREAM_BATCH_SIZE', 3)
+    response = client.get('/characters?stream=1')
+
+    assert response.mimetype == 'application/json'
+    body = json.loads(response.get_data())
+    assert body['result'] == client.get('/characters').get_json()['result']
+
+
+def test_ndjson_is_negotiated_by_accept(client):
+    response = client.get('/planets', headers={'Accept': 'application/x-ndjson'})
+
+    assert response.mimetype == 'application/x-ndjson'
+    lines = response.get_data(as_text=True).splitlines()
+    assert [json.loads(line)['name'] for line in lines] == ['P1', 'P2', 'P3', 'P4', 'P5']
+
+
+def test_stream_applies_fields_filter_and_sort(client):
+    response = client.get('/planets?stream=1&fields=name&filter=population!=null&sort=-population')
+
+    assert json.loads(response.get_data())['result'] == [{'name': name} for name in ('P5', 'P4', 'P2', 'P1')]
+
+
+def test_stream_of_an_empty_filter(client):
+    response = client.get('/planets?stream=1&filter=population>1000000')
+
+    assert json.loads(response.get_data()) == {'msg': 'ok', 'result': []}